@@ -1,8 +1,28 @@
 from app import create_app
-from app.cli import create_admin
+from app.cli import create_admin, check_query_plans, check_query_budgets, rebuild_stats, rebuild_rollups, \
+    run_webhooks, expire_transactions, purge_idempotency_keys, archive_transactions, export_transactions, bulk_import, \
+    commission_schedule, reprice_transactions, sync_replica, snapshot_balances, check_ledger, check_async_api, \
+    check_replica_sync
 
 app = create_app()
 app.cli.add_command(create_admin)
+app.cli.add_command(check_query_plans)
+app.cli.add_command(check_query_budgets)
+app.cli.add_command(rebuild_stats)
+app.cli.add_command(rebuild_rollups)
+app.cli.add_command(run_webhooks)
+app.cli.add_command(expire_transactions)
+app.cli.add_command(purge_idempotency_keys)
+app.cli.add_command(archive_transactions)
+app.cli.add_command(export_transactions)
+app.cli.add_command(bulk_import)
+app.cli.add_command(commission_schedule)
+app.cli.add_command(reprice_transactions)
+app.cli.add_command(sync_replica)
+app.cli.add_command(snapshot_balances)
+app.cli.add_command(check_ledger)
+app.cli.add_command(check_async_api)
+app.cli.add_command(check_replica_sync)
 
 if __name__ == '__main__':
     app.run(debug=True)
@@ -2,32 +2,80 @@ from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
 from flasgger import Swagger
+from .config import config_by_name
+from .replica import REPLICA_BIND, RoutingSession
 import os
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 migrate = Migrate()
-celery = None
 
-def create_app():
+def create_app(test_config=None, config_name=None):
     app = Flask(__name__)
-    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///app.db'
-    app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'secret-key')
-    app.config['SWAGGER'] = {
-        'title': 'Transaction API',
-        'uiversion': 3
-    }
-    app.config['SESSION_TYPE'] = 'filesystem'
-
-    global celery
+    # Профиль конфигурации: development (по умолчанию), testing или production
+    config_name = config_name or os.environ.get('APP_ENV', 'development')
+    app.config.from_object(config_by_name[config_name])
+    if test_config:
+        app.config.update(test_config)
+    if app.config['REPLICA_DATABASE_URL']:
+        app.config['SQLALCHEMY_BINDS'] = {**app.config.get('SQLALCHEMY_BINDS', {}),
+                                          REPLICA_BIND: app.config['REPLICA_DATABASE_URL']}
 
     db.init_app(app)
     migrate.init_app(app, db)
 
+    from .engine import configure_engines
+    configure_engines(app)
+
     Swagger(app)
 
-    from .routes import dashboard, users, transactions
+    from .money import format_money
+    app.add_template_filter(format_money, 'money')
+
+    from .routes import dashboard, users, transactions, analytics
     app.register_blueprint(dashboard.bp)
     app.register_blueprint(users.bp)
     app.register_blueprint(transactions.bp)
+    app.register_blueprint(analytics.bp)
+
+    if app.config['METRICS_ENABLED']:
+        from .metrics import init_metrics
+        from .routes import metrics
+        init_metrics(app)
+        app.register_blueprint(metrics.bp)
+
+    # Поток уведомлений стартует только с первым подписчиком /dashboard/stream
+    from .notifier import DashboardNotifier
+    app.extensions['dashboard_notifier'] = DashboardNotifier.from_config(app)
+
+    from .idempotency import IdempotencyStore
+    app.extensions['idempotency_store'] = IdempotencyStore.from_config(app)
+
+    if app.config['CACHE_ENABLED']:
+        from .cache import TransactionCache
+        app.extensions['transaction_cache'] = TransactionCache.from_config(app)
+
+    # Все записи из обработчиков запросов идут через один поток-писатель с групповым коммитом
+    if app.config['WRITE_COALESCING']:
+        from .writer import WriteCoalescer
+        app.extensions['write_coalescer'] = WriteCoalescer.from_config(app).start()
+
+    # Доставка вебхуков в фоновом потоке этого процесса (иначе - отдельным процессом `flask run-webhooks`)
+    if app.config['WEBHOOK_DISPATCHER_ENABLED']:
+        from .webhooks import WebhookDispatcher
+        app.extensions['webhook_dispatcher'] = WebhookDispatcher.from_config(app).start()
+
+    if app.config['REPLICA_DATABASE_URL']:
+        from .replica import init_replica, ReplicaSync
+        init_replica(app)
+        if app.config['REPLICA_SYNC_INTERVAL'] > 0:
+            app.extensions['replica_sync'] = ReplicaSync.from_config(app).start()
+
+    if app.config['EXPIRY_SWEEP_INTERVAL'] > 0:
+        from .expiry import ExpirySweeper
+        app.extensions['expiry_sweeper'] = ExpirySweeper.from_config(app).start()
+
+    if app.config['LEDGER_SNAPSHOT_INTERVAL'] > 0:
+        from .ledger import BalanceSnapshotter
+        app.extensions['balance_snapshotter'] = BalanceSnapshotter.from_config(app).start()
 
     return app
@@ -0,0 +1,115 @@
+from datetime import datetime, timedelta
+from sqlalchemy import func, literal, select
+from app import db
+from app.models import Transaction, ArchivedTransaction, TransactionRollup
+from app.archive import across_tiers
+from app.money import to_major
+
+PERIOD_LENGTH = {'hour': timedelta(hours=1), 'day': timedelta(days=1)}
+# Окно по умолчанию и максимальное число интервалов в одном ответе
+DEFAULT_BUCKETS = {'hour': 48, 'day': 30}
+MAX_BUCKETS = {'hour': 24 * 31, 'day': 366 * 3}
+
+
+def bucket_expression(period, column, dialect_name):
+    if dialect_name == 'postgresql':
+        return func.date_trunc(period, column)
+    # SQLite хранит DateTime строкой 'YYYY-MM-DD HH:MM:SS.ffffff' - начало интервала в том же формате,
+    # чтобы строки совпадали с теми, что пишет TransactionRollup.apply
+    fmt = '%Y-%m-%d %H:00:00.000000' if period == 'hour' else '%Y-%m-%d 00:00:00.000000'
+    return func.strftime(fmt, column)
+
+
+def rollup_bounds():
+    # Диапазон и сырых данных (с архивом), и агрегатов: агрегаты удаленных транзакций тоже должны быть пересчитаны
+    bounds = [
+        db.session.execute(select(func.min(column), func.max(column))).one()
+        for column in (Transaction.created_at, ArchivedTransaction.created_at, TransactionRollup.bucket)
+    ]
+    starts = [start for start, _ in bounds if start is not None]
+    ends = [end for _, end in bounds if end is not None]
+    if not starts:
+        return None, None
+    return min(starts), max(ends) + PERIOD_LENGTH['day']
+
+
+def rebuild_rollups(since=None, until=None):
+    # Пересчет агрегатов по сырым данным посуточно: на каждые сутки - удаление и INSERT ... SELECT GROUP BY
+    # по индексу created_at и отдельный короткий коммит. Без границ - вся история.
+    # Отдает (сутки, строк агрегатов) по мере пересчета
+    if since is None or until is None:
+        first, last = rollup_bounds()
+        since, until = since or first, until or last
+        if since is None or until is None:
+            return
+    dialect_name = db.session.get_bind().dialect.name
+    columns = ['period', 'user_id', 'bucket', 'status', 'count', 'amount', 'commission']
+
+    day = TransactionRollup.bucket_start('day', since)
+    while day < until:
+        next_day = day + PERIOD_LENGTH['day']
+        db.session.execute(
+            db.delete(TransactionRollup)
+            .where(TransactionRollup.bucket >= day, TransactionRollup.bucket < next_day)
+        )
+        rows = 0
+        # Сутки из горячей таблицы и архива: перенос в архив агрегаты не меняет
+        source = across_tiers(lambda model: select(
+            model.user_id, model.status, model.amount, model.commission, model.created_at
+        ).where(model.created_at >= day, model.created_at < next_day)).subquery()
+        for period in TransactionRollup.PERIODS:
+            bucket = bucket_expression(period, source.c.created_at, dialect_name)
+            for per_user in (True, False):
+                user_id = source.c.user_id if per_user else literal(TransactionRollup.ALL_USERS)
+                group_by = [source.c.user_id] if per_user else []
+                query = (
+                    select(literal(period), user_id, bucket, source.c.status, func.count(),
+                           func.sum(source.c.amount), func.sum(source.c.commission))
+                    .group_by(*group_by, bucket, source.c.status)
+                )
+                rows += db.session.execute(db.insert(TransactionRollup).from_select(columns, query)).rowcount
+        db.session.commit()
+        yield day, rows
+        day = next_day
+
+
+def rollup_series(period, since, until, user_id=None, status=None):
+    # Непустые интервалы [since, until) по возрастанию: итоги и разбивка по статусам
+    query = (
+        select(TransactionRollup.bucket, TransactionRollup.status, TransactionRollup.count,
+               TransactionRollup.amount, TransactionRollup.commission)
+        .where(
+            TransactionRollup.period == period,
+            TransactionRollup.user_id == (TransactionRollup.ALL_USERS if user_id is None else user_id),
+            TransactionRollup.bucket >= since,
+            TransactionRollup.bucket < until,
+            TransactionRollup.count != 0,
+        )
+        .order_by(TransactionRollup.bucket, TransactionRollup.status)
+    )
+    if status is not None:
+        query = query.where(TransactionRollup.status == status)
+
+    series = []
+    bucket = None
+    for row in db.session.execute(query):
+        if row.bucket != bucket:
+            bucket = row.bucket
+            entry = {'bucket': bucket.isoformat(), 'count': 0, 'amount': 0, 'commission': 0, 'statuses': {}}
+            series.append(entry)
+        entry['count'] += row.count
+        entry['amount'] += row.amount
+        entry['commission'] += row.commission
+        entry['statuses'][row.status.value] = {
+            'count': row.count, 'amount': to_major(row.amount), 'commission': to_major(row.commission),
+        }
+    for entry in series:
+        entry['amount'] = to_major(entry['amount'])
+        entry['commission'] = to_major(entry['commission'])
+    return series
+
+
+def default_range(period, now=None):
+    # Последние DEFAULT_BUCKETS интервалов, включая текущий
+    until = TransactionRollup.bucket_start(period, now or datetime.utcnow()) + PERIOD_LENGTH[period]
+    return until - PERIOD_LENGTH[period] * DEFAULT_BUCKETS[period], until
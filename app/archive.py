@@ -0,0 +1,47 @@
+import time
+from datetime import datetime
+from sqlalchemy import select, union_all
+from app import db
+from app.models import Transaction, ArchivedTransaction, TransactionStatus, DashboardStats
+
+# Статусы, которые уже не меняются - только такие транзакции уходят в архив
+SETTLED_STATUSES = (TransactionStatus.CONFIRMED, TransactionStatus.CANCELED, TransactionStatus.EXPIRED)
+ARCHIVED_COLUMNS = ('id', 'amount', 'commission', 'status', 'created_at', 'updated_at', 'user_id')
+
+
+def archive_transactions(cutoff, batch_size=1000, pause=0.0, now=None):
+    # Переносит завершенные транзакции старше cutoff в transactions_archive порциями: INSERT ... SELECT и DELETE
+    # по одним и тем же id в одном коммите. Отдает (сколько строк перенесено, сколько заняла порция в секундах)
+    archived_at = now or datetime.utcnow()
+    while True:
+        started = time.perf_counter()
+        ids = db.session.execute(
+            select(Transaction.id)
+            .where(Transaction.status.in_(SETTLED_STATUSES), Transaction.created_at < cutoff)
+            .limit(batch_size)
+        ).scalars().all()
+        if ids:
+            columns = [getattr(Transaction, name) for name in ARCHIVED_COLUMNS]
+            db.session.execute(
+                db.insert(ArchivedTransaction).from_select(
+                    [*ARCHIVED_COLUMNS, 'archived_at'],
+                    select(*columns, db.literal(archived_at, db.DateTime)).where(Transaction.id.in_(ids))
+                )
+            )
+            db.session.execute(
+                db.delete(Transaction).where(Transaction.id.in_(ids)).execution_options(synchronize_session=False)
+            )
+            # Итоги не меняются, но строки уходят из списков - их ETag должны смениться
+            DashboardStats.apply(transactions_changed=True)
+        db.session.commit()
+        yield len(ids), time.perf_counter() - started
+
+        if len(ids) < batch_size:
+            return
+        if pause:
+            time.sleep(pause)
+
+
+def across_tiers(build):
+    # Один и тот же запрос по горячей таблице и по архиву через UNION ALL; build(model) -> select
+    return union_all(build(Transaction), build(ArchivedTransaction))
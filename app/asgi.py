@@ -0,0 +1,400 @@
+import asyncio
+import io
+import json
+import os
+import sys
+import tempfile
+from datetime import datetime, timedelta
+from flask import request, jsonify, current_app
+from sqlalchemy import event, insert, select
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from app import db
+from app.engine import sqlite_pragma_hook
+from app.metrics import instrument_engine
+from app.models import User, Transaction, TransactionStatus, TransactionRollup, DashboardStats, IdempotencyKey, \
+    LedgerEntry, ArchivedTransaction
+from app.routes.transactions import parse_transaction_input, parse_transaction_id, check_transaction_query, \
+    transaction_cache_entry, transaction_entry_response
+from app.webhooks import transaction_event, transaction_events_insert
+from app.cache import transaction_cache
+from app.pricing import pricing_query, schedules_from_rows
+from app.idempotency import HEADER, IdempotencyConflict, request_key, request_fingerprint, stored_response, \
+    idempotency_store, keyed_response
+
+
+def async_database_url(app):
+    # Тот же файл, что у синхронного движка: относительный путь Flask-SQLAlchemy уже разрешил от instance/
+    with app.app_context():
+        url = db.engine.url
+    if url.get_backend_name() != 'sqlite' or url.database in (None, '', ':memory:'):
+        raise RuntimeError("Async mode needs a file SQLite database")
+    return url.set(drivername='sqlite+aiosqlite')
+
+
+def wsgi_environ(scope, body):
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode().decode('latin-1'),
+        'PATH_INFO': scope['path'].encode().decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_TYPE':
+            environ['CONTENT_TYPE'] = value
+        elif name != 'CONTENT_LENGTH':
+            key = f'HTTP_{name}'
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+async def read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body'):
+            return b''.join(chunks)
+
+
+class AsyncTransactionAPI:
+    # ASGI-приложение: JSON-эндпоинты транзакций на asyncio и aiosqlite, ожидание блокировки БД не занимает
+    # воркер. Остальные страницы обслуживает тот же Flask через WSGI-адаптер.
+    # Запись идет мимо группового коммита (WRITE_COALESCING) - у каждого запроса своя транзакция.
+    def __init__(self, app, pool_size=20):
+        from asgiref.wsgi import WsgiToAsgi
+        self.app = app
+        self.fallback = WsgiToAsgi(app)
+        self.engine = create_async_engine(async_database_url(app), pool_size=pool_size, max_overflow=0)
+        pragmas = app.config['SQLITE_PRAGMAS']
+        if pragmas:
+            event.listen(self.engine.sync_engine, 'connect', sqlite_pragma_hook(pragmas))
+        if 'metrics' in app.extensions:
+            instrument_engine(self.engine.sync_engine, app.extensions['metrics'])
+        self.sessionmaker = async_sessionmaker(self.engine, expire_on_commit=False)
+        self.routes = {
+            ('POST', '/create_transaction'): self.create_transaction,
+            ('POST', '/cancel_transaction'): self.cancel_transaction,
+            ('GET', '/check_transaction'): self.check_transaction,
+        }
+
+    @classmethod
+    def from_config(cls, app):
+        return cls(app, pool_size=app.config['ASYNC_DB_POOL_SIZE'])
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+        handler = self.routes.get((scope.get('method'), scope.get('path'))) if scope['type'] == 'http' else None
+        if handler is None:
+            return await self.fallback(scope, receive, send)
+
+        body = await read_body(receive)
+        # Контекст запроса Flask нужен для той же валидации и тех же ответов, что в синхронных обработчиках
+        with self.app.request_context(wsgi_environ(scope, body)):
+            try:
+                try:
+                    # before_request/after_request - те же хуки, что у синхронных обработчиков (метрики)
+                    rv = self.app.preprocess_request() or await handler()
+                except Exception as e:
+                    rv = self.app.handle_user_exception(e)
+                response = self.app.process_response(self.app.make_response(rv))
+            except Exception as e:
+                response = self.app.handle_exception(e)
+
+        await send({
+            'type': 'http.response.start',
+            'status': response.status_code,
+            'headers': [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                        for name, value in response.headers.items()],
+        })
+        await send({'type': 'http.response.body', 'body': response.get_data()})
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.engine.dispose()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def enqueue_events(self, session, events):
+        stmt, params = transaction_events_insert(events)
+        await session.execute(stmt, params)
+
+    async def apply_rollups(self, session, added=(), removed=()):
+        # Асинхронный режим работает только с SQLite (async_database_url)
+        for stmt in TransactionRollup.apply_statements(TransactionRollup.deltas(added, removed), 'sqlite'):
+            await session.execute(stmt)
+
+    def committed(self, transaction_ids=()):
+        # То же, что слушатели after_commit синхронной сессии: сброс кэша и пробуждение живого дашборда
+        cache = transaction_cache()
+        if cache is not None and transaction_ids:
+            cache.invalidate(transaction_ids)
+        notifier = current_app.extensions.get('dashboard_notifier')
+        if notifier is not None:
+            notifier.wake()
+
+    async def create_transaction(self):
+        values, error = parse_transaction_input(request.get_json())
+        if error:
+            return jsonify({"error": error}), 400
+        user_id, amount = values
+        key, error = request_key(request.headers)
+        if error:
+            return jsonify({"error": error}), 400
+        if key is not None:
+            return await self.create_transaction_once(key, user_id, amount)
+
+        async with self.sessionmaker() as session, session.begin():
+            body, status_code = await self.insert_transaction(session, user_id, amount)
+        self.committed()
+        return jsonify(body), status_code
+
+    async def create_transaction_once(self, key, user_id, amount):
+        # То же, что idempotency.idempotent_response, на асинхронной сессии. Дубли не ждут друг друга в памяти
+        # (ожидание threading.Event заняло бы цикл событий): второй запрос ждет блокировку записи SQLite,
+        # не может занять ключ и отдает сохраненный ответ первого
+        fingerprint = request_fingerprint('create_transaction', (user_id, amount))
+        store = idempotency_store()
+        try:
+            replay = store.cached(key, fingerprint)
+            if replay is None:
+                async with self.sessionmaker() as session:
+                    replay = await self.lookup_key(session, key, fingerprint)
+            if replay is not None:
+                body, status_code = replay
+                replayed = True
+            else:
+                async with self.sessionmaker() as session, session.begin():
+                    claim = IdempotencyKey.claim_statement(key, fingerprint, 'sqlite')
+                    replayed = (await session.execute(claim)).rowcount != 1
+                    if replayed:
+                        stored = await self.lookup_key(session, key, fingerprint)
+                        if stored is None:
+                            raise IdempotencyConflict(f"A request with {HEADER} {key} is still in progress", 409)
+                        body, status_code = stored
+                    else:
+                        body, status_code = await self.insert_transaction(session, user_id, amount)
+                        await session.execute(IdempotencyKey.store_statement(key, status_code, json.dumps(body)))
+                self.committed()
+            store.remember(key, fingerprint, body, status_code)
+        except IdempotencyConflict as e:
+            return jsonify({"error": str(e)}), e.status_code
+        return keyed_response(body, status_code, replayed)
+
+    async def lookup_key(self, session, key, fingerprint):
+        row = (await session.execute(IdempotencyKey.lookup_statement(key))).first()
+        return stored_response(key, fingerprint, row) if row is not None else None
+
+    async def insert_transaction(self, session, user_id, amount):
+        found = schedules_from_rows(await session.execute(pricing_query().where(User.id == user_id)))
+        if user_id not in found:
+            return {"error": "User not found"}, 404
+
+        # Проверка средств с учетом комиссии и списание - одна условная вставка в журнал
+        schedule, _ = found[user_id]
+        commission = schedule.commission(amount)
+        result = await session.execute(LedgerEntry.debit_statement(user_id, amount + commission))
+        debited = result.rowcount == 1
+        if debited and self.app.config['LEDGER_DUAL_WRITE']:
+            await session.execute(User.legacy_debit_statement({user_id: amount + commission}))
+        # Если средств недостаточно, создаем отмененную транзакцию
+        status = TransactionStatus.PENDING if debited else TransactionStatus.CANCELED
+        if not debited:
+            commission = 0
+        now = datetime.utcnow()
+        transaction_id = await session.scalar(
+            insert(Transaction)
+            .values(amount=amount, commission=commission, status=status, user_id=user_id, created_at=now)
+            .returning(Transaction.id)
+        )
+        # Без строки счетчиков (база без миграций) их восстанавливает `flask rebuild-stats`
+        await session.execute(DashboardStats.apply_statement(transactions=1, amount=amount))
+        await self.apply_rollups(session, added=[(now, user_id, status, amount, commission)])
+        await self.enqueue_events(session, [transaction_event(transaction_id, user_id, status, amount, commission)])
+
+        if not debited:
+            return {"error": "Insufficient funds. Transaction canceled.", "transaction_id": transaction_id}, 422
+        return {"message": "Transaction created successfully", "transaction_id": transaction_id}, 201
+
+    async def cancel_transaction(self):
+        data = request.get_json()
+        transaction_id, error = parse_transaction_id(data.get('transaction_id', 0))
+        if error:
+            return jsonify({"error": error}), 400
+
+        async with self.sessionmaker() as session, session.begin():
+            transaction = (await session.execute(
+                select(Transaction.user_id, Transaction.amount, Transaction.commission, Transaction.created_at)
+                .where(Transaction.id == transaction_id)
+            )).first()
+            if not transaction:
+                # В архиве только завершенные транзакции - ответ тот же, что у синхронного обработчика
+                archived = await session.scalar(
+                    select(ArchivedTransaction.id).where(ArchivedTransaction.id == transaction_id))
+                if archived is not None:
+                    return jsonify({"error": "Only pending transactions can be canceled"}), 400
+                return jsonify({"error": "Transaction not found"}), 404
+
+            result = await session.execute(
+                Transaction.transition_statement(transaction_id, TransactionStatus.PENDING, TransactionStatus.CANCELED)
+            )
+            if result.rowcount != 1:
+                return jsonify({"error": "Only pending transactions can be canceled"}), 400
+
+            await self.enqueue_events(session, [transaction_event(
+                transaction_id, transaction.user_id, TransactionStatus.CANCELED, transaction.amount,
+                transaction.commission
+            )])
+            await session.execute(DashboardStats.apply_statement(transactions_changed=True))
+            created_at, user_id, amount, commission = (transaction.created_at, transaction.user_id,
+                                                       transaction.amount, transaction.commission)
+            await self.apply_rollups(
+                session,
+                added=[(created_at, user_id, TransactionStatus.CANCELED, amount, commission)],
+                removed=[(created_at, user_id, TransactionStatus.PENDING, amount, commission)],
+            )
+        self.committed([transaction_id])
+        return jsonify({"message": "Transaction canceled successfully"}), 200
+
+    async def check_transaction(self):
+        transaction_id, error = parse_transaction_id(request.args.get('transaction_id', 0))
+        if error:
+            return jsonify({"error": error}), 400
+
+        # Локальный LRU не блокирует цикл событий; с CACHE_REDIS_URL обращение к Redis синхронное
+        cache = transaction_cache()
+        entry = cache.get(transaction_id) if cache is not None and not cache.version_check_due() else None
+        if entry is None:
+            async with self.sessionmaker() as session:
+                transaction = (await session.execute(check_transaction_query(transaction_id))).first()
+            if not transaction:
+                return jsonify({"error": "Transaction not found"}), 404
+
+            entry = transaction_cache_entry(transaction)
+            if cache is not None:
+                cache.observe_version(transaction.cache_version)
+                cache.put(transaction_id, entry)
+
+        return transaction_entry_response(entry)
+
+
+def parity_cases(user_id, poor_user_id, archived_id):
+    # (метод, путь, тело JSON, заголовки) - одна и та же последовательность для WSGI и ASGI.
+    # Номера транзакций на обеих базах совпадают: создаются в том же порядке
+    return [
+        ('POST', '/create_transaction', {'user_id': user_id, 'amount': 10}, {}),
+        ('POST', '/create_transaction', {'user_id': poor_user_id, 'amount': 10}, {}),
+        ('POST', '/create_transaction', {'user_id': 999999, 'amount': 1}, {}),
+        ('POST', '/create_transaction', {'user_id': user_id, 'amount': '0.001'}, {}),
+        ('POST', '/create_transaction', {'user_id': user_id, 'amount': 1e20}, {}),
+        ('POST', '/create_transaction', {'user_id': user_id, 'amount': 5}, {'Idempotency-Key': 'async-parity'}),
+        ('POST', '/create_transaction', {'user_id': user_id, 'amount': 5}, {'Idempotency-Key': 'async-parity'}),
+        ('POST', '/create_transaction', {'user_id': user_id, 'amount': 6}, {'Idempotency-Key': 'async-parity'}),
+        ('GET', f'/check_transaction?transaction_id={archived_id + 1}', None, {}),
+        ('POST', '/cancel_transaction', {'transaction_id': archived_id + 1}, {}),
+        ('POST', '/cancel_transaction', {'transaction_id': archived_id + 1}, {}),
+        ('GET', f'/check_transaction?transaction_id={archived_id + 1}', None, {}),
+        ('GET', f'/check_transaction?transaction_id={archived_id}', None, {}),
+        ('POST', '/cancel_transaction', {'transaction_id': archived_id}, {}),
+        ('POST', '/cancel_transaction', {'transaction_id': 999999}, {}),
+        ('GET', '/check_transaction?transaction_id=abc', None, {}),
+    ]
+
+
+async def asgi_request(application, method, path, body=None, headers=None):
+    path, _, query = path.partition('?')
+    payload = json.dumps(body).encode() if body is not None else b''
+    scope = {
+        'type': 'http', 'method': method, 'path': path, 'query_string': query.encode(), 'root_path': '',
+        'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(payload)).encode()),
+                    *((name.lower().encode(), value.encode()) for name, value in (headers or {}).items())],
+    }
+    messages = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': payload, 'more_body': False}
+
+    async def send(message):
+        messages.append(message)
+
+    await application(scope, receive, send)
+    return messages[0]['status'], json.loads(b''.join(m.get('body', b'') for m in messages[1:]) or b'null')
+
+
+def check_async_parity():
+    # Одни и те же запросы к синхронным обработчикам и к AsyncTransactionAPI на двух одинаковых временных базах:
+    # коды и тела ответов (кроме времени создания) и балансы по журналу должны совпасть
+    from app import create_app
+    from app.archive import archive_transactions
+    from app.ledger import user_balance
+    from app.money import to_minor
+    directory = tempfile.mkdtemp(prefix='async-parity-')
+    responses = {}
+    balances = {}
+    for mode in ('wsgi', 'asgi'):
+        app = create_app({
+            'SQLALCHEMY_DATABASE_URI': f"sqlite:///{os.path.join(directory, f'{mode}.db')}",
+            'WRITE_COALESCING': False,
+        }, config_name='testing')
+        with app.app_context():
+            db.create_all()
+            db.session.add_all([User(balance=to_minor(1000), commission_rate=0.01),
+                                User(balance=to_minor(1), commission_rate=0.01)])
+            db.session.flush()
+            db.session.add(Transaction(user_id=1, amount=to_minor(10), commission=to_minor('0.1'),
+                                       status=TransactionStatus.CONFIRMED))
+            db.session.add(DashboardStats(id=DashboardStats.ROW_ID, **DashboardStats.compute()))
+            db.session.commit()
+            archived_id = db.session.scalar(select(Transaction.id))
+            for _ in archive_transactions(datetime.utcnow() + timedelta(days=1)):
+                pass
+
+        cases = parity_cases(user_id=1, poor_user_id=2, archived_id=archived_id)
+        if mode == 'wsgi':
+            client = app.test_client()
+            results = []
+            for method, path, body, headers in cases:
+                response = client.open(path, method=method, json=body, headers=headers)
+                results.append((response.status_code, response.get_json()))
+        else:
+            application = AsyncTransactionAPI.from_config(app)
+
+            async def run():
+                try:
+                    return [await asgi_request(application, *case) for case in cases]
+                finally:
+                    await application.engine.dispose()
+
+            results = asyncio.run(run())
+        for _, body in results:
+            if isinstance(body, dict):
+                body.pop('created_at', None)
+        responses[mode] = results
+        with app.app_context():
+            balances[mode] = [user_balance(user_id) for user_id in (1, 2)]
+
+    problems = []
+    for (method, path, body, _), expected, actual in zip(cases, responses['wsgi'], responses['asgi']):
+        if expected != actual:
+            problems.append(f"{method} {path} {json.dumps(body)}: wsgi {expected}, asgi {actual}")
+    if balances['wsgi'] != balances['asgi']:
+        problems.append(f"ledger balances: wsgi {balances['wsgi']}, asgi {balances['asgi']}")
+    return problems
@@ -0,0 +1,192 @@
+import csv
+import gzip
+import json
+import os
+import time
+from datetime import datetime
+from sqlalchemy.dialects import postgresql, sqlite
+from app import db
+from app.models import User, UserRole, Transaction, TransactionStatus, DashboardStats, LedgerEntry
+from app.money import to_minor
+from app.analytics import rebuild_rollups
+
+FORMATS = ('csv', 'ndjson')
+# Разбор значения в перечисление без вызова Enum(...) на каждой строке
+STATUSES = {status.value: status for status in TransactionStatus}
+ROLES = {role.value: role for role in UserRole}
+
+
+class InvalidRow(ValueError):
+    def __init__(self, line, error):
+        super().__init__(f"line {line}: {error}")
+        self.line = line
+
+
+def read_rows(path, fmt):
+    # (номер строки файла, словарь полей); .gz читается потоком, как и пишет export-transactions
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt', encoding='utf-8', newline='') as source:
+        if fmt == 'csv':
+            # Строка 1 - заголовок
+            yield from enumerate(csv.DictReader(source), start=2)
+            return
+        for line, text in enumerate(source, start=1):
+            if not text.strip():
+                continue
+            try:
+                yield line, json.loads(text)
+            except json.JSONDecodeError as e:
+                raise InvalidRow(line, e)
+
+
+def _enum_value(values, value, name):
+    try:
+        return values[str(value).lower()]
+    except KeyError:
+        raise ValueError(f"{name} must be one of: {', '.join(values)}")
+
+
+def _row_id(row):
+    value = row.get('id')
+    return None if value in (None, '') else int(value)
+
+
+def parse_user(row):
+    # Суммы во входных данных - в основных единицах (12.34), как в API и выгрузке
+    return {
+        'id': _row_id(row),
+        'balance': to_minor(row['balance']),
+        'commission_rate': float(row.get('commission_rate') or 0),
+        'webhook_url': row.get('webhook_url') or None,
+        'role': _enum_value(ROLES, row.get('role') or UserRole.USER.value, 'role'),
+    }
+
+
+def parse_transaction(row):
+    user_id = int(row['user_id'])
+    amount = to_minor(row['amount'])
+    if user_id <= 0 or amount <= 0:
+        raise ValueError("user_id and amount must be positive numbers")
+    created_at = row.get('created_at')
+    return {
+        'id': _row_id(row),
+        'user_id': user_id,
+        'amount': amount,
+        'commission': to_minor(row.get('commission') or 0),
+        'status': _enum_value(STATUSES, row.get('status') or TransactionStatus.PENDING.value, 'status'),
+        'created_at': datetime.fromisoformat(created_at) if created_at else datetime.utcnow(),
+    }
+
+
+KINDS = {
+    'users': (User.__table__, parse_user),
+    'transactions': (Transaction.__table__, parse_transaction),
+}
+
+
+def insert_statement(table, dialect_name):
+    # Строки с id, записанные до сбоя, при повторном запуске пропускаются, а не роняют загрузку
+    if dialect_name == 'postgresql':
+        return postgresql.insert(table).on_conflict_do_nothing(index_elements=['id'])
+    if dialect_name == 'sqlite':
+        return sqlite.insert(table).on_conflict_do_nothing(index_elements=['id'])
+    return table.insert()
+
+
+def relax_durability(conn):
+    # Только на время загрузки и только на этом соединении; отдает функцию восстановления
+    if conn.dialect.name == 'sqlite':
+        synchronous = conn.exec_driver_sql('PRAGMA synchronous').scalar()
+        conn.exec_driver_sql('PRAGMA synchronous=OFF')
+        return lambda: conn.exec_driver_sql(f'PRAGMA synchronous={synchronous}')
+    if conn.dialect.name == 'postgresql':
+        conn.exec_driver_sql('SET synchronous_commit = off')
+        return lambda: conn.exec_driver_sql('RESET synchronous_commit')
+    return lambda: None
+
+
+def read_checkpoint(path, kind):
+    if not path or not os.path.exists(path):
+        return 0
+    with open(path) as f:
+        checkpoint = json.load(f)
+    if checkpoint['kind'] != kind:
+        raise ValueError(f"Checkpoint {path} belongs to a {checkpoint['kind']} import")
+    return checkpoint['rows']
+
+
+def write_checkpoint(path, kind, rows):
+    if path:
+        with open(path + '.tmp', 'w') as f:
+            json.dump({'kind': kind, 'rows': rows}, f)
+        os.replace(path + '.tmp', path)
+
+
+def bulk_import(kind, path, fmt, batch_size=50000, checkpoint=None, drop_indexes=False, fast=False):
+    # Core executemany порциями по batch_size, каждая порция - одна транзакция. После коммита порции номер
+    # последней строки пишется в checkpoint, повторный запуск продолжает с него. Строка без id из порции,
+    # закоммиченной перед самым сбоем, может загрузиться дважды - для точного перезапуска нужны id.
+    # Вебхуки по загруженным данным не отправляются.
+    # По каждой порции отдает (номер последней строки, строк в порции, вставлено, секунд)
+    table, parse = KINDS[kind]
+    done = read_checkpoint(checkpoint, kind)
+    with db.engine.connect() as conn:
+        stmt = insert_statement(table, conn.dialect.name)
+        restore = relax_durability(conn) if fast else None
+        # Вторичные индексы дешевле построить один раз в конце, чем обновлять на каждой вставке
+        indexes = sorted(table.indexes, key=lambda index: index.name) if drop_indexes else []
+        for index in indexes:
+            index.drop(conn, checkfirst=True)
+        conn.commit()
+        try:
+            number = done
+            batch = []
+            started = time.perf_counter()
+            for number, (line, row) in enumerate(read_rows(path, fmt), start=1):
+                if number <= done:
+                    continue
+                try:
+                    batch.append(parse(row))
+                except (KeyError, ValueError, TypeError, AttributeError) as e:
+                    raise InvalidRow(line, e)
+                if len(batch) == batch_size:
+                    inserted = _insert_batch(conn, stmt, batch)
+                    write_checkpoint(checkpoint, kind, number)
+                    yield number, len(batch), inserted, time.perf_counter() - started
+                    batch = []
+                    started = time.perf_counter()
+            if batch:
+                inserted = _insert_batch(conn, stmt, batch)
+                write_checkpoint(checkpoint, kind, number)
+                yield number, len(batch), inserted, time.perf_counter() - started
+        finally:
+            conn.rollback()
+            for index in indexes:
+                index.create(conn, checkfirst=True)
+            conn.commit()
+            if restore is not None:
+                restore()
+
+    # Счетчики дашборда и агрегаты - пересчетом по данным, как `flask rebuild-stats` и `flask rebuild-rollups`
+    DashboardStats.rebuild()
+    if kind == 'users':
+        # Начальные балансы загруженных пользователей - записями журнала
+        db.session.execute(LedgerEntry.open_accounts_statement())
+    db.session.commit()
+    if kind == 'transactions':
+        for _ in rebuild_rollups():
+            pass
+    if checkpoint and os.path.exists(checkpoint):
+        os.remove(checkpoint)
+
+
+def _insert_batch(conn, stmt, batch):
+    # executemany требует одинаковый набор колонок: строки с id и без id - отдельными вызовами
+    inserted = 0
+    with_id = [row for row in batch if row['id'] is not None]
+    without_id = [{name: value for name, value in row.items() if name != 'id'} for row in batch if row['id'] is None]
+    for rows in (with_id, without_id):
+        if rows:
+            inserted += conn.execute(stmt, rows).rowcount
+    conn.commit()
+    return inserted
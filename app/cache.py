@@ -0,0 +1,196 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+from flask import current_app
+from sqlalchemy import event
+from app import db
+from app.models import TransactionStatus
+
+FINAL_STATUSES = {TransactionStatus.CONFIRMED.value, TransactionStatus.CANCELED.value, TransactionStatus.EXPIRED.value}
+
+
+class LRUCache:
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._data),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+            }
+
+
+class RedisBackend:
+    # Общий для процессов кэш; client - redis.Redis или совместимый объект (get/set(ex=)/delete)
+    def __init__(self, client, prefix='transactions:'):
+        self.client = client
+        self.prefix = prefix
+
+    def get(self, key):
+        raw = self.client.get(self.prefix + str(key))
+        return json.loads(raw) if raw is not None else None
+
+    def set(self, key, value, ttl):
+        self.client.set(self.prefix + str(key), json.dumps(value), ex=max(1, int(ttl)))
+
+    def delete(self, key):
+        self.client.delete(self.prefix + str(key))
+
+
+class MemoryBackend:
+    # Локальная замена общего бэкенда для разработки и тестов
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[1] <= time.monotonic():
+                self._data.pop(key, None)
+                return None
+            return json.loads(entry[0])
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._data[key] = (json.dumps(value), time.monotonic() + ttl)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+
+class TransactionCache:
+    def __init__(self, local, shared=None, pending_ttl=2.0, final_ttl=3600.0):
+        self.local = local
+        self.shared = shared
+        self.pending_ttl = pending_ttl
+        self.final_ttl = final_ttl
+        self.shared_hits = 0
+        # Последняя увиденная DashboardStats.cache_version и когда ее проверяли (time.monotonic)
+        self.version = None
+        self.version_checked_at = None
+
+    @classmethod
+    def from_config(cls, app):
+        config = app.config
+        shared = None
+        if config['CACHE_REDIS_URL']:
+            import redis
+            shared = RedisBackend(redis.Redis.from_url(config['CACHE_REDIS_URL']))
+        return cls(
+            LRUCache(config['CACHE_MAX_ENTRIES']),
+            shared,
+            pending_ttl=config['CACHE_PENDING_TTL'],
+            final_ttl=config['CACHE_FINAL_TTL'],
+        )
+
+    def ttl(self, status):
+        # Завершенные транзакции больше не меняются, их можно держать долго
+        return self.final_ttl if status in FINAL_STATUSES else self.pending_ttl
+
+    def version_check_due(self):
+        # Не чаще раза в pending_ttl запрос идет в БД и заодно приносит cache_version
+        return self.version_checked_at is None or time.monotonic() - self.version_checked_at >= self.pending_ttl
+
+    def observe_version(self, version):
+        # Версия сменилась (пересчет комиссий в другом процессе) - локальные записи могли устареть
+        if self.version is not None and version != self.version:
+            self.local.clear()
+        self.version = version
+        self.version_checked_at = time.monotonic()
+
+    def get(self, transaction_id):
+        entry = self.local.get(transaction_id)
+        if entry is None and self.shared is not None:
+            entry = self.shared.get(transaction_id)
+            if entry is not None:
+                self.shared_hits += 1
+                self.local.set(transaction_id, entry, self.ttl(entry['status']))
+        return entry
+
+    def put(self, transaction_id, entry):
+        # entry - JSON-совместимый dict, в котором есть status транзакции
+        ttl = self.ttl(entry['status'])
+        self.local.set(transaction_id, entry, ttl)
+        if self.shared is not None:
+            self.shared.set(transaction_id, entry, ttl)
+
+    def invalidate(self, transaction_ids):
+        for transaction_id in transaction_ids:
+            self.local.delete(transaction_id)
+            if self.shared is not None:
+                self.shared.delete(transaction_id)
+
+    def stats(self):
+        return {**self.local.stats(), 'shared_hits': self.shared_hits, 'shared': self.shared is not None}
+
+
+def transaction_cache():
+    return current_app.extensions.get('transaction_cache')
+
+
+def invalidate_transactions(transaction_ids):
+    # Сбрасываем записи после коммита, чтобы параллельный читатель не положил в кэш старый статус
+    if transaction_cache() is not None:
+        db.session.info.setdefault('invalidate_transactions', set()).update(transaction_ids)
+
+
+@event.listens_for(db.session, 'after_commit')
+def _invalidate_after_commit(session):
+    transaction_ids = session.info.pop('invalidate_transactions', None)
+    if transaction_ids:
+        cache = transaction_cache()
+        if cache is not None:
+            cache.invalidate(transaction_ids)
+
+
+@event.listens_for(db.session, 'after_soft_rollback')
+def _forget_invalidations(session, previous_transaction):
+    # Откат SAVEPOINT (групповой коммит) не должен терять сбросы соседних операций
+    if previous_transaction.parent is None:
+        session.info.pop('invalidate_transactions', None)
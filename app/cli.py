@@ -1,6 +1,25 @@
+import time
+from datetime import datetime, timedelta
 import click
+from flask import current_app
 from flask.cli import with_appcontext
-from app.models import User, db, UserRole
+from app.models import User, db, UserRole, DashboardStats, TransactionStatus, CommissionSchedule, CommissionTier, \
+    PricingMode
+from app.query_plans import check_query_plans as run_query_plan_checks
+from app.query_budget import check_query_budgets as run_query_budget_checks
+from app.webhooks import WebhookDispatcher
+from app.expiry import expire_stale_transactions
+from app.idempotency import purge_expired_keys
+from app.archive import archive_transactions as run_archive
+from app.replica import REPLICA_BIND, ReplicaSync, check_replica_sync as run_replica_sync_check
+from app.ledger import snapshot_balances as run_snapshots, ledger_differences
+from app.money import to_minor, format_money
+from app.analytics import rebuild_rollups as run_rollup_rebuild
+from app.pricing import Schedule, REPRICE_STATUSES, reprice_query, reprice_transactions as run_reprice
+from app.bulk_import import FORMATS as IMPORT_FORMATS, KINDS as IMPORT_KINDS, InvalidRow, \
+    bulk_import as run_bulk_import
+from app.export import FORMATS as EXPORT_FORMATS, ExportProgress, export_query, open_export, \
+    export_transactions as write_export
 
 
 @click.command('create-admin')
@@ -11,16 +30,342 @@ def create_admin(webhook_url):
         click.echo("Admin with this webhook URL already exists.")
         return
     admin = User(
-        balance=100000.0,
+        balance=to_minor(100000),
         commission_rate=0.01,
         webhook_url=webhook_url,
         role=UserRole.ADMIN
     )
 
     db.session.add(admin)
+    DashboardStats.apply(users=1)
     try:
         db.session.commit()
         click.echo(f"Admin created with ID: {admin.id}")
     except Exception as e:
         db.session.rollback()
         click.echo(f"Failed to create admin: {e}")
+
+
+@click.command('check-query-plans')
+@with_appcontext
+def check_query_plans():
+    problems = run_query_plan_checks(current_app._get_current_object())
+    if not problems:
+        click.echo("No unexpected full table scans.")
+        return
+    for problem in problems:
+        click.echo(f"{problem['url']}: full scan of {', '.join(problem['tables'])}")
+        click.echo(f"  {problem['statement']}")
+        for detail in problem['plan']:
+            click.echo(f"    {detail}")
+    raise SystemExit(1)
+
+
+@click.command('check-query-budgets')
+def check_query_budgets():
+    # Своя временная база в профиле testing, текущая база не затрагивается
+    problems = run_query_budget_checks()
+    if not problems:
+        click.echo("All routes are within their SQL statement budgets.")
+        return
+    for problem in problems:
+        click.echo(f"{problem.get('url') or problem['endpoint']}: {problem['error']}")
+    raise SystemExit(1)
+
+
+@click.command('check-async-api')
+def check_async_api():
+    # Асинхронный режим - необязательные зависимости (requirements-async.txt), импорт только здесь
+    from app.asgi import check_async_parity
+    problems = check_async_parity()
+    if not problems:
+        click.echo("Async API responses match the sync handlers.")
+        return
+    for problem in problems:
+        click.echo(problem)
+    raise SystemExit(1)
+
+
+@click.command('rebuild-stats')
+@click.option('--check', is_flag=True, help="Only compare the counters with the raw data, do not rewrite them.")
+@with_appcontext
+def rebuild_stats(check):
+    expected = DashboardStats.compute()
+    stats = DashboardStats.current()
+    diffs = stats.differences(expected)
+    for name, (stored, actual) in diffs.items():
+        click.echo(f"{name}: stored {stored}, actual {actual}")
+
+    if check:
+        if diffs:
+            raise SystemExit(1)
+        click.echo("Dashboard stats are consistent.")
+        return
+
+    DashboardStats.rebuild(expected)
+    db.session.commit()
+    click.echo(f"Dashboard stats rebuilt: {expected}")
+
+
+@click.command('rebuild-rollups')
+@click.option('--since', type=click.DateTime(), default=None, help="First day to recompute (default: all history).")
+@click.option('--until', type=click.DateTime(), default=None, help="Recompute days before this moment.")
+@with_appcontext
+def rebuild_rollups(since, until):
+    days = 0
+    for day, rows in run_rollup_rebuild(since, until):
+        days += 1
+        click.echo(f"{day.date()}: {rows} rollup rows")
+    click.echo(f"Rollups rebuilt for {days} days.")
+
+
+@click.command('run-webhooks')
+@click.option('--once', is_flag=True, help="Deliver the events that are due now and exit.")
+@with_appcontext
+def run_webhooks(once):
+    dispatcher = WebhookDispatcher.from_config(current_app._get_current_object())
+    if once:
+        processed = dispatcher.dispatch_once()
+        dispatcher.stop()
+        click.echo(f"Processed {processed} webhook events.")
+        return
+    click.echo("Delivering webhooks, press Ctrl+C to stop.")
+    try:
+        dispatcher.run_forever()
+    except KeyboardInterrupt:
+        dispatcher.stop()
+
+
+@click.command('expire-transactions')
+@click.option('--ttl', type=int, default=None, help="Age in seconds after which PENDING transactions expire.")
+@click.option('--batch-size', type=int, default=None, help="Rows updated per batch/commit.")
+@click.option('--pause', type=float, default=0.0, help="Seconds to sleep between batches.")
+@with_appcontext
+def expire_transactions(ttl, batch_size, pause):
+    ttl = timedelta(seconds=ttl if ttl is not None else current_app.config['TRANSACTION_TTL'])
+    batch_size = batch_size or current_app.config['EXPIRY_BATCH_SIZE']
+    total = 0
+    for number, (expired, elapsed) in enumerate(expire_stale_transactions(ttl, batch_size, pause), start=1):
+        total += expired
+        click.echo(f"Batch {number}: expired {expired} transactions in {elapsed * 1000:.1f} ms")
+    click.echo(f"Expired {total} transactions in total.")
+
+
+@click.command('purge-idempotency-keys')
+@click.option('--ttl', type=int, default=None, help="Age in seconds after which keys are deleted.")
+@click.option('--batch-size', type=int, default=None, help="Rows deleted per batch/commit.")
+@with_appcontext
+def purge_idempotency_keys(ttl, batch_size):
+    ttl = timedelta(seconds=ttl if ttl is not None else current_app.config['IDEMPOTENCY_KEY_TTL'])
+    batch_size = batch_size or current_app.config['EXPIRY_BATCH_SIZE']
+    total = sum(deleted for deleted, _ in purge_expired_keys(ttl, batch_size))
+    click.echo(f"Purged {total} idempotency keys.")
+
+
+@click.command('archive-transactions')
+@click.option('--older-than', type=int, default=None,
+              help="Age in days after which settled transactions are moved to the archive.")
+@click.option('--batch-size', type=int, default=None, help="Rows moved per batch/commit.")
+@click.option('--pause', type=float, default=0.0, help="Seconds to sleep between batches.")
+@with_appcontext
+def archive_transactions(older_than, batch_size, pause):
+    days = older_than if older_than is not None else current_app.config['ARCHIVE_AFTER_DAYS']
+    batch_size = batch_size or current_app.config['ARCHIVE_BATCH_SIZE']
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    total = 0
+    for number, (moved, elapsed) in enumerate(run_archive(cutoff, batch_size, pause), start=1):
+        total += moved
+        click.echo(f"Batch {number}: archived {moved} transactions in {elapsed * 1000:.1f} ms")
+    click.echo(f"Archived {total} transactions created before {cutoff.isoformat()}.")
+
+
+@click.command('sync-replica')
+@with_appcontext
+def sync_replica():
+    # Разовая копия основной базы SQLite в REPLICA_DATABASE_URL; периодически - REPLICA_SYNC_INTERVAL
+    if REPLICA_BIND not in current_app.config['SQLALCHEMY_BINDS']:
+        click.echo("REPLICA_DATABASE_URL is not set.", err=True)
+        raise SystemExit(1)
+    try:
+        replica_sync = ReplicaSync.from_config(current_app)
+    except ValueError as e:
+        click.echo(str(e), err=True)
+        raise SystemExit(1)
+    elapsed = replica_sync.sync()
+    click.echo(f"Copied {replica_sync.source} to {replica_sync.target} in {elapsed * 1000:.1f} ms")
+
+
+@click.command('check-replica-sync')
+def check_replica_sync():
+    # Свои временные базы в instance/, текущие не затрагиваются
+    problems = run_replica_sync_check()
+    if not problems:
+        click.echo("Replica sync copies the primary database used by the engines.")
+        return
+    for problem in problems:
+        click.echo(problem)
+    raise SystemExit(1)
+
+
+@click.command('snapshot-balances')
+@click.option('--batch-size', type=int, default=None, help="Users per batch/commit.")
+@with_appcontext
+def snapshot_balances(batch_size):
+    batch_size = batch_size or current_app.config['LEDGER_SNAPSHOT_BATCH_SIZE']
+    total = 0
+    for after_id, refreshed, elapsed in run_snapshots(batch_size):
+        total += refreshed
+        click.echo(f"Users up to {after_id}: refreshed {refreshed} snapshots in {elapsed * 1000:.1f} ms")
+    click.echo(f"Refreshed {total} balance snapshots.")
+
+
+@click.command('check-ledger')
+@click.option('--batch-size', type=int, default=1000, show_default=True, help="Users compared per query.")
+@click.option('--limit', type=int, default=20, show_default=True, help="Differences to print.")
+@with_appcontext
+def check_ledger(batch_size, limit):
+    # Сверка балансов по журналу со старой колонкой users.balance (она списывается при LEDGER_DUAL_WRITE=1)
+    differences = 0
+    for user_id, balance, ledger_balance in ledger_differences(batch_size):
+        differences += 1
+        if differences <= limit:
+            click.echo(f"user {user_id}: users.balance={format_money(balance)}, "
+                       f"ledger={format_money(ledger_balance)}")
+    if not differences:
+        click.echo("Ledger balances match users.balance.")
+        return
+    click.echo(f"{differences} users differ.")
+    raise SystemExit(1)
+
+
+@click.command('export-transactions')
+@click.option('--format', 'fmt', type=click.Choice(EXPORT_FORMATS), default='csv', show_default=True,
+              help="csv, or ndjson compressed with gzip.")
+@click.option('--output', '-o', default='-', show_default=True, help="File to write, '-' for stdout.")
+@click.option('--user-id', type=int, default=None)
+@click.option('--status', type=click.Choice([status.value for status in TransactionStatus]), default=None)
+@click.option('--since', type=click.DateTime(), default=None, help="created_at from (inclusive).")
+@click.option('--until', type=click.DateTime(), default=None, help="created_at before (exclusive).")
+@click.option('--after-id', type=int, default=0, help="Resume: export only transactions with a greater id.")
+@click.option('--append', is_flag=True, help="Append to the output file without a CSV header (use with --after-id).")
+@click.option('--chunk-size', type=int, default=1000, show_default=True, help="Rows fetched from the cursor at once.")
+@with_appcontext
+def export_transactions(fmt, output, user_id, status, since, until, after_id, append, chunk_size):
+    query = export_query(user_id, TransactionStatus(status) if status else None, since, until, after_id)
+    progress = ExportProgress()
+    try:
+        with open_export(output, fmt, append) as stream:
+            write_export(stream, fmt, query, progress, chunk_size, header=not append)
+    except KeyboardInterrupt:
+        # Все строки до last_id включительно уже в файле: он закрывается с дозаписью буфера
+        click.echo(f"Interrupted after {progress.count} transactions; "
+                   f"resume with --after-id {progress.last_id or after_id} --append", err=True)
+        raise SystemExit(1)
+    click.echo(f"Exported {progress.count} transactions, last id {progress.last_id}.", err=True)
+
+
+@click.command('bulk-import')
+@click.argument('kind', type=click.Choice(sorted(IMPORT_KINDS)))
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(IMPORT_FORMATS), default='csv', show_default=True,
+              help="Input format; a .gz file is decompressed on the fly.")
+@click.option('--batch-size', type=int, default=50000, show_default=True, help="Rows per insert/commit.")
+@click.option('--checkpoint', default=None, help="Progress file for restarts (default: PATH.checkpoint).")
+@click.option('--drop-indexes', is_flag=True, help="Drop secondary indexes during the load and rebuild them after.")
+@click.option('--fast', is_flag=True, help="Relax durability (SQLite synchronous=OFF) on the loading connection.")
+@with_appcontext
+def bulk_import(kind, path, fmt, batch_size, checkpoint, drop_indexes, fast):
+    checkpoint = checkpoint or path + '.checkpoint'
+    started = time.perf_counter()
+    inserted = 0
+    batches = run_bulk_import(kind, path, fmt, batch_size, checkpoint, drop_indexes, fast)
+    try:
+        for number, (through, rows, batch_inserted, elapsed) in enumerate(batches, start=1):
+            inserted += batch_inserted
+            click.echo(f"Batch {number}: rows up to {through} committed, {batch_inserted} of {rows} inserted, "
+                       f"{rows / elapsed:.0f} rows/sec")
+    except InvalidRow as e:
+        click.echo(f"Invalid {kind} row at {e}. Fix the input and rerun to continue from {checkpoint}.", err=True)
+        raise SystemExit(1)
+    elapsed = time.perf_counter() - started
+    click.echo(f"Imported {inserted} {kind} in {elapsed:.1f} s ({inserted / elapsed:.0f} rows/sec).")
+
+
+def parse_tier(ctx, param, values):
+    tiers = []
+    for value in values:
+        try:
+            amount, rate = value.split(':')
+            tiers.append((to_minor(amount), float(rate)))
+        except ValueError:
+            raise click.BadParameter(f"{value!r} is not FROM_AMOUNT:RATE, e.g. 1000:0.01")
+    return tiers
+
+
+@click.command('commission-schedule')
+@click.argument('name')
+@click.option('--mode', type=click.Choice([mode.value for mode in PricingMode]), required=True,
+              help="tiered: each part of the amount at its tier rate; "
+                   "volume: the whole amount at the rate of the tier it reaches.")
+@click.option('--tier', 'tiers', multiple=True, required=True, callback=parse_tier,
+              help="FROM_AMOUNT:RATE, amount in major units; the first tier starts at 0. Repeat for each tier.")
+@click.option('--assign', 'assign_ids', type=int, multiple=True, help="User id to price with this schedule.")
+@click.option('--unassign', 'unassign_ids', type=int, multiple=True, help="User id to return to its flat rate.")
+@with_appcontext
+def commission_schedule(name, mode, tiers, assign_ids, unassign_ids):
+    # Создает сетку или заменяет ступени существующей; новые транзакции сразу считаются по ней,
+    # записанные - `flask reprice-transactions --schedule NAME`
+    try:
+        Schedule(PricingMode(mode), tiers)
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint='--tier')
+
+    schedule = CommissionSchedule.query.filter_by(name=name).first()
+    if schedule is None:
+        schedule = CommissionSchedule(name=name, mode=PricingMode(mode))
+        db.session.add(schedule)
+        db.session.flush()
+    else:
+        schedule.mode = PricingMode(mode)
+        db.session.execute(db.delete(CommissionTier).where(CommissionTier.schedule_id == schedule.id))
+    db.session.add_all(CommissionTier(schedule_id=schedule.id, from_amount=amount, rate=rate) for amount, rate in tiers)
+    if assign_ids:
+        db.session.execute(db.update(User).where(User.id.in_(assign_ids)).values(commission_schedule_id=schedule.id))
+    if unassign_ids:
+        db.session.execute(db.update(User).where(User.id.in_(unassign_ids), User.commission_schedule_id == schedule.id)
+                           .values(commission_schedule_id=None))
+    db.session.commit()
+    click.echo(f"Commission schedule {name} ({mode}) saved with {len(tiers)} tiers.")
+
+
+@click.command('reprice-transactions')
+@click.option('--schedule', 'schedule_name', default=None, help="Only users on this commission schedule.")
+@click.option('--user-id', type=int, default=None)
+@click.option('--status', 'statuses', type=click.Choice([status.value for status in TransactionStatus]), multiple=True,
+              help=f"Statuses to reprice (default: {', '.join(status.value for status in REPRICE_STATUSES)}).")
+@click.option('--since', type=click.DateTime(), default=None, help="created_at from (inclusive).")
+@click.option('--until', type=click.DateTime(), default=None, help="created_at before (exclusive).")
+@click.option('--batch-size', type=int, default=10000, show_default=True, help="Rows priced and updated per commit.")
+@click.option('--dry-run', is_flag=True, help="Only report what would change.")
+@with_appcontext
+def reprice_transactions(schedule_name, user_id, statuses, since, until, batch_size, dry_run):
+    # Пересчитывается только записанная комиссия; балансы пользователей не меняются
+    schedule_id = None
+    if schedule_name:
+        schedule_id = db.session.scalar(
+            db.select(CommissionSchedule.id).where(CommissionSchedule.name == schedule_name))
+        if schedule_id is None:
+            raise click.BadParameter(f"No commission schedule named {schedule_name}", param_hint='--schedule')
+    statuses = [TransactionStatus(status) for status in statuses] or REPRICE_STATUSES
+    query = reprice_query(schedule_id, user_id, statuses, since, until)
+
+    started = time.perf_counter()
+    total = changed = difference = 0
+    for through, rows, batch_changed, batch_difference in run_reprice(query, batch_size, dry_run):
+        total += rows
+        changed += batch_changed
+        difference += batch_difference
+        click.echo(f"Up to id {through}: {batch_changed} of {rows} commissions changed")
+    verb = "would change" if dry_run else "changed"
+    click.echo(f"Repriced {total} transactions in {time.perf_counter() - started:.1f} s: {changed} {verb}, "
+               f"commission difference {format_money(difference)}.")
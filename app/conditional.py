@@ -0,0 +1,37 @@
+import hashlib
+import json
+from datetime import timezone
+from flask import request, Response
+
+
+def content_etag(data):
+    return hashlib.sha1(json.dumps(data, sort_keys=True).encode()).hexdigest()
+
+
+def _aware(value):
+    return value.replace(tzinfo=timezone.utc, microsecond=0) if value is not None else None
+
+
+def not_modified(etag, last_modified=None):
+    # 304 без выполнения запроса и рендера, если у клиента актуальная версия; иначе None.
+    # If-None-Match важнее If-Modified-Since (RFC 9110)
+    if request.if_none_match:
+        matched = request.if_none_match.contains(etag)
+    elif request.if_modified_since and last_modified is not None:
+        # Last-Modified округлен до секунды: изменение в ту же секунду, что и Last-Modified у клиента,
+        # по времени не отличить - 304 только если версия старше указанной секунды
+        matched = _aware(last_modified) < request.if_modified_since
+    else:
+        matched = False
+    if not matched:
+        return None
+    return with_validators(Response(status=304), etag, last_modified)
+
+
+def with_validators(response, etag, last_modified=None):
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = _aware(last_modified)
+    # Клиент может хранить ответ, но обязан перепроверять его при каждом запросе
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
@@ -0,0 +1,123 @@
+import os
+
+
+def env_flag(name, default='0'):
+    return os.environ.get(name, default) == '1'
+
+
+class Config:
+    SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL', 'sqlite:///app.db')
+    SECRET_KEY = os.environ.get('SECRET_KEY', 'secret-key')
+    SWAGGER = {
+        'title': 'Transaction API',
+        'uiversion': 3
+    }
+    SESSION_TYPE = 'filesystem'
+
+    # Знаков после запятой в денежных суммах: хранятся целым числом минимальных единиц (app/money.py)
+    MONEY_SCALE = int(os.environ.get('MONEY_SCALE', 2))
+
+    # Параметры движка SQLAlchemy и PRAGMA, выполняемые на каждом новом соединении SQLite
+    SQLALCHEMY_ENGINE_OPTIONS = {}
+    SQLITE_PRAGMAS = {}
+
+    WEBHOOK_DISPATCHER_ENABLED = env_flag('WEBHOOK_DISPATCHER_ENABLED')
+    WEBHOOK_WORKERS = int(os.environ.get('WEBHOOK_WORKERS', 4))
+    WEBHOOK_BATCH_SIZE = int(os.environ.get('WEBHOOK_BATCH_SIZE', 50))
+    WEBHOOK_POLL_INTERVAL = float(os.environ.get('WEBHOOK_POLL_INTERVAL', 1.0))
+    WEBHOOK_TIMEOUT = float(os.environ.get('WEBHOOK_TIMEOUT', 5.0))
+    WEBHOOK_MAX_ATTEMPTS = int(os.environ.get('WEBHOOK_MAX_ATTEMPTS', 8))
+
+    TRANSACTION_TTL = int(os.environ.get('TRANSACTION_TTL', 24 * 60 * 60))  # в секундах
+    EXPIRY_BATCH_SIZE = int(os.environ.get('EXPIRY_BATCH_SIZE', 500))
+    EXPIRY_SWEEP_INTERVAL = float(os.environ.get('EXPIRY_SWEEP_INTERVAL', 0))  # 0 - без фонового потока
+
+    # Ключи Idempotency-Key хранятся в БД не меньше IDEMPOTENCY_KEY_TTL, удаляет их тот же фоновый поток
+    # (EXPIRY_SWEEP_INTERVAL) или `flask purge-idempotency-keys`
+    IDEMPOTENCY_KEY_TTL = int(os.environ.get('IDEMPOTENCY_KEY_TTL', 24 * 60 * 60))  # в секундах
+    IDEMPOTENCY_CACHE_MAX_ENTRIES = int(os.environ.get('IDEMPOTENCY_CACHE_MAX_ENTRIES', 10000))
+    IDEMPOTENCY_CACHE_TTL = float(os.environ.get('IDEMPOTENCY_CACHE_TTL', 600.0))
+    # Сколько дубль ждет завершения первого запроса с тем же ключом, потом - 409
+    IDEMPOTENCY_WAIT_TIMEOUT = float(os.environ.get('IDEMPOTENCY_WAIT_TIMEOUT', 30.0))
+
+    # `flask archive-transactions`: завершенные транзакции старше ARCHIVE_AFTER_DAYS - в transactions_archive
+    ARCHIVE_AFTER_DAYS = int(os.environ.get('ARCHIVE_AFTER_DAYS', 90))
+    ARCHIVE_BATCH_SIZE = int(os.environ.get('ARCHIVE_BATCH_SIZE', 1000))
+
+    # Балансы ведутся журналом ledger_entries. На время перехода LEDGER_DUAL_WRITE=1 продолжает списывать и старую
+    # колонку users.balance, чтобы `flask check-ledger` мог сверить их
+    LEDGER_DUAL_WRITE = env_flag('LEDGER_DUAL_WRITE')
+    LEDGER_SNAPSHOT_BATCH_SIZE = int(os.environ.get('LEDGER_SNAPSHOT_BATCH_SIZE', 1000))
+    # Снимки балансов держат хвост журнала коротким - без них баланс считается по всей истории пользователя.
+    # Фоновый поток раз в LEDGER_SNAPSHOT_INTERVAL секунд; 0 - только `flask snapshot-balances` (cron)
+    LEDGER_SNAPSHOT_INTERVAL = float(os.environ.get('LEDGER_SNAPSHOT_INTERVAL', 60.0))
+
+    CACHE_ENABLED = env_flag('CACHE_ENABLED', '1')
+    CACHE_MAX_ENTRIES = int(os.environ.get('CACHE_MAX_ENTRIES', 10000))
+    CACHE_PENDING_TTL = float(os.environ.get('CACHE_PENDING_TTL', 2.0))  # в секундах
+    CACHE_FINAL_TTL = float(os.environ.get('CACHE_FINAL_TTL', 3600.0))
+    CACHE_REDIS_URL = os.environ.get('CACHE_REDIS_URL')  # общий кэш между процессами, нужен пакет redis
+
+    # Живой дашборд: как часто проверять изменения из других процессов и как часто слать keep-alive
+    DASHBOARD_POLL_INTERVAL = float(os.environ.get('DASHBOARD_POLL_INTERVAL', 5.0))  # в секундах
+    DASHBOARD_STREAM_HEARTBEAT = float(os.environ.get('DASHBOARD_STREAM_HEARTBEAT', 15.0))
+
+    # Метрики запросов и SQL на /metrics; METRICS_ENABLED=0 отключает и хуки, и маршрут
+    METRICS_ENABLED = env_flag('METRICS_ENABLED', '1')
+    METRICS_SLOW_QUERY_MS = float(os.environ.get('METRICS_SLOW_QUERY_MS', 200))
+
+    # Бюджеты SQL-запросов обработчиков (@query_budget); `flask check-query-budgets` включает проверку сам
+    QUERY_BUDGET_ENFORCED = env_flag('QUERY_BUDGET_ENFORCED', '0')
+
+    # Соединения aiosqlite для ASGI-режима (asgi.py)
+    ASYNC_DB_POOL_SIZE = int(os.environ.get('ASYNC_DB_POOL_SIZE', 20))
+
+    # Реплика только для чтения: обработчики с @read_replica (app/replica.py) читают с нее.
+    # После записи клиент REPLICA_PIN_SECONDS секунд читает с основной базы (cookie), чтобы видеть свои изменения
+    REPLICA_DATABASE_URL = os.environ.get('REPLICA_DATABASE_URL')
+    REPLICA_PIN_SECONDS = float(os.environ.get('REPLICA_PIN_SECONDS', 5.0))
+    # Локальная реплика SQLite: копия основного файла через backup API раз в N секунд (0 - без фонового потока)
+    REPLICA_SYNC_INTERVAL = float(os.environ.get('REPLICA_SYNC_INTERVAL', 0))
+
+    WRITE_COALESCING = env_flag('WRITE_COALESCING')
+    WRITE_COALESCE_WINDOW = float(os.environ.get('WRITE_COALESCE_WINDOW', 0.002))  # в секундах
+    WRITE_COALESCE_MAX_BATCH = int(os.environ.get('WRITE_COALESCE_MAX_BATCH', 256))
+
+
+class DevelopmentConfig(Config):
+    SQLITE_PRAGMAS = {
+        'busy_timeout': 5000,
+    }
+
+
+class TestingConfig(Config):
+    TESTING = True
+    WTF_CSRF_ENABLED = False
+    SQLALCHEMY_DATABASE_URI = os.environ.get('TEST_DATABASE_URL', 'sqlite://')
+    LEDGER_SNAPSHOT_INTERVAL = 0
+
+
+class ProductionConfig(Config):
+    SQLITE_PRAGMAS = {
+        'journal_mode': 'WAL',
+        # В режиме WAL NORMAL не теряет целостность, fsync только на checkpoint
+        'synchronous': 'NORMAL',
+        'cache_size': int(os.environ.get('SQLITE_CACHE_SIZE', -64000)),  # отрицательное - в КиБ
+        'mmap_size': int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)),
+        'temp_store': 'MEMORY',
+        'busy_timeout': int(os.environ.get('SQLITE_BUSY_TIMEOUT', 5000)),  # в мс
+    }
+    # Пул на процесс: под потоки воркера (gunicorn --threads), после fork пул сбрасывается в create_app
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 8)),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 8)),
+        'pool_timeout': 10,
+        'pool_pre_ping': True,
+    }
+
+
+config_by_name = {
+    'development': DevelopmentConfig,
+    'testing': TestingConfig,
+    'production': ProductionConfig,
+}
@@ -0,0 +1,40 @@
+import os
+import weakref
+from sqlalchemy import event
+from app import db
+
+
+# Движки всех приложений процесса; хук fork регистрируется один раз на модуль, а не на каждый create_app -
+# os.register_at_fork нельзя отменить, и иначе каждое приложение (в тестах, проверках) держало бы свои движки
+_engines = weakref.WeakSet()
+
+
+def _dispose_after_fork():
+    # Соединения, открытые до fork (gunicorn --preload), не должны использоваться дочерним процессом
+    for engine in list(_engines):
+        engine.dispose(close=False)
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_dispose_after_fork)
+
+
+def sqlite_pragma_hook(pragmas):
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+    return set_pragmas
+
+
+def configure_engines(app):
+    with app.app_context():
+        engines = list(db.engines.values())
+
+    pragmas = app.config['SQLITE_PRAGMAS']
+    for engine in engines:
+        if engine.dialect.name == 'sqlite' and pragmas:
+            event.listen(engine, 'connect', sqlite_pragma_hook(pragmas))
+
+    _engines.update(engines)
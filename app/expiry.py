@@ -0,0 +1,110 @@
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import select
+from app import db
+from app.models import Transaction, TransactionStatus, TransactionRollup, DashboardStats
+from app.webhooks import enqueue_transaction_events, transaction_event
+from app.cache import invalidate_transactions
+from app.idempotency import purge_expired_keys
+
+logger = logging.getLogger(__name__)
+
+
+def expire_stale_transactions(ttl, batch_size=500, pause=0.0, now=None):
+    # Переводит PENDING старше ttl в EXPIRED порциями; на каждую порцию - отдельный короткий коммит.
+    # Отдает (сколько строк истекло, сколько заняла порция в секундах)
+    cutoff = (now or datetime.utcnow()) - ttl
+    while True:
+        started = time.perf_counter()
+        # В SQLite без SQLITE_ENABLE_UPDATE_DELETE_LIMIT нет UPDATE ... LIMIT, поэтому порция - через подзапрос
+        due = (
+            select(Transaction.id)
+            .where(Transaction.status == TransactionStatus.PENDING, Transaction.created_at < cutoff)
+            .order_by(Transaction.created_at)
+            .limit(batch_size)
+        )
+        # Статус проверяется и во внешнем UPDATE: в PostgreSQL (READ COMMITTED) строку могли отменить после
+        # снимка подзапроса - такая не перезаписывается и не попадает в RETURNING, по которому считаются дельты
+        rows = db.session.execute(
+            db.update(Transaction)
+            .where(Transaction.id.in_(due), Transaction.status == TransactionStatus.PENDING)
+            .values(status=TransactionStatus.EXPIRED)
+            .returning(Transaction.id, Transaction.user_id, Transaction.amount, Transaction.commission,
+                       Transaction.created_at)
+            .execution_options(synchronize_session=False)
+        ).all()
+        enqueue_transaction_events([
+            transaction_event(row.id, row.user_id, TransactionStatus.EXPIRED, row.amount, row.commission)
+            for row in rows
+        ])
+        invalidate_transactions(row.id for row in rows)
+        if rows:
+            DashboardStats.apply(transactions_changed=True)
+            TransactionRollup.apply(
+                added=[(row.created_at, row.user_id, TransactionStatus.EXPIRED, row.amount, row.commission)
+                       for row in rows],
+                removed=[(row.created_at, row.user_id, TransactionStatus.PENDING, row.amount, row.commission)
+                         for row in rows],
+            )
+        db.session.commit()
+        yield len(rows), time.perf_counter() - started
+
+        if len(rows) < batch_size:
+            return
+        if pause:
+            time.sleep(pause)
+
+
+class ExpirySweeper:
+    def __init__(self, app, ttl, interval, batch_size=500, pause=0.0, key_ttl=None):
+        self.app = app
+        self.ttl = ttl
+        self.key_ttl = key_ttl
+        self.interval = interval
+        self.batch_size = batch_size
+        self.pause = pause
+        self._stop = threading.Event()
+        self._thread = None
+
+    @classmethod
+    def from_config(cls, app):
+        config = app.config
+        return cls(
+            app,
+            ttl=timedelta(seconds=config['TRANSACTION_TTL']),
+            interval=config['EXPIRY_SWEEP_INTERVAL'],
+            batch_size=config['EXPIRY_BATCH_SIZE'],
+            key_ttl=timedelta(seconds=config['IDEMPOTENCY_KEY_TTL']),
+        )
+
+    def sweep(self):
+        total = 0
+        with self.app.app_context():
+            for expired, elapsed in expire_stale_transactions(self.ttl, self.batch_size, self.pause):
+                total += expired
+                if expired:
+                    logger.info("Expired %d pending transactions in %.1f ms", expired, elapsed * 1000)
+            if self.key_ttl is not None:
+                for deleted, elapsed in purge_expired_keys(self.key_ttl, self.batch_size, self.pause):
+                    if deleted:
+                        logger.info("Purged %d idempotency keys in %.1f ms", deleted, elapsed * 1000)
+        return total
+
+    def run_forever(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.sweep()
+            except Exception:
+                logger.exception("Expiry sweep failed")
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run_forever, name='expiry-sweeper', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
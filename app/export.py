@@ -0,0 +1,89 @@
+import csv
+import gzip
+import io
+import json
+import sys
+from contextlib import contextmanager
+from sqlalchemy import select
+from app import db
+from app.models import transaction_to_dict
+from app.archive import across_tiers
+from app.money import format_money
+
+FORMATS = ('csv', 'ndjson')
+CSV_COLUMNS = ('id', 'user_id', 'amount', 'commission', 'status', 'created_at')
+
+
+def export_query(user_id=None, status=None, since=None, until=None, after_id=0):
+    # Порядок по первичному ключу: выгрузку можно продолжить с последнего id (after_id).
+    # Горячая таблица и архив сливаются по id - у обеих выборок порядок по первичному ключу
+    def build(model):
+        query = select(
+            model.id, model.amount, model.commission, model.status, model.user_id, model.created_at
+        ).where(model.id > after_id)
+        if user_id is not None:
+            query = query.where(model.user_id == user_id)
+        if status is not None:
+            query = query.where(model.status == status)
+        if since is not None:
+            query = query.where(model.created_at >= since)
+        if until is not None:
+            query = query.where(model.created_at < until)
+        return query
+
+    query = across_tiers(build)
+    return query.order_by(query.selected_columns.id)
+
+
+@contextmanager
+def open_export(path, fmt, append=False):
+    # NDJSON всегда сжат gzip; дозапись в .gz дает многосоставной архив, его читают gzip/zcat как один файл.
+    # '-' - stdout, он остается открытым после выгрузки
+    if path == '-':
+        if fmt == 'ndjson':
+            with io.TextIOWrapper(gzip.GzipFile(fileobj=sys.stdout.buffer, mode='wb'), encoding='utf-8') as stream:
+                yield stream
+        else:
+            yield sys.stdout
+        sys.stdout.flush()
+        return
+    mode = 'at' if append else 'wt'
+    if fmt == 'ndjson':
+        stream = gzip.open(path, mode, encoding='utf-8')
+    else:
+        stream = open(path, mode, encoding='utf-8', newline='')
+    with stream:
+        yield stream
+
+
+class ExportProgress:
+    __slots__ = ('count', 'last_id')
+
+    def __init__(self):
+        self.count = 0
+        self.last_id = None
+
+
+def export_transactions(stream, fmt, query, progress, chunk_size=1000, header=True):
+    # Строки идут через курсор БД порциями по chunk_size и сразу пишутся в поток - память не зависит от объема.
+    # progress обновляется после каждой строки: при прерывании по нему продолжают выгрузку (after_id)
+    rows = db.session.execute(query.execution_options(yield_per=chunk_size))
+    try:
+        if fmt == 'csv':
+            writer = csv.writer(stream)
+            if header:
+                writer.writerow(CSV_COLUMNS)
+            for row in rows:
+                # Суммы строкой с фиксированным числом знаков - без округлений при загрузке в таблицы
+                writer.writerow((row.id, row.user_id, format_money(row.amount), format_money(row.commission),
+                                 row.status.value, row.created_at.isoformat()))
+                progress.count += 1
+                progress.last_id = row.id
+        else:
+            for row in rows:
+                stream.write(json.dumps(transaction_to_dict(row)) + '\n')
+                progress.count += 1
+                progress.last_id = row.id
+    finally:
+        rows.close()
+    return progress
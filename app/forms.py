@@ -1,7 +1,8 @@
 from enum import Enum
 from flask_wtf import FlaskForm
-from wtforms import StringField, FloatField, SelectField, SubmitField
-from wtforms.validators import DataRequired, URL
+from wtforms import StringField, FloatField, DecimalField, SelectField, SubmitField
+from wtforms.validators import DataRequired, URL, ValidationError
+from app.money import to_minor
 
 
 class TransactionStatus(Enum):
@@ -10,8 +11,14 @@ class TransactionStatus(Enum):
     CANCELED = "canceled"
     EXPIRED = "expired"
 
+def money_amount(form, field):
+    try:
+        to_minor(field.data)
+    except ValueError as e:
+        raise ValidationError(str(e))
+
 class UserForm(FlaskForm):
-    balance = FloatField('Balance', validators=[DataRequired(message="Balance is required")])
+    balance = DecimalField('Balance', validators=[DataRequired(message="Balance is required"), money_amount])
     commission_rate = FloatField('Commission Rate', validators=[DataRequired(message="Commission rate is required")])
     webhook_url = StringField('Webhook URL', validators=[URL(message="Invalid URL")])
     submit = SubmitField('Submit')
@@ -0,0 +1,176 @@
+import hashlib
+import json
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from flask import current_app, jsonify
+from sqlalchemy import select
+from app import db
+from app.models import IdempotencyKey
+from app.cache import LRUCache
+from app.writer import run_write
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+
+
+class IdempotencyConflict(Exception):
+    # Ключ уже использован с другими параметрами (422) или его запрос еще выполняется (409)
+    def __init__(self, message, status_code):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def request_key(headers):
+    # (ключ, ошибка); без заголовка - (None, None)
+    key = headers.get(HEADER)
+    if key is None:
+        return None, None
+    key = key.strip()
+    if not key or len(key) > MAX_KEY_LENGTH:
+        return None, f"{HEADER} must be 1 to {MAX_KEY_LENGTH} characters"
+    return key, None
+
+
+def request_fingerprint(endpoint, values):
+    # По разобранным параметрам, а не по телу: 10 и 10.00 - один и тот же запрос
+    return hashlib.sha256(json.dumps([endpoint, values], sort_keys=True).encode()).hexdigest()
+
+
+def stored_response(key, fingerprint, row):
+    # (тело, код) сохраненного ответа по строке IdempotencyKey.lookup_statement
+    if row.fingerprint != fingerprint:
+        raise IdempotencyConflict(f"{HEADER} {key} was already used with different parameters", 422)
+    if row.status_code is None:
+        raise IdempotencyConflict(f"A request with {HEADER} {key} is still in progress", 409)
+    return json.loads(row.response), row.status_code
+
+
+class IdempotencyStore:
+    # Ответы по ключам в памяти процесса (повтор без обращения к БД) и сворачивание одновременных дублей:
+    # пока первый запрос с ключом выполняется, остальные с тем же ключом ждут его ответа.
+    # Между процессами то же обеспечивает уникальный ключ в таблице idempotency_keys
+    def __init__(self, cache, cache_ttl=600.0, wait_timeout=30.0):
+        self.cache = cache
+        self.cache_ttl = cache_ttl
+        self.wait_timeout = wait_timeout
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self.replays = 0
+        self.collapsed = 0
+
+    @classmethod
+    def from_config(cls, app):
+        config = app.config
+        return cls(
+            LRUCache(config['IDEMPOTENCY_CACHE_MAX_ENTRIES']),
+            cache_ttl=config['IDEMPOTENCY_CACHE_TTL'],
+            wait_timeout=config['IDEMPOTENCY_WAIT_TIMEOUT'],
+        )
+
+    def cached(self, key, fingerprint):
+        entry = self.cache.get(key)
+        if entry is None:
+            return None
+        if entry[0] != fingerprint:
+            raise IdempotencyConflict(f"{HEADER} {key} was already used with different parameters", 422)
+        self.replays += 1
+        return entry[1], entry[2]
+
+    def remember(self, key, fingerprint, body, status_code):
+        self.cache.set(key, (fingerprint, body, status_code), self.cache_ttl)
+
+    @contextmanager
+    def exclusive(self, key):
+        # Первый запрос с ключом выполняется сразу; дубли ждут его завершения и затем читают его ответ
+        while True:
+            with self._lock:
+                done = self._inflight.get(key)
+                if done is None:
+                    done = self._inflight[key] = threading.Event()
+                    break
+            self.collapsed += 1
+            if not done.wait(self.wait_timeout):
+                raise IdempotencyConflict(f"A request with {HEADER} {key} is still in progress", 409)
+        try:
+            yield
+        finally:
+            with self._lock:
+                del self._inflight[key]
+            done.set()
+
+
+def idempotency_store():
+    return current_app.extensions.get('idempotency_store')
+
+
+def lookup(key, fingerprint):
+    # Чтение без блокировки записи: повтор уже выполненного запроса не трогает users и transactions
+    row = db.session.execute(IdempotencyKey.lookup_statement(key)).first()
+    return stored_response(key, fingerprint, row) if row is not None else None
+
+
+def run_once(key, fingerprint, fn, *args):
+    # Операция записи для run_write: занять ключ, выполнить fn и сохранить ответ в той же транзакции.
+    # Не удалось занять - ключ уже выполнен (в т. ч. другим процессом, чья транзакция завершилась,
+    # пока эта ждала блокировку записи) - отдается сохраненный ответ
+    claimed = db.session.execute(
+        IdempotencyKey.claim_statement(key, fingerprint, db.session.get_bind().dialect.name)).rowcount == 1
+    if not claimed:
+        stored = lookup(key, fingerprint)
+        if stored is None:
+            raise IdempotencyConflict(f"A request with {HEADER} {key} is still in progress", 409)
+        return stored + (True,)
+    body, status_code = fn(*args)
+    db.session.execute(IdempotencyKey.store_statement(key, status_code, json.dumps(body)))
+    return body, status_code, False
+
+
+def idempotent_response(key, endpoint, fn, *args):
+    # fn(*args) -> (тело, код) - операция записи, как для run_write; args - разобранные параметры запроса.
+    # Повтор отдает сохраненный ответ с заголовком Idempotent-Replayed
+    fingerprint = request_fingerprint(endpoint, args)
+    store = idempotency_store()
+    try:
+        with store.exclusive(key):
+            replay = store.cached(key, fingerprint) or lookup(key, fingerprint)
+            if replay is not None:
+                body, status_code = replay
+                replayed = True
+            else:
+                body, status_code, replayed = run_write(run_once, key, fingerprint, fn, *args)
+            store.remember(key, fingerprint, body, status_code)
+    except IdempotencyConflict as e:
+        return jsonify({"error": str(e)}), e.status_code
+    return keyed_response(body, status_code, replayed)
+
+
+def keyed_response(body, status_code, replayed):
+    response = jsonify(body)
+    response.status_code = status_code
+    if replayed:
+        response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def purge_expired_keys(ttl, batch_size=1000, pause=0.0, now=None):
+    # Удаляет ключи старше ttl порциями с отдельным коммитом; отдает число удаленных в каждой порции
+    cutoff = (now or datetime.utcnow()) - ttl
+    while True:
+        started = time.perf_counter()
+        due = (
+            select(IdempotencyKey.key)
+            .where(IdempotencyKey.created_at < cutoff)
+            .order_by(IdempotencyKey.created_at)
+            .limit(batch_size)
+        )
+        deleted = db.session.execute(
+            db.delete(IdempotencyKey).where(IdempotencyKey.key.in_(due)).execution_options(synchronize_session=False)
+        ).rowcount
+        db.session.commit()
+        yield deleted, time.perf_counter() - started
+        if deleted < batch_size:
+            return
+        if pause:
+            time.sleep(pause)
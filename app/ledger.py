@@ -0,0 +1,135 @@
+import logging
+import threading
+import time
+from flask import current_app
+from sqlalchemy import func, select
+from app import db
+from app.models import User, LedgerEntry, BalanceSnapshot
+
+logger = logging.getLogger(__name__)
+
+
+def lock_statements(user_ids, dialect_name):
+    # SQLite выполняет условную вставку под единственной блокировкой записи. В PostgreSQL при READ COMMITTED
+    # две вставки могли бы прочитать один и тот же баланс - списания одного пользователя сериализуются
+    # транзакционной advisory-блокировкой по его id (строки users при этом не переписываются)
+    if dialect_name != 'postgresql':
+        return []
+    return [select(func.pg_advisory_xact_lock(user_id)) for user_id in sorted(user_ids)]
+
+
+def legacy_debit(amounts):
+    # Колонка users.balance повторяет журнал только при LEDGER_DUAL_WRITE - на время перехода
+    if amounts and current_app.config['LEDGER_DUAL_WRITE']:
+        db.session.execute(User.legacy_debit_statement(amounts))
+
+
+def debit(user_id, amount):
+    for statement in lock_statements([user_id], db.session.get_bind().dialect.name):
+        db.session.execute(statement)
+    debited = db.session.execute(LedgerEntry.debit_statement(user_id, amount)).rowcount == 1
+    if debited:
+        legacy_debit({user_id: amount})
+    return debited
+
+
+def debit_many(amounts):
+    # amounts: {user_id: сумма}; множество списанных пользователей
+    for statement in lock_statements(amounts, db.session.get_bind().dialect.name):
+        db.session.execute(statement)
+    debited = set(db.session.scalars(LedgerEntry.debit_many_statement(amounts)))
+    legacy_debit({user_id: amount for user_id, amount in amounts.items() if user_id in debited})
+    return debited
+
+
+def user_balance(user_id):
+    return db.session.scalar(select(LedgerEntry.balance_expression(user_id)))
+
+
+def snapshot_balances(batch_size=1000, pause=0.0):
+    # Снимки по диапазонам id пользователей, на каждый диапазон - отдельный короткий коммит.
+    # Отдает (последний id диапазона, сколько снимков обновлено, сколько заняла порция в секундах)
+    dialect_name = db.session.get_bind().dialect.name
+    after_id = 0
+    while True:
+        started = time.perf_counter()
+        user_ids = db.session.scalars(
+            select(User.id).where(User.id > after_id).order_by(User.id).limit(batch_size)).all()
+        if not user_ids:
+            db.session.rollback()
+            return
+        if dialect_name == 'postgresql':
+            # id записей из последовательности фиксируются не по порядку: снимок ждет незавершенные вставки,
+            # иначе запись с меньшим id, зафиксированная позже, оказалась бы до entry_id и выпала из баланса
+            db.session.execute(db.text('LOCK TABLE ledger_entries IN SHARE MODE'))
+        refreshed = db.session.execute(
+            BalanceSnapshot.refresh_statement(user_ids[0], user_ids[-1], dialect_name)).rowcount
+        db.session.commit()
+        after_id = user_ids[-1]
+        yield after_id, refreshed, time.perf_counter() - started
+
+        if len(user_ids) < batch_size:
+            return
+        if pause:
+            time.sleep(pause)
+
+
+class BalanceSnapshotter:
+    # Периодическое обновление снимков в фоновом потоке процесса. Несколько процессов делают одну и ту же работу
+    # (снимок - upsert по пользователю), но результат от этого не меняется
+    def __init__(self, app, interval, batch_size=1000, pause=0.0):
+        self.app = app
+        self.interval = interval
+        self.batch_size = batch_size
+        self.pause = pause
+        self._stop = threading.Event()
+        self._thread = None
+
+    @classmethod
+    def from_config(cls, app):
+        config = app.config
+        return cls(app, interval=config['LEDGER_SNAPSHOT_INTERVAL'], batch_size=config['LEDGER_SNAPSHOT_BATCH_SIZE'])
+
+    def snapshot(self):
+        total = 0
+        with self.app.app_context():
+            for _, refreshed, elapsed in snapshot_balances(self.batch_size, self.pause):
+                total += refreshed
+                if refreshed:
+                    logger.info("Refreshed %d balance snapshots in %.1f ms", refreshed, elapsed * 1000)
+        return total
+
+    def run_forever(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.snapshot()
+            except Exception:
+                logger.exception("Balance snapshot failed")
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run_forever, name='balance-snapshots', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+
+def ledger_differences(batch_size=1000):
+    # Сверка журнала со старой колонкой users.balance: (user_id, users.balance, баланс по журналу)
+    # для всех расхождений, порциями по id
+    balance = LedgerEntry.balance_expression(User.id).label('ledger_balance')
+    after_id = 0
+    while True:
+        rows = db.session.execute(
+            select(User.id, User.balance, balance).where(User.id > after_id).order_by(User.id).limit(batch_size)
+        ).all()
+        db.session.rollback()
+        if not rows:
+            return
+        after_id = rows[-1].id
+        for row in rows:
+            if row.balance != row.ledger_balance:
+                yield row.id, row.balance, row.ledger_balance
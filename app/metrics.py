@@ -0,0 +1,167 @@
+import logging
+import threading
+import time
+from contextvars import ContextVar
+from flask import request, g
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STATEMENT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+# SQL вне запроса: поток-писатель группового коммита, вебхуки, истечение транзакций
+BACKGROUND = 'background'
+
+_current = ContextVar('request_metrics', default=None)
+
+
+class RequestMetrics:
+    __slots__ = ('endpoint', 'started', 'statements', 'sql_seconds')
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.started = time.perf_counter()
+        self.statements = 0
+        self.sql_seconds = 0.0
+
+
+class Histogram:
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(**labels):
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + '}'
+
+
+class MetricsRegistry:
+    # Счетчики процесса; при нескольких воркерах gunicorn каждый отдает свои, суммирует Prometheus
+    def __init__(self, slow_query_seconds=0.2):
+        self.slow_query_seconds = slow_query_seconds
+        self._lock = threading.Lock()
+        self.requests = {}
+        self.latency = {}
+        self.statements = {}
+        self.sql_statements_total = {}
+        self.sql_seconds_total = {}
+        self.slow_queries = {}
+
+    def record_request(self, metrics, method, status, duration):
+        with self._lock:
+            key = (metrics.endpoint, method, status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            self.latency.setdefault((metrics.endpoint, method), Histogram(LATENCY_BUCKETS)).observe(duration)
+            self.statements.setdefault(metrics.endpoint, Histogram(STATEMENT_BUCKETS)).observe(metrics.statements)
+
+    def record_statement(self, endpoint, seconds):
+        with self._lock:
+            self.sql_statements_total[endpoint] = self.sql_statements_total.get(endpoint, 0) + 1
+            self.sql_seconds_total[endpoint] = self.sql_seconds_total.get(endpoint, 0.0) + seconds
+            if seconds >= self.slow_query_seconds:
+                self.slow_queries[endpoint] = self.slow_queries.get(endpoint, 0) + 1
+
+    def render(self):
+        lines = []
+        with self._lock:
+            lines += ['# HELP http_requests_total Requests by endpoint, method and status.',
+                      '# TYPE http_requests_total counter']
+            for (endpoint, method, status), count in sorted(self.requests.items()):
+                lines.append(f'http_requests_total{_labels(endpoint=endpoint, method=method, status=status)} {count}')
+
+            lines += ['# HELP http_request_duration_seconds Request latency up to the response headers.',
+                      '# TYPE http_request_duration_seconds histogram']
+            for (endpoint, method), histogram in sorted(self.latency.items()):
+                lines += self._histogram('http_request_duration_seconds', histogram, endpoint=endpoint, method=method)
+
+            lines += ['# HELP http_request_sql_statements SQL statements executed per request.',
+                      '# TYPE http_request_sql_statements histogram']
+            for endpoint, histogram in sorted(self.statements.items()):
+                lines += self._histogram('http_request_sql_statements', histogram, endpoint=endpoint)
+
+            for name, kind, help_text, values in (
+                ('sql_statements_total', 'counter', 'SQL statements by endpoint.', self.sql_statements_total),
+                ('sql_duration_seconds_total', 'counter', 'Time spent in SQL by endpoint.', self.sql_seconds_total),
+                ('sql_slow_queries_total', 'counter',
+                 f'SQL statements slower than {self.slow_query_seconds}s by endpoint.', self.slow_queries),
+            ):
+                lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+                for endpoint, value in sorted(values.items()):
+                    lines.append(f'{name}{_labels(endpoint=endpoint)} {value}')
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def _histogram(name, histogram, **labels):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(histogram.buckets, histogram.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{_labels(**labels, le=bound)} {cumulative}')
+        lines.append(f'{name}_bucket{_labels(**labels, le="+Inf")} {histogram.count}')
+        lines.append(f'{name}_sum{_labels(**labels)} {histogram.sum}')
+        lines.append(f'{name}_count{_labels(**labels)} {histogram.count}')
+        return lines
+
+
+def instrument_engine(engine, registry):
+    @event.listens_for(engine, 'before_cursor_execute')
+    def _started(conn, cursor, statement, parameters, context, executemany):
+        context._metrics_started = time.perf_counter()
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def _finished(conn, cursor, statement, parameters, context, executemany):
+        seconds = time.perf_counter() - context._metrics_started
+        metrics = _current.get()
+        if metrics is not None:
+            metrics.statements += 1
+            metrics.sql_seconds += seconds
+        endpoint = metrics.endpoint if metrics is not None else BACKGROUND
+        registry.record_statement(endpoint, seconds)
+        if seconds >= registry.slow_query_seconds:
+            logger.warning("Slow query in %s: %.1f ms: %s", endpoint, seconds * 1000, ' '.join(statement.split()))
+
+
+def init_metrics(app):
+    from app import db
+    registry = MetricsRegistry(slow_query_seconds=app.config['METRICS_SLOW_QUERY_MS'] / 1000)
+    app.extensions['metrics'] = registry
+    with app.app_context():
+        for engine in db.engines.values():
+            instrument_engine(engine, registry)
+
+    @app.before_request
+    def _start_request():
+        # Без url_rule (404) - одна метка на все неизвестные адреса, чтобы не раздувать число рядов
+        g.request_metrics_token = _current.set(RequestMetrics(request.endpoint or 'unmatched'))
+
+    @app.after_request
+    def _finish_request(response):
+        metrics = _current.get()
+        if metrics is not None:
+            duration = time.perf_counter() - metrics.started
+            registry.record_request(metrics, request.method, response.status_code, duration)
+        return response
+
+    @app.teardown_request
+    def _reset_request(exc):
+        token = g.pop('request_metrics_token', None)
+        if token is not None:
+            _current.reset(token)
+
+    return registry
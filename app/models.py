@@ -1,6 +1,8 @@
 from datetime import datetime
 from enum import Enum
+from sqlalchemy.dialects import postgresql, sqlite
 from app import db
+from app.money import to_major
 
 
 class TransactionStatus(Enum):
@@ -13,16 +15,40 @@ class UserRole(Enum):
     ADMIN = "admin"
     USER = "user"
 
+class WebhookStatus(Enum):
+    PENDING = "pending"
+    DELIVERED = "delivered"
+    FAILED = "failed"
+
+class PricingMode(Enum):
+    # tiered - каждая часть суммы по ставке своей ступени; volume - вся сумма по ставке ступени, куда она попала
+    TIERED = "tiered"
+    VOLUME = "volume"
+
+class LedgerKind(Enum):
+    OPENING = "opening"  # начальный баланс пользователя
+    DEBIT = "debit"
+
 class User(db.Model):
     __tablename__ = 'users'
+    # id не переиспользуются: записи журнала удаленного пользователя не достанутся новому
+    __table_args__ = {'sqlite_autoincrement': True}
 
     id = db.Column(db.Integer, primary_key=True)
-    balance = db.Column(db.Float, nullable=False, default=0.0)
+    # Денежные колонки - целые минимальные единицы (app/money.py).
+    # balance - начальный баланс; текущий - по журналу (LedgerEntry.balance_expression), колонку списания
+    # меняют только при LEDGER_DUAL_WRITE
+    balance = db.Column(db.BigInteger, nullable=False, default=0)
     commission_rate = db.Column(db.Float, nullable=False, default=0.0)
     webhook_url = db.Column(db.String(255), nullable=True)
     role = db.Column(db.Enum(UserRole), nullable=False, default=UserRole.USER)
+    # Тарифная сетка комиссии; без нее - плоская ставка commission_rate
+    commission_schedule_id = db.Column(db.Integer, db.ForeignKey('commission_schedules.id'), nullable=True)
 
-    transactions = db.relationship('Transaction', back_populates='user', cascade="all, delete-orphan")
+    # Связи не подгружаются неявно (N+1): нужна - загружайте явно (selectinload/joinedload).
+    # Транзакции пользователя удаляются одним DELETE в users._delete_user, ORM их не загружает
+    transactions = db.relationship('Transaction', back_populates='user', cascade="all, delete-orphan",
+                                   passive_deletes=True, lazy='raise_on_sql')
 
     def __repr__(self):
         return f"<User(id={self.id}, balance={self.balance}, commission_rate={self.commission_rate})>"
@@ -30,19 +56,460 @@ class User(db.Model):
     def is_admin(self):
         return self.role == UserRole.ADMIN
 
+    @classmethod
+    def legacy_debit_statement(cls, amounts):
+        # Старая колонка balance при LEDGER_DUAL_WRITE: {user_id: сумма}. Без проверки средств -
+        # решает журнал (LedgerEntry.debit_statement), колонка только повторяет его для `flask check-ledger`
+        amount = db.case(amounts, value=cls.id)
+        return (
+            db.update(cls)
+            .where(cls.id.in_(list(amounts)))
+            .values(balance=cls.balance - amount)
+            .execution_options(synchronize_session=False)
+        )
+
+
+@db.event.listens_for(User, 'after_insert')
+def _open_ledger_account(mapper, connection, user):
+    # Пользователь, созданный через ORM, получает начальный баланс записью журнала.
+    # Вставки Core (bulk-import, сиды) открывают счета через LedgerEntry.open_accounts_statement
+    connection.execute(LedgerEntry.__table__.insert().values(
+        user_id=user.id, amount=user.balance or 0, kind=LedgerKind.OPENING, created_at=datetime.utcnow()))
+
+
+class CommissionSchedule(db.Model):
+    __tablename__ = 'commission_schedules'
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(64), nullable=False, unique=True)
+    mode = db.Column(db.Enum(PricingMode), nullable=False)
+
+    tiers = db.relationship('CommissionTier', cascade="all, delete-orphan", order_by='CommissionTier.from_amount',
+                            lazy='raise_on_sql')
+
+    def __repr__(self):
+        return f"<CommissionSchedule(id={self.id}, name={self.name}, mode={self.mode.value})>"
+
+
+class CommissionTier(db.Model):
+    __tablename__ = 'commission_tiers'
+
+    schedule_id = db.Column(db.Integer, db.ForeignKey('commission_schedules.id', ondelete='CASCADE'),
+                            primary_key=True)
+    # Нижняя граница ступени в минимальных единицах; первая ступень начинается с 0
+    from_amount = db.Column(db.BigInteger, primary_key=True)
+    rate = db.Column(db.Float, nullable=False)
+
+    def __repr__(self):
+        return f"<CommissionTier(schedule_id={self.schedule_id}, from_amount={self.from_amount}, rate={self.rate})>"
+
 
 class Transaction(db.Model):
     __tablename__ = 'transactions'
+    __table_args__ = (
+        # Фильтры списка транзакций (user_id/status) с сортировкой по created_at
+        db.Index('ix_transactions_user_id_status_created_at', 'user_id', 'status', 'created_at'),
+        db.Index('ix_transactions_status_created_at', 'status', 'created_at'),
+        # Последние транзакции на дашборде и постраничный вывод без фильтров
+        db.Index('ix_transactions_created_at', 'created_at'),
+        # id не переиспользуются после переноса старших строк в архив (transactions_archive)
+        {'sqlite_autoincrement': True},
+    )
 
     id = db.Column(db.Integer, primary_key=True)
-    amount = db.Column(db.Float, nullable=False)
-    commission = db.Column(db.Float, nullable=False)
+    amount = db.Column(db.BigInteger, nullable=False)
+    commission = db.Column(db.BigInteger, nullable=False)
     status = db.Column(db.Enum(TransactionStatus), nullable=False, default=TransactionStatus.PENDING)
     created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    # Время последнего изменения строки (Last-Modified); у строк до миграции пусто - берется created_at
+    updated_at = db.Column(db.DateTime, nullable=True, default=datetime.utcnow, onupdate=datetime.utcnow)
 
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
-    user = db.relationship('User', back_populates='transactions')
+    user = db.relationship('User', back_populates='transactions', lazy='raise_on_sql')
 
     def __repr__(self):
         return (f"<Transaction(id={self.id}, amount={self.amount}, commission={self.commission}, "
                 f"status={self.status.value}, user_id={self.user_id})>")
+
+    @classmethod
+    def transition_statement(cls, transaction_id, from_status, to_status):
+        # Смена статуса проходит, только если статус не успели изменить параллельно
+        return (
+            db.update(cls)
+            .where(cls.id == transaction_id, cls.status == from_status)
+            .values(status=to_status)
+            .execution_options(synchronize_session=False)
+        )
+
+    @classmethod
+    def transition(cls, transaction_id, from_status, to_status):
+        return db.session.execute(cls.transition_statement(transaction_id, from_status, to_status)).rowcount == 1
+
+
+class ArchivedTransaction(db.Model):
+    # Завершенные транзакции старше ARCHIVE_AFTER_DAYS, перенесенные `flask archive-transactions` (app/archive.py).
+    # Строки не меняются; id те же, что были в transactions
+    __tablename__ = 'transactions_archive'
+    __table_args__ = (
+        db.Index('ix_transactions_archive_user_id', 'user_id'),
+        db.Index('ix_transactions_archive_created_at', 'created_at'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    amount = db.Column(db.BigInteger, nullable=False)
+    commission = db.Column(db.BigInteger, nullable=False)
+    status = db.Column(db.Enum(TransactionStatus), nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False)
+    updated_at = db.Column(db.DateTime, nullable=True)
+    archived_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+
+    def __repr__(self):
+        return (f"<ArchivedTransaction(id={self.id}, amount={self.amount}, commission={self.commission}, "
+                f"status={self.status.value}, user_id={self.user_id})>")
+
+
+def transaction_to_dict(row):
+    # Принимает как объект Transaction, так и строку результата select() с теми же колонками
+    return {
+        "id": row.id,
+        "amount": to_major(row.amount),
+        "commission": to_major(row.commission),
+        "status": row.status.value,
+        "user_id": row.user_id,
+        "created_at": row.created_at.isoformat()
+    }
+
+
+class WebhookEvent(db.Model):
+    __tablename__ = 'webhook_events'
+    __table_args__ = (
+        # Выборка готовых к отправке событий диспетчером
+        db.Index('ix_webhook_events_status_next_attempt_at', 'status', 'next_attempt_at'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    # Без внешнего ключа: событие должно быть доставлено и после удаления пользователя
+    user_id = db.Column(db.Integer, nullable=False)
+    url = db.Column(db.String(255), nullable=False)
+    payload = db.Column(db.Text, nullable=False)
+    status = db.Column(db.Enum(WebhookStatus), nullable=False, default=WebhookStatus.PENDING)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    delivered_at = db.Column(db.DateTime, nullable=True)
+    last_error = db.Column(db.String(255), nullable=True)
+
+    def __repr__(self):
+        return (f"<WebhookEvent(id={self.id}, user_id={self.user_id}, status={self.status.value}, "
+                f"attempts={self.attempts})>")
+
+
+class IdempotencyKey(db.Model):
+    __tablename__ = 'idempotency_keys'
+    __table_args__ = (
+        # Удаление ключей старше IDEMPOTENCY_KEY_TTL
+        db.Index('ix_idempotency_keys_created_at', 'created_at'),
+    )
+
+    # Первичный ключ - уникальный индекс: второй запрос с тем же ключом не может занять его параллельно
+    key = db.Column(db.String(255), primary_key=True)
+    # Хэш маршрута и разобранных параметров: тот же ключ с другим запросом - ошибка клиента
+    fingerprint = db.Column(db.String(64), nullable=False)
+    # Пусто, пока запрос, занявший ключ, не завершен (видно только внутри его транзакции)
+    status_code = db.Column(db.Integer, nullable=True)
+    response = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<IdempotencyKey(key={self.key}, status_code={self.status_code})>"
+
+    @classmethod
+    def lookup_statement(cls, key):
+        return db.select(cls.fingerprint, cls.status_code, cls.response).where(cls.key == key)
+
+    @classmethod
+    def claim_statement(cls, key, fingerprint, dialect_name):
+        # INSERT ... ON CONFLICT DO NOTHING: rowcount 1 - ключ занят этим запросом, 0 - он уже есть
+        insert = postgresql.insert if dialect_name == 'postgresql' else sqlite.insert
+        return insert(cls).values(key=key, fingerprint=fingerprint, created_at=datetime.utcnow()) \
+            .on_conflict_do_nothing(index_elements=['key'])
+
+    @classmethod
+    def store_statement(cls, key, status_code, response):
+        return (
+            db.update(cls)
+            .where(cls.key == key)
+            .values(status_code=status_code, response=response)
+            .execution_options(synchronize_session=False)
+        )
+
+
+class LedgerEntry(db.Model):
+    # Журнал движения средств: только вставки, строки не меняются и не удаляются (в т. ч. при удалении
+    # пользователя). Баланс - последний снимок (BalanceSnapshot) плюс сумма записей после него
+    __tablename__ = 'ledger_entries'
+    __table_args__ = (
+        # Хвост после снимка: поиск по (user_id, id > entry_id), сумма - из самого индекса
+        db.Index('ix_ledger_entries_user_id_id_amount', 'user_id', 'id', 'amount'),
+        {'sqlite_autoincrement': True},
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    # Без внешнего ключа: журнал остается и после удаления пользователя
+    user_id = db.Column(db.Integer, nullable=False)
+    # Зачисление - положительная сумма, списание - отрицательная; в минимальных единицах
+    amount = db.Column(db.BigInteger, nullable=False)
+    kind = db.Column(db.Enum(LedgerKind), nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<LedgerEntry(id={self.id}, user_id={self.user_id}, amount={self.amount}, kind={self.kind.value})>"
+
+    @classmethod
+    def balance_expression(cls, user_id):
+        # user_id - колонка внешнего запроса (User.id) или число
+        snapshot = BalanceSnapshot
+        # correlate_except: внутри подзапроса хвоста колонка User.id все равно берется из внешнего запроса
+        snapshot_balance = (db.select(snapshot.balance).where(snapshot.user_id == user_id)
+                            .correlate_except(snapshot).scalar_subquery())
+        snapshot_entry = (db.select(snapshot.entry_id).where(snapshot.user_id == user_id)
+                          .correlate_except(snapshot).scalar_subquery())
+        tail = (
+            db.select(db.func.coalesce(db.func.sum(cls.amount), 0))
+            .where(cls.user_id == user_id, cls.id > db.func.coalesce(snapshot_entry, 0))
+            .scalar_subquery()
+        )
+        return db.func.coalesce(snapshot_balance, 0) + tail
+
+    @classmethod
+    def debit_statement(cls, user_id, amount):
+        # Проверка средств и списание - одна условная вставка: строка появляется, только если баланс >= amount.
+        # Чтение баланса и вставка в одном операторе под блокировкой записи SQLite
+        return db.insert(cls).from_select(
+            ['user_id', 'amount', 'kind', 'created_at'],
+            db.select(db.literal(user_id), db.literal(-amount), db.literal(LedgerKind.DEBIT, cls.kind.type),
+                      db.literal(datetime.utcnow(), db.DateTime))
+            .where(cls.balance_expression(user_id) >= amount)
+        )
+
+    @classmethod
+    def debit_many_statement(cls, amounts):
+        # amounts: {user_id: сумма}; RETURNING отдает id тех, у кого хватило средств и кто списан
+        amount = db.case(amounts, value=User.id)
+        return db.insert(cls).from_select(
+            ['user_id', 'amount', 'kind', 'created_at'],
+            db.select(User.id, -amount, db.literal(LedgerKind.DEBIT, cls.kind.type),
+                      db.literal(datetime.utcnow(), db.DateTime))
+            .where(User.id.in_(list(amounts)), cls.balance_expression(User.id) >= amount)
+        ).returning(cls.user_id)
+
+    @classmethod
+    def open_accounts_statement(cls, user_ids=None):
+        # Начальный баланс из users.balance для пользователей без записей в журнале
+        # (перенос данных и загрузка пользователей Core-вставками)
+        query = (
+            db.select(User.id, User.balance, db.literal(LedgerKind.OPENING, cls.kind.type),
+                      db.literal(datetime.utcnow(), db.DateTime))
+            .where(~db.select(cls.id).where(cls.user_id == User.id).exists())
+        )
+        if user_ids is not None:
+            query = query.where(User.id.in_(user_ids))
+        return db.insert(cls).from_select(['user_id', 'amount', 'kind', 'created_at'], query)
+
+
+class BalanceSnapshot(db.Model):
+    # Баланс пользователя по записям журнала до entry_id включительно; обновляется периодически
+    # (`flask snapshot-balances`, фоновый поток EXPIRY_SWEEP_INTERVAL), не на каждом списании
+    __tablename__ = 'balance_snapshots'
+
+    user_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    entry_id = db.Column(db.Integer, nullable=False)
+    balance = db.Column(db.BigInteger, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<BalanceSnapshot(user_id={self.user_id}, entry_id={self.entry_id}, balance={self.balance})>"
+
+    @classmethod
+    def refresh_statement(cls, first_user_id, last_user_id, dialect_name):
+        # Снимки пользователей из диапазона id, у которых после снимка появились записи: один INSERT ... SELECT
+        # с группировкой по хвостам журнала и ON CONFLICT DO UPDATE
+        entry = LedgerEntry
+        query = (
+            db.select(entry.user_id, db.func.max(entry.id), db.func.coalesce(db.func.max(cls.balance), 0)
+                      + db.func.sum(entry.amount), db.literal(datetime.utcnow(), db.DateTime))
+            .select_from(entry)
+            .outerjoin(cls, cls.user_id == entry.user_id)
+            .where(entry.user_id.between(first_user_id, last_user_id),
+                   entry.id > db.func.coalesce(cls.entry_id, 0))
+            .group_by(entry.user_id)
+        )
+        insert = postgresql.insert if dialect_name == 'postgresql' else sqlite.insert
+        stmt = insert(cls).from_select(['user_id', 'entry_id', 'balance', 'created_at'], query)
+        return stmt.on_conflict_do_update(
+            index_elements=['user_id'],
+            set_={'entry_id': stmt.excluded.entry_id, 'balance': stmt.excluded.balance,
+                  'created_at': stmt.excluded.created_at},
+        )
+
+
+class TransactionRollup(db.Model):
+    __tablename__ = 'transaction_rollups'
+
+    # Агрегаты по времени создания транзакции: (период, пользователь, начало интервала, текущий статус).
+    # Обновляются в той же транзакции, что и запись данных (apply), историю пересчитывает `flask rebuild-rollups`
+    PERIODS = ('hour', 'day')
+    # Строки по всем пользователям сразу - глобальные запросы не суммируют тысячи пользовательских строк
+    ALL_USERS = 0
+    # Лимит строк в одном INSERT ... VALUES (ограничение числа параметров SQLite)
+    UPSERT_CHUNK = 1000
+
+    # Первичный ключ в порядке запросов /analytics: период и пользователь - равенство, интервалы - диапазон
+    period = db.Column(db.String(8), primary_key=True)
+    # Без внешнего ключа: в строках ALL_USERS здесь 0
+    user_id = db.Column(db.Integer, primary_key=True)
+    bucket = db.Column(db.DateTime, primary_key=True)
+    status = db.Column(db.Enum(TransactionStatus), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    amount = db.Column(db.BigInteger, nullable=False, default=0)
+    commission = db.Column(db.BigInteger, nullable=False, default=0)
+
+    def __repr__(self):
+        return (f"<TransactionRollup(period={self.period}, user_id={self.user_id}, bucket={self.bucket}, "
+                f"status={self.status.value}, count={self.count})>")
+
+    @staticmethod
+    def bucket_start(period, moment):
+        if period == 'hour':
+            return moment.replace(minute=0, second=0, microsecond=0)
+        return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+
+    @classmethod
+    def deltas(cls, added=(), removed=(), per_user=True):
+        # added/removed - (created_at, user_id, status, amount, commission) транзакций, вошедших в агрегаты
+        # или вышедших из них (смена статуса - выход из старого и вход в новый)
+        totals = {}
+        for sign, items in ((1, added), (-1, removed)):
+            for created_at, user_id, status, amount, commission in items:
+                users = (user_id, cls.ALL_USERS) if per_user else (cls.ALL_USERS,)
+                for period in cls.PERIODS:
+                    bucket = cls.bucket_start(period, created_at)
+                    for rollup_user_id in users:
+                        total = totals.setdefault((period, rollup_user_id, bucket, status), [0, 0, 0])
+                        total[0] += sign
+                        total[1] += sign * amount
+                        total[2] += sign * commission
+        return [
+            {'period': period, 'user_id': user_id, 'bucket': bucket, 'status': status,
+             'count': count, 'amount': amount, 'commission': commission}
+            for (period, user_id, bucket, status), (count, amount, commission) in totals.items()
+            if count or amount or commission
+        ]
+
+    @classmethod
+    def apply_statements(cls, rows, dialect_name):
+        # Инкремент на стороне БД: INSERT ... ON CONFLICT DO UPDATE, одна инструкция на UPSERT_CHUNK строк
+        insert = postgresql.insert if dialect_name == 'postgresql' else sqlite.insert
+        for start in range(0, len(rows), cls.UPSERT_CHUNK):
+            stmt = insert(cls).values(rows[start:start + cls.UPSERT_CHUNK])
+            yield stmt.on_conflict_do_update(
+                index_elements=['period', 'user_id', 'bucket', 'status'],
+                set_={name: getattr(cls, name) + stmt.excluded[name] for name in ('count', 'amount', 'commission')}
+            )
+
+    @classmethod
+    def apply(cls, added=(), removed=(), per_user=True):
+        rows = cls.deltas(added, removed, per_user)
+        for stmt in cls.apply_statements(rows, db.session.get_bind().dialect.name):
+            db.session.execute(stmt)
+
+
+class DashboardStats(db.Model):
+    __tablename__ = 'dashboard_stats'
+
+    # Единственная строка со счетчиками, обновляется в той же транзакции, что и запись данных
+    ROW_ID = 1
+
+    id = db.Column(db.Integer, primary_key=True)
+    total_users = db.Column(db.Integer, nullable=False, default=0)
+    total_transactions = db.Column(db.Integer, nullable=False, default=0)
+    total_transaction_amount = db.Column(db.BigInteger, nullable=False, default=0)
+    # Счетчики изменений таблиц - дешевая версия данных для ETag/Last-Modified
+    users_version = db.Column(db.Integer, nullable=False, default=0)
+    transactions_version = db.Column(db.Integer, nullable=False, default=0)
+    changed_at = db.Column(db.DateTime, nullable=True)
+    # Меняется при массовой перезаписи строк мимо смены статуса (пересчет комиссий): по ней процессы
+    # сбрасывают локальный кэш /check_transaction, где завершенные транзакции лежат CACHE_FINAL_TTL
+    cache_version = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return (f"<DashboardStats(total_users={self.total_users}, total_transactions={self.total_transactions}, "
+                f"total_transaction_amount={self.total_transaction_amount})>")
+
+    @classmethod
+    def apply_statement(cls, users=0, transactions=0, amount=0, users_changed=False, transactions_changed=False,
+                        rows_rewritten=False):
+        # Инкремент на стороне БД, без чтения строки в Python
+        values = dict(
+            total_users=cls.total_users + users,
+            total_transactions=cls.total_transactions + transactions,
+            total_transaction_amount=cls.total_transaction_amount + amount,
+            changed_at=datetime.utcnow()
+        )
+        if users or users_changed:
+            values['users_version'] = cls.users_version + 1
+        if transactions or amount or transactions_changed:
+            values['transactions_version'] = cls.transactions_version + 1
+        if rows_rewritten:
+            values['cache_version'] = cls.cache_version + 1
+        return db.update(cls).where(cls.id == cls.ROW_ID).values(**values)
+
+    @classmethod
+    def apply(cls, **changes):
+        result = db.session.execute(cls.apply_statement(**changes))
+        # После коммита разбудит поток живого дашборда (app/notifier.py)
+        db.session.info['dashboard_changed'] = True
+        if result.rowcount == 0:
+            # Строки еще нет (база создана без миграций) - считаем с нуля, изменения уже во flush
+            db.session.add(cls(id=cls.ROW_ID, users_version=1, transactions_version=1, cache_version=1,
+                               changed_at=datetime.utcnow(), **cls.compute()))
+
+    @classmethod
+    def current(cls):
+        stats = db.session.get(cls, cls.ROW_ID)
+        if stats is None:
+            stats = cls(id=cls.ROW_ID, users_version=0, transactions_version=0, **cls.compute())
+        return stats
+
+    @staticmethod
+    def compute():
+        return {
+            'total_users': db.session.query(db.func.count(User.id)).scalar(),
+            # Итоги по обоим хранилищам: перенос в архив их не меняет
+            'total_transactions': sum(db.session.query(db.func.count(model.id)).scalar()
+                                      for model in (Transaction, ArchivedTransaction)),
+            'total_transaction_amount': sum(db.session.query(db.func.sum(model.amount)).scalar() or 0
+                                            for model in (Transaction, ArchivedTransaction)),
+        }
+
+    @classmethod
+    def rebuild(cls, expected=None):
+        # Пересчет по сырым данным; новые версии - чтобы клиенты с ETag получили пересчитанные значения
+        expected = expected or cls.compute()
+        stats = cls.current()
+        for name, value in expected.items():
+            setattr(stats, name, value)
+        stats.users_version = (stats.users_version or 0) + 1
+        stats.transactions_version = (stats.transactions_version or 0) + 1
+        stats.changed_at = datetime.utcnow()
+        db.session.add(stats)
+        db.session.info['dashboard_changed'] = True
+        return stats
+
+    def differences(self, expected):
+        # Все счетчики целые (суммы - в минимальных единицах), сравнение точное
+        return {
+            name: (getattr(self, name), value)
+            for name, value in expected.items() if getattr(self, name) != value
+        }
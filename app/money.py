@@ -0,0 +1,61 @@
+from decimal import Decimal, InvalidOperation
+from app.config import Config
+
+# Суммы хранятся и считаются целым числом минимальных единиц (центов): в БД BIGINT, в Python int.
+# SCALE фиксирован для базы - смена требует пересчета данных (см. миграцию f3b5c7d9e124)
+SCALE = Config.MONEY_SCALE
+FACTOR = 10 ** SCALE
+# Ставка комиссии переводится в миллионные доли, чтобы комиссия считалась в целых числах
+RATE_FACTOR = 10 ** 6
+# Предел суммы в минимальных единицах: с запасом до BIGINT (2**63 - 1), чтобы сумма с комиссией
+# и итоги по нескольким суммам тоже помещались в INTEGER SQLite, а сумма x ставка в миллионных долях -
+# в int64 векторного расчета комиссий (pricing.PricingEngine)
+MAX_MINOR = 10 ** 12
+
+
+class MoneyPrecisionError(ValueError):
+    pass
+
+
+class MoneyRangeError(ValueError):
+    pass
+
+
+def to_minor(value):
+    # Сумма из ввода (строка, число) в минимальные единицы; больше SCALE знаков после запятой - ошибка
+    if isinstance(value, bool):
+        raise ValueError("Amount must be numeric")
+    try:
+        amount = Decimal(str(value))
+    except (InvalidOperation, ValueError):
+        raise ValueError("Amount must be numeric")
+    if not amount.is_finite():
+        raise ValueError("Amount must be numeric")
+    minor = amount.scaleb(SCALE)
+    if minor != minor.to_integral_value():
+        raise MoneyPrecisionError(f"amount must have at most {SCALE} decimal places")
+    if abs(minor) > MAX_MINOR:
+        raise MoneyRangeError(f"amount must be at most {format_money(MAX_MINOR)}")
+    return int(minor)
+
+
+def to_major(minor):
+    # Для JSON: деление int на степень десяти округляется корректно, 12.34 остается 12.34
+    return minor / FACTOR
+
+
+def format_money(minor):
+    if minor is None:
+        return ''
+    sign = '-' if minor < 0 else ''
+    whole, fraction = divmod(abs(minor), FACTOR)
+    return f"{sign}{whole}.{fraction:0{SCALE}d}" if SCALE else f"{sign}{whole}"
+
+
+def rate_units(rate):
+    return round(rate * RATE_FACTOR)
+
+
+def commission_for(amount, rate):
+    # amount - в минимальных единицах; округление половины вверх, только целочисленная арифметика
+    return (amount * rate_units(rate) + RATE_FACTOR // 2) // RATE_FACTOR
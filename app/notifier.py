@@ -0,0 +1,172 @@
+import logging
+import threading
+import time
+from flask import current_app
+from sqlalchemy import event, select
+from app import db
+from app.models import Transaction, DashboardStats
+from app.money import format_money
+
+logger = logging.getLogger(__name__)
+
+RECENT_LIMIT = 5
+TOTALS = ('total_users', 'total_transactions', 'total_transaction_amount')
+
+
+class Subscription:
+    # Накопленные для одного открытого дашборда изменения; отдаются не чаще, чем раз в throttle секунд
+    def __init__(self, throttle):
+        self.throttle = throttle
+        self.closed = False
+        self._cond = threading.Condition()
+        self._version = None
+        self._totals = None
+        self._transactions = []
+        self._sent_at = float('-inf')
+
+    def push(self, version, totals, transactions):
+        with self._cond:
+            self._version = version
+            if totals is not None:
+                self._totals = totals
+            # На дашборде видны только последние RECENT_LIMIT, более старые между отправками не нужны
+            self._transactions = (transactions + self._transactions)[:RECENT_LIMIT]
+            self._cond.notify()
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify()
+
+    def wait(self, heartbeat):
+        # (версия, изменение) или None, если за heartbeat секунд отправлять нечего
+        with self._cond:
+            deadline = time.monotonic() + heartbeat
+            while not self.closed:
+                now = time.monotonic()
+                pending = self._totals is not None or self._transactions
+                ready_at = self._sent_at + self.throttle
+                if pending and now >= ready_at:
+                    change = {'totals': self._totals, 'transactions': self._transactions}
+                    self._totals, self._transactions = None, []
+                    self._sent_at = now
+                    return self._version, change
+                if now >= deadline:
+                    return None
+                self._cond.wait(min(deadline, ready_at) - now if pending else deadline - now)
+            return None
+
+
+class DashboardNotifier:
+    # Один поток на процесс читает изменения и раздает их всем подпискам, вместо запросов от каждой вкладки
+    def __init__(self, app, poll_interval=5.0):
+        self.app = app
+        self.poll_interval = poll_interval
+        self.checks = 0
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._version = None
+        self._totals = None
+        self._last_id = None
+
+    @classmethod
+    def from_config(cls, app):
+        return cls(app, poll_interval=app.config['DASHBOARD_POLL_INTERVAL'])
+
+    def subscribe(self, throttle):
+        subscription = Subscription(throttle)
+        with self._lock:
+            self._subscribers.add(subscription)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self.run_forever, name='dashboard-notifier', daemon=True)
+                self._thread.start()
+            version, totals = self._version, self._totals
+        # Текущие итоги без запроса к БД, если поток уже работает
+        if totals is not None:
+            subscription.push(version, totals, [])
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+        subscription.close()
+
+    def wake(self):
+        self._wake.set()
+
+    def check(self):
+        # Один запрос по первичному ключу строки счетчиков; транзакции читаются, только если версия сменилась
+        self.checks += 1
+        stats = db.session.execute(
+            select(DashboardStats.users_version, DashboardStats.transactions_version,
+                   *(getattr(DashboardStats, name) for name in TOTALS))
+            .where(DashboardStats.id == DashboardStats.ROW_ID)
+        ).first()
+        if stats is None:
+            return None
+        version = f"{stats.users_version}-{stats.transactions_version}"
+        if version == self._version:
+            return None
+        self._version = version
+
+        totals = {name: getattr(stats, name) for name in TOTALS}
+        # Суммы - строкой в том же виде, что и на странице (фильтр money)
+        totals['total_transaction_amount'] = format_money(totals['total_transaction_amount'])
+        changed_totals = totals if totals != self._totals else None
+        self._totals = totals
+
+        query = select(Transaction.id, Transaction.amount, Transaction.status) \
+            .order_by(Transaction.id.desc()).limit(RECENT_LIMIT)
+        if self._last_id is not None:
+            query = query.where(Transaction.id > self._last_id)
+        rows = db.session.execute(query).all()
+        transactions = [
+            {'id': row.id, 'amount': format_money(row.amount), 'status': row.status.value} for row in rows
+        ] if self._last_id is not None else []
+        if rows:
+            self._last_id = rows[0].id
+        elif self._last_id is None:
+            self._last_id = 0
+        return version, changed_totals, transactions
+
+    def publish(self, version, totals, transactions):
+        if totals is None and not transactions:
+            return
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            subscription.push(version, totals, transactions)
+
+    def run_forever(self):
+        while True:
+            with self._lock:
+                # Последняя вкладка закрылась - поток завершается, следующая подписка запустит новый
+                if not self._subscribers:
+                    self._thread = None
+                    return
+            try:
+                with self.app.app_context():
+                    change = self.check()
+                if change is not None:
+                    self.publish(*change)
+            except Exception:
+                logger.exception("Dashboard change check failed")
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+
+
+@event.listens_for(db.session, 'after_commit')
+def _wake_after_commit(session):
+    # Изменения из этого процесса доходят сразу, из других - за DASHBOARD_POLL_INTERVAL
+    if session.info.pop('dashboard_changed', False):
+        notifier = current_app.extensions.get('dashboard_notifier')
+        if notifier is not None:
+            notifier.wake()
+
+
+@event.listens_for(db.session, 'after_soft_rollback')
+def _forget_dashboard_change(session, previous_transaction):
+    if previous_transaction.parent is None:
+        session.info.pop('dashboard_changed', None)
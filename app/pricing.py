@@ -0,0 +1,229 @@
+from bisect import bisect_right
+from sqlalchemy import select
+from app import db
+from app.models import User, CommissionSchedule, CommissionTier, PricingMode, Transaction, TransactionStatus, \
+    TransactionRollup, DashboardStats
+from app.money import RATE_FACTOR, rate_units
+from app.cache import invalidate_transactions
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+HALF = RATE_FACTOR // 2
+# Строк в одном векторном проходе: промежуточные матрицы (строки x ступени) не растут с размером батча
+VECTOR_CHUNK = 1 << 20
+# Статусы, которые пересчитывает reprice_transactions по умолчанию: у CANCELED из-за нехватки средств комиссия 0
+REPRICE_STATUSES = (TransactionStatus.PENDING, TransactionStatus.CONFIRMED)
+
+
+class Schedule:
+    # Ступени (нижняя граница в минимальных единицах, ставка в миллионных долях); счет только в целых числах,
+    # округление половины вверх один раз на всю комиссию - плоская ставка дает то же, что money.commission_for
+    __slots__ = ('mode', 'bounds', 'units')
+
+    def __init__(self, mode, tiers):
+        tiers = sorted(tiers)
+        if not tiers or tiers[0][0] != 0:
+            raise ValueError("The first tier must start at 0")
+        self.mode = mode
+        self.bounds = tuple(bound for bound, _ in tiers)
+        self.units = tuple(rate_units(rate) for _, rate in tiers)
+
+    @classmethod
+    def flat(cls, rate):
+        return cls(PricingMode.VOLUME, [(0, rate)])
+
+    def key(self):
+        return self.mode, self.bounds, self.units
+
+    def commission(self, amount):
+        if self.mode is PricingMode.VOLUME:
+            total = amount * self.units[bisect_right(self.bounds, amount) - 1]
+        else:
+            total = 0
+            for index, bound in enumerate(self.bounds):
+                if amount <= bound:
+                    break
+                upper = self.bounds[index + 1] if index + 1 < len(self.bounds) else amount
+                total += (min(amount, upper) - bound) * self.units[index]
+        return (total + HALF) // RATE_FACTOR
+
+
+def pricing_query(*columns):
+    # Пользователь и его сетка одним запросом: по строке на ступень, у пользователя без сетки - одна строка
+    return (
+        select(User.id, User.commission_rate, CommissionSchedule.mode, CommissionTier.from_amount,
+               CommissionTier.rate, *columns)
+        .outerjoin(CommissionSchedule, CommissionSchedule.id == User.commission_schedule_id)
+        .outerjoin(CommissionTier, CommissionTier.schedule_id == CommissionSchedule.id)
+    )
+
+
+def schedules_from_rows(rows):
+    # {user_id: (Schedule, строка запроса)} по результату pricing_query
+    tiers = {}
+    found = {}
+    for row in rows:
+        found[row.id] = row
+        if row.mode is not None and row.from_amount is not None:
+            tiers.setdefault(row.id, []).append((row.from_amount, row.rate))
+    return {
+        user_id: (Schedule(row.mode, tiers[user_id]) if user_id in tiers else Schedule.flat(row.commission_rate), row)
+        for user_id, row in found.items()
+    }
+
+
+def schedule_for_user(user_id):
+    # Быстрый путь create_transaction: один SELECT, None - пользователя нет
+    found = schedules_from_rows(db.session.execute(pricing_query().where(User.id == user_id)))
+    return found[user_id][0] if user_id in found else None
+
+
+class PricingEngine:
+    # Комиссии для многих (пользователь, сумма) сразу. С NumPy - векторно по матрицам ступеней
+    # всех различных сеток, без него - тем же Schedule.commission в цикле
+    def __init__(self, schedules):
+        self.schedules = schedules
+        self._compiled = None
+
+    @classmethod
+    def load(cls, user_ids):
+        user_ids = sorted(set(user_ids))
+        schedules = {}
+        # Кусками - лимит параметров SQLite
+        for start in range(0, len(user_ids), 500):
+            chunk = user_ids[start:start + 500]
+            found = schedules_from_rows(db.session.execute(pricing_query().where(User.id.in_(chunk))))
+            schedules.update((user_id, schedule) for user_id, (schedule, _) in found.items())
+        return cls(schedules)
+
+    def commission(self, user_id, amount):
+        return self.schedules[user_id].commission(amount)
+
+    def price(self, user_ids, amounts, vectorized=None):
+        # Список комиссий (int) в порядке входа; неизвестный пользователь - KeyError
+        if vectorized is None:
+            vectorized = np is not None
+        if not vectorized:
+            schedules = self.schedules
+            return [schedules[user_id].commission(amount) for user_id, amount in zip(user_ids, amounts)]
+        if np is None:
+            raise RuntimeError("Vectorized pricing requires numpy")
+        user_ids = np.asarray(user_ids, dtype=np.int64)
+        amounts = np.asarray(amounts, dtype=np.int64)
+        result = np.empty(len(amounts), dtype=np.int64)
+        for start in range(0, len(amounts), VECTOR_CHUNK):
+            end = start + VECTOR_CHUNK
+            result[start:end] = self._price_chunk(user_ids[start:end], amounts[start:end])
+        return result.tolist()
+
+    def _compile(self):
+        # Одинаковые сетки (у плоских ставок - одинаковые ставки) сводятся в одну строку таблиц ступеней;
+        # короткие сетки добиваются ступенями с границей "бесконечность" и нулевой ставкой.
+        # Таблицы хранятся по столбцам-ступеням: на каждую ступень - одномерная выборка take по номерам сеток
+        if self._compiled is not None:
+            return self._compiled
+        index = {}
+        unique = []
+        positions = {}
+        for user_id, schedule in self.schedules.items():
+            position = index.get(schedule.key())
+            if position is None:
+                position = index[schedule.key()] = len(unique)
+                unique.append(schedule)
+            positions[user_id] = position
+
+        width = max((len(schedule.bounds) for schedule in unique), default=1)
+        infinity = np.iinfo(np.int64).max
+        bounds = np.full((width, len(unique)), infinity, dtype=np.int64)
+        uppers = np.full((width, len(unique)), infinity, dtype=np.int64)
+        units = np.zeros((width, len(unique)), dtype=np.int64)
+        tiered = np.zeros(len(unique), dtype=bool)
+        for row, schedule in enumerate(unique):
+            count = len(schedule.bounds)
+            bounds[:count, row] = schedule.bounds
+            uppers[:count - 1, row] = schedule.bounds[1:]
+            units[:count, row] = schedule.units
+            tiered[row] = schedule.mode is PricingMode.TIERED
+
+        # Номер сетки по id - двоичным поиском в отсортированных id: память по числу пользователей, а не по
+        # наибольшему id (id бывают редкими и большими)
+        ids = np.fromiter(positions.keys(), dtype=np.int64, count=len(positions))
+        order = ids.argsort()
+        ids = ids[order]
+        lookup = np.fromiter(positions.values(), dtype=np.int64, count=len(positions))[order]
+        self._compiled = (ids, lookup, bounds, uppers, units, tiered)
+        return self._compiled
+
+    def _price_chunk(self, user_ids, amounts):
+        ids, lookup, bounds, uppers, units, tiered = self._compile()
+        found = ids.searchsorted(user_ids).clip(0, max(len(ids) - 1, 0))
+        missing = (ids.take(found) != user_ids) if len(ids) else np.ones(len(user_ids), dtype=bool)
+        if missing.any():
+            raise KeyError(int(user_ids[missing.argmax()]))
+        rows = lookup.take(found)
+
+        rate = np.zeros(len(amounts), dtype=np.int64)
+        graduated = np.zeros(len(amounts), dtype=np.int64)
+        for column in range(len(bounds)):
+            bound = bounds[column].take(rows)
+            column_units = units[column].take(rows)
+            # volume: границы по возрастанию - остается ставка последней достигнутой ступени
+            rate = np.where(bound <= amounts, column_units, rate)
+            # tiered: часть суммы внутри ступени по ее ставке
+            graduated += np.clip(np.minimum(amounts, uppers[column].take(rows)) - bound, 0, None) * column_units
+        # В int64 без переполнения при суммах до ~9.2e12 минимальных единиц (ввод ограничен money.MAX_MINOR)
+        # и ставках до 100%
+        return (np.where(tiered.take(rows), graduated, amounts * rate) + HALF) // RATE_FACTOR
+
+
+def reprice_query(schedule_id=None, user_id=None, statuses=REPRICE_STATUSES, since=None, until=None):
+    query = select(Transaction.id, Transaction.user_id, Transaction.amount, Transaction.commission,
+                   Transaction.status, Transaction.created_at).where(Transaction.status.in_(statuses))
+    if schedule_id is not None:
+        query = query.where(Transaction.user_id.in_(select(User.id).where(User.commission_schedule_id == schedule_id)))
+    if user_id is not None:
+        query = query.where(Transaction.user_id == user_id)
+    if since is not None:
+        query = query.where(Transaction.created_at >= since)
+    if until is not None:
+        query = query.where(Transaction.created_at < until)
+    return query
+
+
+def reprice_transactions(query, batch_size=10000, dry_run=False):
+    # Пересчет записанных комиссий по текущим сеткам порциями по id, каждая порция - отдельный коммит.
+    # Балансы не меняются: разницу (новая - старая) вызывающий видит в отчете и проводит отдельно.
+    # По каждой порции отдает (последний id, строк, изменено, разница комиссий)
+    after_id = 0
+    engine = PricingEngine({})
+    while True:
+        rows = db.session.execute(query.where(Transaction.id > after_id).order_by(Transaction.id)
+                                  .limit(batch_size)).all()
+        if not rows:
+            return
+        after_id = rows[-1].id
+        missing = {row.user_id for row in rows} - engine.schedules.keys()
+        if missing:
+            engine = PricingEngine({**engine.schedules, **PricingEngine.load(missing).schedules})
+        commissions = engine.price([row.user_id for row in rows], [row.amount for row in rows])
+        changed = [(row, commission) for row, commission in zip(rows, commissions) if commission != row.commission]
+        difference = sum(commission - row.commission for row, commission in changed)
+
+        if changed and not dry_run:
+            # UPDATE по первичному ключу через executemany
+            db.session.execute(db.update(Transaction),
+                               [{'id': row.id, 'commission': commission} for row, commission in changed])
+            invalidate_transactions(row.id for row, _ in changed)
+            DashboardStats.apply(transactions_changed=True, rows_rewritten=True)
+            TransactionRollup.apply(
+                added=[(row.created_at, row.user_id, row.status, row.amount, commission)
+                       for row, commission in changed],
+                removed=[(row.created_at, row.user_id, row.status, row.amount, row.commission) for row, _ in changed],
+            )
+            db.session.commit()
+        else:
+            db.session.rollback()
+        yield after_id, len(rows), len(changed), difference
@@ -0,0 +1,151 @@
+import functools
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import event
+from app import db
+
+
+class QueryBudgetExceeded(AssertionError):
+    def __init__(self, name, budget, statements):
+        super().__init__(f"{name} ran {len(statements)} SQL statements, budget is {budget}:\n"
+                         + '\n'.join(' '.join(statement.split()) for statement in statements))
+        self.name = name
+        self.budget = budget
+        self.statements = statements
+
+
+@contextmanager
+def count_statements(engine=None):
+    # Только запросы этого потока; записи потока-писателя (WRITE_COALESCING) сюда не попадают.
+    # Без engine - по всем базам, включая реплику для чтения
+    engines = [engine] if engine is not None else list(db.engines.values())
+    thread = threading.get_ident()
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if threading.get_ident() == thread:
+            statements.append(statement)
+
+    for engine in engines:
+        event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        for engine in engines:
+            event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+
+
+@contextmanager
+def assert_query_budget(budget, name='block', engine=None):
+    with count_statements(engine) as statements:
+        yield statements
+    if len(statements) > budget:
+        raise QueryBudgetExceeded(name, budget, statements)
+
+
+def query_budget(budget):
+    # Бюджет SQL-запросов обработчика, не зависящий от объема данных.
+    # Проверяется только при QUERY_BUDGET_ENFORCED, иначе - прямой вызов
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not current_app.config['QUERY_BUDGET_ENFORCED']:
+                return fn(*args, **kwargs)
+            with assert_query_budget(budget, fn.__name__):
+                return fn(*args, **kwargs)
+
+        wrapper.query_budget = budget
+        return wrapper
+    return decorator
+
+
+def budget_cases(user_id, other_user_id, transaction_id, pending_id, deleted_user_id, archived_id):
+    # (метод, url, параметры запроса тестового клиента) - по запросу на каждый маршрут
+    return [
+        ('GET', '/', {}),
+        ('POST', '/set_refresh_interval', {'json': {'refresh_interval': 0}}),
+        ('GET', '/dashboard/stream', {}),
+        ('GET', '/users', {}),
+        ('POST', '/users', {'data': {'balance': 100, 'commission_rate': 0.01,
+                                     'webhook_url': 'http://example.com/hook'}}),
+        ('GET', '/transactions', {}),
+        ('GET', f'/transactions?user_id={user_id}', {}),
+        ('GET', '/transactions?format=json', {}),
+        ('GET', f'/transactions?format=ndjson&user_id={user_id}', {}),
+        ('GET', f'/transactions/{transaction_id}', {}),
+        ('POST', f'/transactions/{transaction_id}', {'data': {'status': 'confirmed'}}),
+        ('POST', '/create_transaction', {'json': {'user_id': user_id, 'amount': 1}}),
+        # Первый запрос с ключом выполняет операцию, повтор отдает сохраненный ответ
+        ('POST', '/create_transaction', {'json': {'user_id': user_id, 'amount': 1},
+                                         'headers': {'Idempotency-Key': 'query-budget-check'}}),
+        ('POST', '/create_transaction', {'json': {'user_id': user_id, 'amount': 1},
+                                         'headers': {'Idempotency-Key': 'query-budget-check'}}),
+        ('POST', '/create_transactions', {'json': {'transactions': [
+            {'user_id': (user_id, other_user_id)[index % 2], 'amount': 1} for index in range(20)
+        ]}}),
+        ('POST', '/cancel_transaction', {'json': {'transaction_id': pending_id}}),
+        ('GET', f'/check_transaction?transaction_id={transaction_id}', {}),
+        # Не найдено в горячей таблице - чтение из архива
+        ('GET', f'/transactions/{archived_id}', {}),
+        ('GET', f'/check_transaction?transaction_id={archived_id}', {}),
+        ('POST', '/cancel_transaction', {'json': {'transaction_id': archived_id}}),
+        ('GET', '/cache_stats', {}),
+        ('GET', '/metrics', {}),
+        ('GET', '/analytics', {}),
+        ('GET', f'/analytics?period=hour&user_id={user_id}&status=pending', {}),
+        ('POST', f'/users/{deleted_user_id}/delete', {}),
+    ]
+
+
+def check_query_budgets(users=3, transactions_per_user=50):
+    # Отдельная временная база: проверка создает и удаляет данные.
+    # На каждого пользователя заведомо больше строк, чем бюджет, чтобы N+1 не мог в него уложиться
+    from app import create_app
+    from app.models import User, Transaction, TransactionStatus, DashboardStats
+    from app.money import to_minor
+    from app.archive import archive_transactions
+    directory = tempfile.mkdtemp(prefix='query-budget-')
+    app = create_app({
+        'SQLALCHEMY_DATABASE_URI': f"sqlite:///{os.path.join(directory, 'budget.db')}",
+        'QUERY_BUDGET_ENFORCED': True,
+        'WRITE_COALESCING': False,
+    }, config_name='testing')
+
+    with app.app_context():
+        db.create_all()
+        db.session.add_all(User(balance=to_minor(1000000), commission_rate=0.01) for _ in range(users))
+        db.session.flush()
+        db.session.add_all(
+            Transaction(user_id=user_id, amount=to_minor(10), commission=to_minor('0.1'))
+            for user_id in range(1, users + 1) for _ in range(transactions_per_user)
+        )
+        db.session.add(DashboardStats(id=DashboardStats.ROW_ID, users_version=1, transactions_version=1,
+                                      **DashboardStats.compute()))
+        # Последняя транзакция удаляемого пользователя - в архиве
+        archived_id = users * transactions_per_user
+        db.session.get(Transaction, archived_id).status = TransactionStatus.CONFIRMED
+        db.session.commit()
+        for _ in archive_transactions(datetime.utcnow() + timedelta(days=1)):
+            pass
+
+        problems = []
+        undeclared = sorted(
+            endpoint for endpoint, view in app.view_functions.items()
+            if endpoint != 'static' and not endpoint.startswith('flasgger.') and not hasattr(view, 'query_budget')
+        )
+        for endpoint in undeclared:
+            problems.append({'endpoint': endpoint, 'error': 'no query budget declared'})
+
+        client = app.test_client()
+        for method, url, kwargs in budget_cases(user_id=1, other_user_id=2, transaction_id=1, pending_id=2,
+                                                 deleted_user_id=users, archived_id=archived_id):
+            try:
+                response = client.open(url, method=method, buffered=False, **kwargs)
+                response.close()
+            except QueryBudgetExceeded as e:
+                problems.append({'url': f'{method} {url}', 'error': str(e)})
+    return problems
@@ -0,0 +1,88 @@
+import re
+from contextlib import contextmanager
+from datetime import datetime
+from sqlalchemy import event
+from app import db
+from app.models import Transaction
+from app.routes.transactions import encode_cursor
+
+FULL_SCAN_RE = re.compile(r'^SCAN (\w+)(?: AS \w+)?$')
+
+# (url, таблицы, полный просмотр которых для этого запроса ожидаем)
+ROUTE_CASES = [
+    ('/', set()),
+    ('/transactions', {'transactions'}),  # HTML-список без фильтров выводит все строки
+    ('/transactions?user_id={user_id}', set()),
+    ('/transactions?status=pending', set()),
+    ('/transactions?user_id={user_id}&status=pending', set()),
+    ('/transactions?format=json', set()),
+    ('/transactions?format=json&user_id={user_id}', set()),
+    ('/transactions?format=json&status=pending', set()),
+    ('/transactions?format=json&user_id={user_id}&status=pending', set()),
+    ('/transactions?format=json&status=pending&cursor={cursor}', set()),
+    ('/transactions/{transaction_id}', set()),
+    ('/check_transaction?transaction_id={transaction_id}', set()),
+    ('/users', {'users'}),  # список всех пользователей
+    ('/analytics', set()),
+    ('/analytics?period=hour&user_id={user_id}', set()),
+]
+
+
+@contextmanager
+def capture_statements(engine):
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('SELECT'):
+            statements.append((statement, parameters))
+
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+
+
+def explain(statement, parameters):
+    with db.engine.connect() as conn:
+        rows = conn.exec_driver_sql('EXPLAIN QUERY PLAN ' + statement, parameters).all()
+    return [row[-1] for row in rows]
+
+
+def full_scans(plan, tables):
+    scanned = set()
+    for detail in plan:
+        match = FULL_SCAN_RE.match(detail)
+        if match and match.group(1) in tables:
+            scanned.add(match.group(1))
+    return scanned
+
+
+# Прогоняет GET-запросы к маршрутам и возвращает найденные полные сканирования таблиц
+def check_query_plans(app, cases=ROUTE_CASES):
+    tables = set(db.metadata.tables)
+    transaction = db.session.query(Transaction.id, Transaction.user_id, Transaction.created_at).first()
+    params = {
+        'transaction_id': transaction.id if transaction else 1,
+        'user_id': transaction.user_id if transaction else 1,
+        'cursor': encode_cursor(transaction.created_at if transaction else datetime.utcnow(),
+                                transaction.id if transaction else 1),
+    }
+
+    problems = []
+    client = app.test_client()
+    for url_template, allowed in cases:
+        url = url_template.format(**params)
+        with capture_statements(db.engine) as statements:
+            client.get(url)
+        for statement, parameters in statements:
+            plan = explain(statement, parameters)
+            unexpected = full_scans(plan, tables) - allowed
+            if unexpected:
+                problems.append({
+                    'url': url,
+                    'tables': sorted(unexpected),
+                    'statement': statement,
+                    'plan': plan,
+                })
+    return problems
@@ -0,0 +1,178 @@
+import functools
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import closing
+from flask import current_app, request
+from flask_sqlalchemy.session import Session
+from sqlalchemy.engine import make_url
+
+logger = logging.getLogger(__name__)
+
+REPLICA_BIND = 'replica'
+# Клиент, только что записавший данные, читает с основной базы до этого времени (unix time)
+PIN_COOKIE = 'read_primary_until'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+class RoutingSession(Session):
+    # SELECT из обработчиков с @read_replica - на реплику; flush и запись - на основную базу.
+    # ORM передает UNION по моделям без clause - такие вызовы в обработчиках только для чтения тоже идут на реплику
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (bind is None and self.info.get('read_replica') and not self._flushing
+                and (clause is None or clause.is_select)):
+            engine = self._db.engines.get(REPLICA_BIND)
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def pinned_to_primary():
+    try:
+        return float(request.cookies.get(PIN_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+
+def read_replica(fn):
+    # Чтения обработчика идут на реплику (если она настроена), кроме клиентов, закрепленных за основной базой
+    # после записи. Флаг живет до конца запроса - и на время потоковой выдачи ответа
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        if (REPLICA_BIND in current_app.config['SQLALCHEMY_BINDS'] and request.method in SAFE_METHODS
+                and not pinned_to_primary()):
+            from app import db
+            db.session.info['read_replica'] = True
+        return fn(*args, **kwargs)
+
+    wrapper.read_replica = True
+    return wrapper
+
+
+def init_replica(app):
+    from app import db
+    pin_seconds = app.config['REPLICA_PIN_SECONDS']
+
+    @app.after_request
+    def _pin_writer(response):
+        # Свои изменения клиент увидит сразу, даже если реплика еще не догнала основную базу
+        if request.method not in SAFE_METHODS and response.status_code < 400 and pin_seconds > 0:
+            response.set_cookie(PIN_COOKIE, f"{time.time() + pin_seconds:.3f}", max_age=math.ceil(pin_seconds),
+                                httponly=True, samesite='Lax')
+        return response
+
+    @app.teardown_request
+    def _reset_routing(exc):
+        db.session.info.pop('read_replica', None)
+
+
+def sqlite_path(url):
+    # url движка: Flask-SQLAlchemy уже разрешил относительный путь SQLite от instance/
+    url = make_url(url)
+    if url.get_backend_name() != 'sqlite' or url.database in (None, '', ':memory:'):
+        raise ValueError(f"Replica sync needs SQLite database files, got {url.render_as_string()}")
+    return url.database
+
+
+class ReplicaSync:
+    # Локальная реплика для разработки и проверки: копия основного файла SQLite через backup API.
+    # Копия делается одним шагом - реплика всегда согласована, читатели реплики ждут ее окончания (busy_timeout)
+    def __init__(self, source, target, interval, busy_timeout=5.0):
+        self.source = source
+        self.target = target
+        self.interval = interval
+        self.busy_timeout = busy_timeout
+        self.synced_at = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    @classmethod
+    def from_config(cls, app):
+        # Пути - из созданных движков, а не из строк конфигурации: копируются те же файлы, с которыми они работают
+        from app import db
+        with app.app_context():
+            source, target = db.engines[None].url, db.engines[REPLICA_BIND].url
+        return cls(sqlite_path(source), sqlite_path(target), interval=app.config['REPLICA_SYNC_INTERVAL'])
+
+    def sync(self):
+        started = time.perf_counter()
+        with closing(sqlite3.connect(self.source, timeout=self.busy_timeout)) as source, \
+                closing(sqlite3.connect(self.target, timeout=self.busy_timeout)) as target:
+            source.backup(target)
+        self.synced_at = time.time()
+        return time.perf_counter() - started
+
+    def run_forever(self):
+        while not self._stop.wait(self.interval):
+            try:
+                elapsed = self.sync()
+                logger.debug("Replica synced in %.1f ms", elapsed * 1000)
+            except Exception:
+                logger.exception("Replica sync failed")
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run_forever, name='replica-sync', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+
+def check_replica_sync():
+    # Запись на основную базу, копия ReplicaSync.from_config и чтение той же строки сессией с флагом реплики.
+    # URI относительные, как в обычной конфигурации: Flask-SQLAlchemy разрешает их от instance/
+    from app import create_app, db
+    from app.models import User
+    from sqlalchemy import select
+    from sqlalchemy.exc import SQLAlchemyError
+    name = f"replica-check-{uuid.uuid4().hex}"
+    app = create_app({
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{name}.db',
+        'REPLICA_DATABASE_URL': f'sqlite:///{name}-replica.db',
+        'REPLICA_SYNC_INTERVAL': 0,
+        'WRITE_COALESCING': False,
+    }, config_name='testing')
+    problems = []
+    try:
+        with app.app_context():
+            db.create_all()
+            user = User(balance=100, commission_rate=0.01)
+            db.session.add(user)
+            db.session.commit()
+            user_id = user.id
+            paths = [db.engines[None].url.database, db.engines[REPLICA_BIND].url.database]
+
+        replica_sync = ReplicaSync.from_config(app)
+        if [replica_sync.source, replica_sync.target] != paths:
+            problems.append(f"sync copies {replica_sync.source} -> {replica_sync.target}, engines use {paths}")
+        replica_sync.sync()
+
+        with app.app_context():
+            db.session.info['read_replica'] = True
+            query = select(User.id).where(User.id == user_id)
+            if db.session.get_bind(clause=query) is not db.engines[REPLICA_BIND]:
+                problems.append("reads are not routed to the replica engine")
+            else:
+                try:
+                    found = db.session.scalar(query)
+                except SQLAlchemyError as e:
+                    found = None
+                    problems.append(f"replica read failed: {e.orig or e}")
+                if found != user_id:
+                    problems.append(f"user {user_id} written to the primary is missing on the replica after sync")
+    finally:
+        with app.app_context():
+            for engine in db.engines.values():
+                engine.dispose()
+        for path in (os.path.join(app.instance_path, f'{name}.db'),
+                     os.path.join(app.instance_path, f'{name}-replica.db')):
+            if os.path.exists(path):
+                os.remove(path)
+    return problems
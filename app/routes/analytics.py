@@ -0,0 +1,115 @@
+from datetime import datetime, timezone
+from flask import Blueprint, request, jsonify
+from flasgger import swag_from
+from app.models import TransactionStatus, DashboardStats
+from app.analytics import PERIOD_LENGTH, MAX_BUCKETS, rollup_series, default_range
+from app.conditional import content_etag, not_modified, with_validators
+from app.query_budget import query_budget
+from app.replica import read_replica
+
+bp = Blueprint('analytics', __name__)
+
+
+def parse_datetime(value):
+    # Время в базе - наивное UTC; значение со смещением (RFC 3339, ...Z) приводится к нему же
+    moment = datetime.fromisoformat(value)
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return moment
+
+
+@bp.route('/analytics')
+@swag_from({
+    'tags': ['Analytics'],
+    'description': 'Transaction volume, commission and status breakdown per hour or day, for one user or for all '
+                   'users. Served from rollup tables kept current by every write; buckets without transactions '
+                   'are omitted. Transactions are counted in the bucket of their creation time.',
+    'parameters': [
+        {'in': 'query', 'name': 'period', 'type': 'string', 'required': False, 'enum': ['hour', 'day'],
+         'description': 'Bucket size (default day)'},
+        {'in': 'query', 'name': 'since', 'type': 'string', 'format': 'date-time', 'required': False,
+         'description': 'Range start, inclusive (default: 30 days or 48 hours before until)'},
+        {'in': 'query', 'name': 'until', 'type': 'string', 'format': 'date-time', 'required': False,
+         'description': 'Range end, exclusive (default: end of the current bucket)'},
+        {'in': 'query', 'name': 'user_id', 'type': 'integer', 'required': False,
+         'description': 'Only this user (default: all users)'},
+        {'in': 'query', 'name': 'status', 'type': 'string', 'required': False,
+         'enum': ['pending', 'confirmed', 'canceled', 'expired']}
+    ],
+    'responses': {
+        200: {
+            'description': 'Buckets in ascending order',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'period': {'type': 'string'},
+                    'since': {'type': 'string', 'format': 'date-time'},
+                    'until': {'type': 'string', 'format': 'date-time'},
+                    'user_id': {'type': 'integer'},
+                    'buckets': {
+                        'type': 'array',
+                        'items': {
+                            'type': 'object',
+                            'properties': {
+                                'bucket': {'type': 'string', 'format': 'date-time'},
+                                'count': {'type': 'integer'},
+                                'amount': {'type': 'number'},
+                                'commission': {'type': 'number'},
+                                'statuses': {'type': 'object', 'description': 'status -> {count, amount, commission}'}
+                            }
+                        }
+                    }
+                }
+            }
+        },
+        304: {'description': 'Not modified: no transaction changes since the version in If-None-Match'},
+        400: {'description': 'Invalid period, range, user_id or status'}
+    }
+})
+@query_budget(2)
+@read_replica
+def analytics():
+    period = request.args.get('period', 'day')
+    if period not in PERIOD_LENGTH:
+        return jsonify({"error": "period must be one of: hour, day"}), 400
+
+    since, until = default_range(period)
+    try:
+        if request.args.get('until'):
+            until = parse_datetime(request.args['until'])
+        if request.args.get('since'):
+            since = parse_datetime(request.args['since'])
+        elif request.args.get('until'):
+            since, _ = default_range(period, until - PERIOD_LENGTH[period])
+    except ValueError:
+        return jsonify({"error": "Invalid input: since and until must be ISO 8601 date-times"}), 400
+    if since >= until:
+        return jsonify({"error": "since must be before until"}), 400
+    if (until - since) / PERIOD_LENGTH[period] > MAX_BUCKETS[period]:
+        return jsonify({"error": f"At most {MAX_BUCKETS[period]} {period} buckets per request"}), 400
+
+    user_id = request.args.get('user_id')
+    status = request.args.get('status')
+    try:
+        user_id = int(user_id) if user_id else None
+        status = TransactionStatus(status.lower()) if status else None
+    except ValueError:
+        return jsonify({"error": "Invalid user_id or status"}), 400
+    if user_id is not None and user_id <= 0:
+        return jsonify({"error": "user_id must be a positive number"}), 400
+
+    # Агрегаты меняются только вместе с версией таблицы транзакций
+    stats = DashboardStats.current()
+    etag = (f"analytics-{stats.transactions_version}-"
+            f"{content_etag([period, since.isoformat(), until.isoformat(), user_id, status and status.value])}")
+    response = not_modified(etag, stats.changed_at)
+    if response is not None:
+        return response
+
+    return with_validators(jsonify({
+        'period': period,
+        'since': since.isoformat(),
+        'until': until.isoformat(),
+        'user_id': user_id,
+        'buckets': rollup_series(period, since, until, user_id, status),
+    }), etag, stats.changed_at)
@@ -1,7 +1,10 @@
-from flask import Blueprint, render_template, session, jsonify, request
-from app.models import User, Transaction
-from app import db
+import json
+from flask import Blueprint, render_template, session, jsonify, request, make_response, Response, current_app
+from app.models import Transaction, DashboardStats
+from app.conditional import not_modified, with_validators
 from flasgger import swag_from
+from app.query_budget import query_budget
+from app.replica import read_replica
 
 bp = Blueprint('dashboard', __name__)
 
@@ -11,6 +14,7 @@ bp = Blueprint('dashboard', __name__)
     'tags': ['Dashboard'],
     'description': 'Get statistics about the platform, including users, transactions, and recent transactions.',
     'responses': {
+        304: {'description': 'Not modified since the version in If-None-Match'},
         200: {
             'description': 'Dashboard statistics and recent transactions',
             'schema': {
@@ -35,18 +39,67 @@ bp = Blueprint('dashboard', __name__)
         }
     }
 })
+@query_budget(2)
+@read_replica
 def dashboard():
-    total_users = User.query.count()
-    total_transactions = Transaction.query.count()
-    total_transaction_amount = db.session.query(db.func.sum(Transaction.amount)).scalar() or 0
+    stats = DashboardStats.current()
+    refresh_interval = session.get('refresh_interval', 10)
+
+    # Страница зависит только от версий таблиц и интервала обновления. Интервал - из сессии, его смена не меняет
+    # время изменения данных, поэтому Last-Modified не отдается и валидатор - только ETag
+    etag = f"dashboard-{stats.users_version}-{stats.transactions_version}-{refresh_interval}"
+    response = not_modified(etag)
+    if response is not None:
+        return response
+
     recent_transactions = Transaction.query.order_by(Transaction.created_at.desc()).limit(5).all()
+    response = make_response(render_template('dashboard.html',
+                                              total_users=stats.total_users,
+                                              total_transactions=stats.total_transactions,
+                                              total_transaction_amount=stats.total_transaction_amount,
+                                              recent_transactions=recent_transactions,
+                                              refresh_interval=refresh_interval))
+    return with_validators(response, etag)
+
+@bp.route('/dashboard/stream')
+@swag_from({
+    'tags': ['Dashboard'],
+    'description': 'Server-Sent Events with dashboard changes: new transactions and changed totals. '
+                   'Events are sent at most once per the session refresh interval.',
+    'produces': ['text/event-stream'],
+    'responses': {
+        200: {
+            'description': 'Stream of "dashboard" events, data is {"totals": {...} | null, "transactions": [...]}'
+        },
+        204: {'description': 'Auto-refresh is disabled for this session'}
+    }
+})
+@query_budget(0)
+def dashboard_stream():
     refresh_interval = session.get('refresh_interval', 10)
-    return render_template('dashboard.html',
-                           total_users=total_users,
-                           total_transactions=total_transactions,
-                           total_transaction_amount=total_transaction_amount,
-                           recent_transactions=recent_transactions,
-                           refresh_interval=refresh_interval)
+    if not refresh_interval:
+        # На 204 EventSource не переподключается
+        return '', 204
+
+    notifier = current_app.extensions['dashboard_notifier']
+    heartbeat = current_app.config['DASHBOARD_STREAM_HEARTBEAT']
+    subscription = notifier.subscribe(refresh_interval)
+
+    def generate():
+        try:
+            yield 'retry: 5000\n\n'
+            while True:
+                change = subscription.wait(heartbeat)
+                if change is None:
+                    yield ': keep-alive\n\n'
+                    continue
+                version, data = change
+                yield f"id: {version}\nevent: dashboard\ndata: {json.dumps(data)}\n\n"
+        finally:
+            notifier.unsubscribe(subscription)
+
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 @bp.route('/set_refresh_interval', methods=['POST'])
 @swag_from({
@@ -62,7 +115,7 @@ def dashboard():
                     'refresh_interval': {
                         'type': 'integer',
                         'enum': [0, 10, 15, 30, 60],
-                        'description': 'Auto-refresh interval in seconds.',
+                        'description': 'Minimum interval between live dashboard updates in seconds, 0 disables them.',
                         'example': 10
                     }
                 }
@@ -93,6 +146,7 @@ def dashboard():
         }
     }
 })
+@query_budget(0)
 def set_refresh_interval():
     refresh_interval = request.json.get('refresh_interval')
 
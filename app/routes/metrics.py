@@ -0,0 +1,19 @@
+from flask import Blueprint, Response, current_app
+from flasgger import swag_from
+from app.query_budget import query_budget
+
+bp = Blueprint('metrics', __name__)
+
+
+@bp.route('/metrics')
+@swag_from({
+    'tags': ['Metrics'],
+    'description': 'Request latency, status and SQL statement metrics of this process in Prometheus text format.',
+    'produces': ['text/plain'],
+    'responses': {
+        200: {'description': 'Prometheus text exposition format 0.0.4'}
+    }
+})
+@query_budget(0)
+def metrics():
+    return Response(current_app.extensions['metrics'].render(), mimetype='text/plain; version=0.0.4')
@@ -1,55 +1,226 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify
-from app.models import Transaction, TransactionStatus, User
+import base64
+import json
+from datetime import datetime
+from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, Response, \
+    stream_with_context, make_response, abort
+from sqlalchemy import select, tuple_
+from app.models import Transaction, TransactionStatus, TransactionRollup, User, DashboardStats, ArchivedTransaction, \
+    LedgerEntry, transaction_to_dict
 from app.forms import TransactionStatusForm
 from app import db
+from app.webhooks import enqueue_transaction_event, enqueue_transaction_events, transaction_event
+from app.writer import run_write, Rollback
+from app.cache import transaction_cache, invalidate_transactions
+from app.conditional import content_etag, not_modified, with_validators
+from app.query_budget import query_budget
+from app.replica import read_replica
+from app.money import MoneyPrecisionError, MoneyRangeError, to_minor, to_major
+from app.pricing import schedule_for_user, pricing_query, schedules_from_rows
+from app.idempotency import request_key, idempotent_response
+from app.archive import across_tiers
+from app.ledger import debit, debit_many
 from flasgger import swag_from
 
 
 
 bp = Blueprint('transactions', __name__)
 
+NDJSON_MIMETYPE = 'application/x-ndjson'
+DEFAULT_PAGE_LIMIT = 100
+MAX_PAGE_LIMIT = 1000
+STREAM_CHUNK_SIZE = 200
+MAX_BATCH_SIZE = 10000
+USER_LOOKUP_CHUNK = 500
+
+
+def encode_cursor(created_at, transaction_id):
+    raw = f"{created_at.isoformat()}|{transaction_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    padded = cursor + '=' * (-len(cursor) % 4)
+    created_at, transaction_id = base64.urlsafe_b64decode(padded.encode()).decode().split('|')
+    return datetime.fromisoformat(created_at), int(transaction_id)
+
+
+def parse_transaction_input(data):
+    try:
+        user_id = int(data.get('user_id', 0))
+        amount = to_minor(data.get('amount', 0))
+    except (MoneyPrecisionError, MoneyRangeError) as e:
+        return None, f"Invalid input: {e}"
+    except (ValueError, TypeError, AttributeError):
+        return None, "Invalid input: user_id and amount must be numeric"
+
+    if user_id <= 0 or amount <= 0:
+        return None, "user_id and amount must be positive numbers"
+    return (user_id, amount), None
+
+
+def parse_transaction_id(value):
+    try:
+        transaction_id = int(value)
+    except (ValueError, TypeError):
+        return None, "Invalid input: transaction_id must be numeric"
+
+    if transaction_id <= 0:
+        return None, "transaction_id must be a positive number"
+    return transaction_id, None
+
+
+def _list_format():
+    fmt = request.args.get('format')
+    if fmt:
+        return fmt.lower()
+    best = request.accept_mimetypes.best_match(['text/html', 'application/json', NDJSON_MIMETYPE])
+    return {'application/json': 'json', NDJSON_MIMETYPE: 'ndjson'}.get(best, 'html')
+
+
+def _stream_transactions(query, limit, fmt):
+    # Берем на одну строку больше, чтобы понять, есть ли следующая страница
+    rows = db.session.execute(
+        query.limit(limit + 1).execution_options(yield_per=STREAM_CHUNK_SIZE)
+    )
+
+    def generate():
+        count = 0
+        last = None
+        next_cursor = None
+        if fmt == 'json':
+            yield '{"items": ['
+        for row in rows:
+            if count == limit:
+                next_cursor = encode_cursor(last.created_at, last.id)
+                break
+            item = json.dumps(transaction_to_dict(row))
+            if fmt == 'json':
+                yield item if count == 0 else ',' + item
+            else:
+                yield item + '\n'
+            count += 1
+            last = row
+        rows.close()
+        if fmt == 'json':
+            yield '], "next_cursor": ' + json.dumps(next_cursor) + '}'
+        else:
+            yield json.dumps({"next_cursor": next_cursor}) + '\n'
+
+    mimetype = 'application/json' if fmt == 'json' else NDJSON_MIMETYPE
+    return Response(stream_with_context(generate()), mimetype=mimetype)
+
 @bp.route('/transactions')
 @swag_from({
     'tags': ['Transactions'],
-    'description': 'Get a list of all transactions.',
+    'description': 'Get a list of transactions. HTML by default; with format=json or format=ndjson '
+                   '(or the matching Accept header) the newest-first list is streamed page by page '
+                   'using keyset pagination on (created_at, id). Archived transactions are not listed.',
+    'parameters': [
+        {'in': 'query', 'name': 'user_id', 'type': 'integer', 'required': False},
+        {'in': 'query', 'name': 'status', 'type': 'string', 'required': False,
+         'enum': ['pending', 'confirmed', 'canceled', 'expired']},
+        {'in': 'query', 'name': 'format', 'type': 'string', 'required': False, 'enum': ['html', 'json', 'ndjson']},
+        {'in': 'query', 'name': 'limit', 'type': 'integer', 'required': False,
+         'description': f'Page size for json/ndjson, 1..{MAX_PAGE_LIMIT} (default {DEFAULT_PAGE_LIMIT})'},
+        {'in': 'query', 'name': 'cursor', 'type': 'string', 'required': False,
+         'description': 'next_cursor value from the previous page'}
+    ],
     'responses': {
         200: {
-            'description': 'List of transactions',
+            'description': 'Page of transactions. For ndjson every line is a transaction and the last line '
+                           'is {"next_cursor": ...}',
             'schema': {
-                'type': 'array',
-                'items': {
-                    'type': 'object',
-                    'properties': {
-                        'id': {'type': 'integer'},
-                        'amount': {'type': 'number'},
-                        'commission': {'type': 'number'},
-                        'status': {'type': 'string'},
-                        'user_id': {'type': 'integer'},
-                        'created_at': {'type': 'string', 'format': 'date-time'}
-                    }
+                'type': 'object',
+                'properties': {
+                    'items': {
+                        'type': 'array',
+                        'items': {
+                            'type': 'object',
+                            'properties': {
+                                'id': {'type': 'integer'},
+                                'amount': {'type': 'number'},
+                                'commission': {'type': 'number'},
+                                'status': {'type': 'string'},
+                                'user_id': {'type': 'integer'},
+                                'created_at': {'type': 'string', 'format': 'date-time'}
+                            }
+                        }
+                    },
+                    'next_cursor': {'type': 'string'}
                 }
             }
-        }
+        },
+        304: {'description': 'Not modified: If-None-Match / If-Modified-Since matches the current version'},
+        400: {'description': 'Invalid filter, limit or cursor'}
     }
 })
+@query_budget(2)
+@read_replica
 def transactions_list():
     user_id = request.args.get('user_id')
     status = request.args.get('status')
+    fmt = _list_format()
+
+    # Любая страница списка меняется только вместе с версией таблицы транзакций
+    stats = DashboardStats.current()
+    etag = f"transactions-{stats.transactions_version}-{content_etag([fmt, sorted(request.args.items())])}"
+    response = not_modified(etag, stats.changed_at)
+    if response is not None:
+        return response
 
-    query = db.session.query(Transaction)
+    if fmt == 'html':
+        query = db.session.query(Transaction)
+
+        if user_id:
+            query = query.filter(Transaction.user_id == user_id)
+        if status:
+            query = query.filter(Transaction.status == status.upper())
+
+        transactions = query.all()
+        response = make_response(render_template('transactions.html', transactions=transactions))
+        return with_validators(response, etag, stats.changed_at)
+
+    if fmt not in ('json', 'ndjson'):
+        return jsonify({"error": "format must be one of: html, json, ndjson"}), 400
+
+    try:
+        limit = int(request.args.get('limit', DEFAULT_PAGE_LIMIT))
+    except (ValueError, TypeError):
+        return jsonify({"error": "Invalid input: limit must be numeric"}), 400
+    if not 1 <= limit <= MAX_PAGE_LIMIT:
+        return jsonify({"error": f"limit must be between 1 and {MAX_PAGE_LIMIT}"}), 400
+
+    query = select(
+        Transaction.id, Transaction.amount, Transaction.commission, Transaction.status,
+        Transaction.user_id, Transaction.created_at
+    )
 
     if user_id:
-        query = query.filter(Transaction.user_id == user_id)
+        try:
+            query = query.where(Transaction.user_id == int(user_id))
+        except ValueError:
+            return jsonify({"error": "Invalid input: user_id must be numeric"}), 400
     if status:
-        query = query.filter(Transaction.status == status.upper())
-
-    transactions = query.all()
-    return render_template('transactions.html', transactions=transactions)
+        try:
+            query = query.where(Transaction.status == TransactionStatus[status.upper()])
+        except KeyError:
+            return jsonify({"error": "Unknown status"}), 400
+
+    cursor = request.args.get('cursor')
+    if cursor:
+        try:
+            created_at, last_id = decode_cursor(cursor)
+        except (ValueError, TypeError):
+            return jsonify({"error": "Invalid cursor"}), 400
+        query = query.where(tuple_(Transaction.created_at, Transaction.id) < tuple_(created_at, last_id))
+
+    query = query.order_by(Transaction.created_at.desc(), Transaction.id.desc())
+    return with_validators(_stream_transactions(query, limit, fmt), etag, stats.changed_at)
 
 @bp.route('/transactions/<int:transaction_id>', methods=['GET', 'POST'])
 @swag_from({
     'tags': ['Transactions'],
-    'description': 'View or update the status of a transaction by ID.',
+    'description': 'View or update the status of a transaction by ID. Archived transactions are read-only.',
     'parameters': [
         {
             'in': 'path',
@@ -89,32 +260,45 @@ def transactions_list():
         404: {'description': 'Transaction not found'}
     }
 })
+@query_budget(6)
 def transaction_detail(transaction_id):
-    transaction = Transaction.query.get_or_404(transaction_id)
+    transaction = db.session.get(Transaction, transaction_id) or db.session.get(ArchivedTransaction, transaction_id)
+    if transaction is None:
+        abort(404)
+    archived = isinstance(transaction, ArchivedTransaction)
     form = TransactionStatusForm()
 
     if form.validate_on_submit():
-        if transaction.status == TransactionStatus.PENDING:
-            new_status = TransactionStatus(form.status.data)
-            transaction.status = new_status
-            db.session.commit()
-
-            # Если транзакция переходит в статус confirmed
-            if new_status == TransactionStatus.CONFIRMED:
-                user = transaction.user
-                if user.balance < transaction.amount:
-                    flash('Insufficient balance in user wallet!', 'danger')
-                else:
-                    user.balance -= transaction.amount
-                    db.session.commit()
-                    flash('Transaction confirmed and balance updated successfully!', 'success')
-            else:
-                flash('Transaction status updated successfully!', 'success')
-        else:
+        # Архивные транзакции завершены, статус у них не меняется
+        if archived:
             flash('Transaction status cannot be changed!', 'danger')
+            return redirect(url_for('transactions.transaction_detail', transaction_id=transaction_id))
+        new_status = TransactionStatus(form.status.data)
+        message, category = run_write(
+            _update_transaction_status, transaction_id, transaction.user_id, transaction.amount,
+            transaction.commission, transaction.created_at, new_status
+        )
+        flash(message, category)
         return redirect(url_for('transactions.transaction_detail', transaction_id=transaction_id))
 
-    return render_template('transaction_detail.html', transaction=transaction, form=form)
+    return render_template('transaction_detail.html', transaction=transaction, form=form, archived=archived)
+
+
+def _update_transaction_status(transaction_id, user_id, amount, commission, created_at, new_status):
+    if not Transaction.transition(transaction_id, TransactionStatus.PENDING, new_status):
+        return 'Transaction status cannot be changed!', 'danger'
+    # Если транзакция переходит в статус confirmed, списание и смена статуса - в одном коммите
+    if new_status == TransactionStatus.CONFIRMED and not debit(user_id, amount):
+        raise Rollback(('Insufficient balance in user wallet!', 'danger'))
+
+    enqueue_transaction_events([transaction_event(transaction_id, user_id, new_status, amount, commission)])
+    invalidate_transactions([transaction_id])
+    DashboardStats.apply(transactions_changed=True)
+    TransactionRollup.apply(added=[(created_at, user_id, new_status, amount, commission)],
+                            removed=[(created_at, user_id, TransactionStatus.PENDING, amount, commission)])
+    if new_status == TransactionStatus.CONFIRMED:
+        return 'Transaction confirmed and balance updated successfully!', 'success'
+    return 'Transaction status updated successfully!', 'success'
 
 
 @bp.route('/create_transaction', methods=['POST'])
@@ -134,11 +318,21 @@ def transaction_detail(transaction_id):
                 },
                 'required': ['user_id', 'amount']
             }
+        },
+        {
+            'in': 'header',
+            'name': 'Idempotency-Key',
+            'type': 'string',
+            'required': False,
+            'description': 'Unique key of this request (e.g. a UUID). A retry with the same key and parameters '
+                           'returns the stored response of the first request without creating another '
+                           'transaction; keys are kept for at least IDEMPOTENCY_KEY_TTL seconds.'
         }
     ],
     'responses': {
         201: {
-            'description': 'Transaction created successfully',
+            'description': 'Transaction created successfully; a replayed response has the header '
+                           'Idempotent-Replayed: true',
             'schema': {
                 'type': 'object',
                 'properties': {
@@ -149,45 +343,207 @@ def transaction_detail(transaction_id):
         },
         400: {'description': 'Invalid input'},
         404: {'description': 'User not found'},
-        422: {'description': 'Insufficient funds'}
+        409: {'description': 'A request with the same Idempotency-Key is still in progress'},
+        422: {'description': 'Insufficient funds, or the Idempotency-Key was used with different parameters'}
     }
 })
+@query_budget(9)
 def create_transaction():
     data = request.get_json()
 
-    try:
-        user_id = int(data.get('user_id', 0))
-        amount = float(data.get('amount', 0))
-    except (ValueError, TypeError):
-        return jsonify({"error": "Invalid input: user_id and amount must be numeric"}), 400
+    values, error = parse_transaction_input(data)
+    if error:
+        return jsonify({"error": error}), 400
+    user_id, amount = values
 
-    if user_id <= 0 or amount <= 0:
-        return jsonify({"error": "user_id and amount must be positive numbers"}), 400
+    key, error = request_key(request.headers)
+    if error:
+        return jsonify({"error": error}), 400
+    if key is not None:
+        return idempotent_response(key, 'create_transaction', _create_transaction, user_id, amount)
+
+    body, status = run_write(_create_transaction, user_id, amount)
+    return jsonify(body), status
 
-    user = User.query.get(user_id)
-    if not user:
-        return jsonify({"error": "User not found"}), 404
 
-    # Проверка, хватает ли средств на балансе с учетом комиссии
-    if user.balance < amount + amount * user.commission_rate:
+def _create_transaction(user_id, amount):
+    schedule = schedule_for_user(user_id)
+    if schedule is None:
+        return {"error": "User not found"}, 404
+
+    # Проверка средств с учетом комиссии и списание - одна условная вставка в журнал, все суммы в целых единицах
+    commission = schedule.commission(amount)
+    # Время создания задаем сами - по нему же считается интервал агрегатов
+    now = datetime.utcnow()
+    if not debit(user_id, amount + commission):
         # Если средств недостаточно, создаем отмененную транзакцию
-        transaction = Transaction(amount=amount, commission=0, status=TransactionStatus.CANCELED, user=user)
+        transaction = Transaction(amount=amount, commission=0, status=TransactionStatus.CANCELED, user_id=user_id,
+                                  created_at=now)
         db.session.add(transaction)
-        db.session.commit()
-
-        return jsonify(
-            {"error": "Insufficient funds. Transaction canceled.", "transaction_id": transaction.id}), 422
+        DashboardStats.apply(transactions=1, amount=amount)
+        TransactionRollup.apply(added=[(now, user_id, TransactionStatus.CANCELED, amount, 0)])
+        enqueue_transaction_event(transaction)
 
-    # Если средств достаточно, создаем транзакцию
-    commission = amount * user.commission_rate
-    transaction = Transaction(amount=amount, commission=commission, user=user)
+        return {"error": "Insufficient funds. Transaction canceled.", "transaction_id": transaction.id}, 422
 
-    # Вычитаем сумму транзакции с баланса пользователя
-    user.balance -= (amount + commission)
+    transaction = Transaction(amount=amount, commission=commission, user_id=user_id, created_at=now)
     db.session.add(transaction)
-    db.session.commit()
+    DashboardStats.apply(transactions=1, amount=amount)
+    TransactionRollup.apply(added=[(now, user_id, TransactionStatus.PENDING, amount, commission)])
+    enqueue_transaction_event(transaction)
 
-    return jsonify({"message": "Transaction created successfully", "transaction_id": transaction.id}), 201
+    return {"message": "Transaction created successfully", "transaction_id": transaction.id}, 201
+
+@bp.route('/create_transactions', methods=['POST'])
+@swag_from({
+    'tags': ['Transactions'],
+    'description': 'Create many transactions in one request. Every item follows the same rules as '
+                   '/create_transaction (commission, insufficient funds -> canceled transaction), items of '
+                   'the same user are applied in order, and the whole batch is stored with a single commit.',
+    'parameters': [
+        {
+            'in': 'body',
+            'name': 'body',
+            'required': True,
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'transactions': {
+                        'type': 'array',
+                        'maxItems': MAX_BATCH_SIZE,
+                        'items': {
+                            'type': 'object',
+                            'properties': {
+                                'user_id': {'type': 'integer', 'description': 'ID of the user'},
+                                'amount': {'type': 'number', 'description': 'Transaction amount'}
+                            },
+                            'required': ['user_id', 'amount']
+                        }
+                    }
+                },
+                'required': ['transactions']
+            }
+        }
+    ],
+    'responses': {
+        200: {
+            'description': 'Per-item results in request order; code is the status the single endpoint would return',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'results': {
+                        'type': 'array',
+                        'items': {
+                            'type': 'object',
+                            'properties': {
+                                'index': {'type': 'integer'},
+                                'code': {'type': 'integer', 'enum': [201, 400, 404, 422]},
+                                'message': {'type': 'string'},
+                                'error': {'type': 'string'},
+                                'transaction_id': {'type': 'integer'}
+                            }
+                        }
+                    }
+                }
+            }
+        },
+        400: {'description': 'Invalid batch'}
+    }
+})
+@query_budget(6)
+def create_transactions():
+    data = request.get_json(silent=True)
+    items = data.get('transactions') if isinstance(data, dict) else None
+
+    if not isinstance(items, list) or not items:
+        return jsonify({"error": "transactions must be a non-empty list"}), 400
+    if len(items) > MAX_BATCH_SIZE:
+        return jsonify({"error": f"At most {MAX_BATCH_SIZE} transactions per batch"}), 400
+
+    parsed = [parse_transaction_input(item) for item in items]
+    return jsonify({"results": run_write(_create_transactions, parsed)}), 200
+
+
+def _create_transactions(parsed):
+    # Все пользователи батча одним запросом (кусками, чтобы не упереться в лимит параметров SQLite)
+    user_ids = sorted({values[0] for values, error in parsed if not error})
+    users = {}
+    for start in range(0, len(user_ids), USER_LOOKUP_CHUNK):
+        chunk = user_ids[start:start + USER_LOOKUP_CHUNK]
+        users.update(schedules_from_rows(db.session.execute(
+            pricing_query(LedgerEntry.balance_expression(User.id).label('balance')).where(User.id.in_(chunk)))))
+
+    # Позиции одного пользователя применяются по порядку к снимку его баланса
+    results = [None] * len(parsed)
+    planned = {}
+    balances = {}
+    for index, (values, error) in enumerate(parsed):
+        if error:
+            results[index] = {"index": index, "code": 400, "error": error}
+            continue
+        user_id, amount = values
+        if user_id not in users:
+            results[index] = {"index": index, "code": 404, "error": "User not found"}
+            continue
+
+        schedule, user = users[user_id]
+        commission = schedule.commission(amount)
+        balance = balances.get(user_id, user.balance)
+        accepted = balance >= amount + commission
+        if accepted:
+            balances[user_id] = balance - (amount + commission)
+        planned.setdefault(user_id, []).append([index, amount, commission, accepted])
+
+    # Условное списание сразу для всех пользователей куска одной вставкой в журнал;
+    # у кого баланс успел измениться - по одному списанию на позицию
+    totals = {}
+    for user_id, items in planned.items():
+        total = sum(amount + commission for _, amount, commission, accepted in items if accepted)
+        if total:
+            totals[user_id] = total
+    debited = set()
+    pending = list(totals.items())
+    for start in range(0, len(pending), USER_LOOKUP_CHUNK):
+        chunk = dict(pending[start:start + USER_LOOKUP_CHUNK])
+        debited.update(debit_many(chunk))
+    for user_id in totals.keys() - debited:
+        for item in planned[user_id]:
+            _, amount, commission, _ = item
+            item[3] = debit(user_id, amount + commission)
+
+    rows = []
+    row_results = []
+    now = datetime.utcnow()
+    for user_id, items in planned.items():
+        for index, amount, commission, accepted in items:
+            if accepted:
+                rows.append({"amount": amount, "commission": commission, "status": TransactionStatus.PENDING,
+                             "user_id": user_id, "created_at": now})
+                result = {"index": index, "code": 201, "message": "Transaction created successfully"}
+            else:
+                # Если средств недостаточно, создаем отмененную транзакцию
+                rows.append({"amount": amount, "commission": 0, "status": TransactionStatus.CANCELED,
+                             "user_id": user_id, "created_at": now})
+                result = {"index": index, "code": 422, "error": "Insufficient funds. Transaction canceled."}
+            results[index] = result
+            row_results.append(result)
+
+    if rows:
+        # sort_by_parameter_order в SQLite превращается в отдельный INSERT на строку. Под блокировкой записи
+        # rowid выдаются по порядку строк VALUES, так что порядок параметров восстанавливает сортировка
+        transaction_ids = sorted(db.session.scalars(db.insert(Transaction).returning(Transaction.id), rows).all())
+        for result, transaction_id in zip(row_results, transaction_ids):
+            result["transaction_id"] = transaction_id
+        DashboardStats.apply(transactions=len(rows), amount=sum(row["amount"] for row in rows))
+        TransactionRollup.apply(added=[
+            (now, row["user_id"], row["status"], row["amount"], row["commission"]) for row in rows
+        ])
+        enqueue_transaction_events([
+            transaction_event(transaction_id, row["user_id"], row["status"], row["amount"], row["commission"])
+            for row, transaction_id in zip(rows, transaction_ids)
+        ])
+
+    return results
 
 @bp.route('/cancel_transaction', methods=['POST'])
 @swag_from({
@@ -213,33 +569,42 @@ def create_transaction():
         404: {'description': 'Transaction not found'}
     }
 })
+@query_budget(5)
 def cancel_transaction():
     data = request.get_json()
 
-    try:
-        transaction_id = int(data.get('transaction_id', 0))
-    except (ValueError, TypeError):
-        return jsonify({"error": "Invalid input: transaction_id must be numeric"}), 400
+    transaction_id, error = parse_transaction_id(data.get('transaction_id', 0))
+    if error:
+        return jsonify({"error": error}), 400
+
+    body, status = run_write(_cancel_transaction, transaction_id)
+    return jsonify(body), status
 
-    if transaction_id <= 0:
-        return jsonify({"error": "transaction_id must be a positive number"}), 400
 
+def _cancel_transaction(transaction_id):
     transaction = Transaction.query.get(transaction_id)
     if not transaction:
-        return jsonify({"error": "Transaction not found"}), 404
-
-    if transaction.status != TransactionStatus.PENDING:
-        return jsonify({"error": "Only pending transactions can be canceled"}), 400
-
-    transaction.status = TransactionStatus.CANCELED
-    db.session.commit()
-
-    return jsonify({"message": "Transaction canceled successfully"}), 200
+        # В архиве только завершенные транзакции
+        if db.session.get(ArchivedTransaction, transaction_id) is not None:
+            return {"error": "Only pending transactions can be canceled"}, 400
+        return {"error": "Transaction not found"}, 404
+
+    if not Transaction.transition(transaction_id, TransactionStatus.PENDING, TransactionStatus.CANCELED):
+        return {"error": "Only pending transactions can be canceled"}, 400
+
+    enqueue_transaction_event(transaction, TransactionStatus.CANCELED)
+    invalidate_transactions([transaction_id])
+    DashboardStats.apply(transactions_changed=True)
+    created_at, user_id, amount, commission = (transaction.created_at, transaction.user_id, transaction.amount,
+                                               transaction.commission)
+    TransactionRollup.apply(added=[(created_at, user_id, TransactionStatus.CANCELED, amount, commission)],
+                            removed=[(created_at, user_id, TransactionStatus.PENDING, amount, commission)])
+    return {"message": "Transaction canceled successfully"}, 200
 
 @bp.route('/check_transaction', methods=['GET'])
 @swag_from({
     'tags': ['Transactions'],
-    'description': 'Check the details of a transaction.',
+    'description': 'Check the details of a transaction, including archived ones.',
     'parameters': [
         {
             'in': 'query',
@@ -264,28 +629,98 @@ def cancel_transaction():
                 }
             }
         },
+        304: {'description': 'Not modified: the ETag in If-None-Match is still current'},
         400: {'description': 'Invalid input'},
         404: {'description': 'Transaction not found'}
     }
 })
+@query_budget(1)
+@read_replica
 def check_transaction():
-    try:
-        transaction_id = int(request.args.get('transaction_id', 0))
-    except (ValueError, TypeError):
-        return jsonify({"error": "Invalid input: transaction_id must be numeric"}), 400
-
-    if transaction_id <= 0:
-        return jsonify({"error": "transaction_id must be a positive number"}), 400
-
-    transaction = Transaction.query.get(transaction_id)
-    if not transaction:
-        return jsonify({"error": "Transaction not found"}), 404
-
-    return jsonify({
+    transaction_id, error = parse_transaction_id(request.args.get('transaction_id', 0))
+    if error:
+        return jsonify({"error": error}), 400
+
+    # Чтение через кэш: без запроса к БД, пока запись не устарела или не сброшена сменой статуса.
+    # Раз в CACHE_PENDING_TTL запрос все же идет в БД - сверить версию кэша с другими процессами
+    cache = transaction_cache()
+    entry = cache.get(transaction_id) if cache is not None and not cache.version_check_due() else None
+    if entry is None:
+        transaction = db.session.execute(check_transaction_query(transaction_id)).first()
+        if not transaction:
+            return jsonify({"error": "Transaction not found"}), 404
+
+        entry = transaction_cache_entry(transaction)
+        if cache is not None:
+            cache.observe_version(transaction.cache_version)
+            cache.put(transaction_id, entry)
+
+    return transaction_entry_response(entry)
+
+
+def check_transaction_query(transaction_id):
+    # Сначала горячая таблица, затем архив: с LIMIT 1 второй SELECT выполняется, только если первый пуст.
+    # Тем же запросом - версия кэша (TransactionCache.observe_version)
+    cache_version = select(DashboardStats.cache_version).where(DashboardStats.id == DashboardStats.ROW_ID)
+    return across_tiers(lambda model: select(
+        model.id, model.amount, model.commission, model.status, model.user_id, model.created_at, model.updated_at,
+        cache_version.scalar_subquery().label('cache_version')
+    ).where(model.id == transaction_id)).limit(1)
+
+
+def transaction_cache_entry(transaction):
+    data = {
         "transaction_id": transaction.id,
-        "amount": transaction.amount,
-        "commission": transaction.commission,
+        "amount": to_major(transaction.amount),
+        "commission": to_major(transaction.commission),
         "status": transaction.status.value,
         "user_id": transaction.user_id,
         "created_at": transaction.created_at.isoformat()
-    }), 200
\ No newline at end of file
+    }
+    # В кэше вместе с телом лежат валидаторы, чтобы 304 отдавался без запроса к БД
+    return {
+        "status": data["status"],
+        "body": data,
+        "etag": content_etag(data),
+        "last_modified": (transaction.updated_at or transaction.created_at).isoformat(),
+    }
+
+
+def transaction_entry_response(entry):
+    last_modified = datetime.fromisoformat(entry["last_modified"])
+    response = not_modified(entry["etag"], last_modified)
+    if response is not None:
+        return response
+    return with_validators(jsonify(entry["body"]), entry["etag"], last_modified)
+
+
+@bp.route('/cache_stats', methods=['GET'])
+@swag_from({
+    'tags': ['Transactions'],
+    'description': 'Counters of the /check_transaction cache.',
+    'responses': {
+        200: {
+            'description': 'Cache counters',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'entries': {'type': 'integer'},
+                    'max_entries': {'type': 'integer'},
+                    'hits': {'type': 'integer'},
+                    'misses': {'type': 'integer'},
+                    'evictions': {'type': 'integer'},
+                    'expirations': {'type': 'integer'},
+                    'shared_hits': {'type': 'integer'},
+                    'shared': {'type': 'boolean'}
+                }
+            }
+        },
+        404: {'description': 'Cache is disabled'}
+    }
+})
+@query_budget(0)
+def cache_stats():
+    cache = transaction_cache()
+    if cache is None:
+        return jsonify({"error": "Cache is disabled"}), 404
+    return jsonify(cache.stats()), 200
\ No newline at end of file
@@ -1,7 +1,12 @@
 from flask import Blueprint, render_template, redirect, url_for, flash
 from flasgger import swag_from
-from app.models import User, db
+from app.models import User, Transaction, ArchivedTransaction, TransactionRollup, DashboardStats, LedgerEntry, db
 from app.forms import UserForm
+from app.writer import run_write
+from app.cache import invalidate_transactions
+from app.query_budget import query_budget
+from app.replica import read_replica
+from app.money import to_minor
 
 bp = Blueprint('users', __name__)
 
@@ -35,7 +40,7 @@ bp = Blueprint('users', __name__)
                     'type': 'object',
                     'properties': {
                         'id': {'type': 'integer'},
-                        'balance': {'type': 'number'},
+                        'balance': {'type': 'number', 'description': 'Current balance from the ledger'},
                         'commission_rate': {'type': 'number'},
                         'webhook_url': {'type': 'string'}
                     }
@@ -46,21 +51,29 @@ bp = Blueprint('users', __name__)
         400: {'description': 'Invalid input'}
     }
 })
+@query_budget(3)
+@read_replica
 def users():
     form = UserForm()
     if form.validate_on_submit():
-        user = User(
-            balance=form.balance.data,
-            commission_rate=form.commission_rate.data,
-            webhook_url=form.webhook_url.data
-        )
-        db.session.add(user)
-        db.session.commit()
+        run_write(_create_user, to_minor(form.balance.data), form.commission_rate.data, form.webhook_url.data)
         flash('User created successfully!', 'success')
         return redirect(url_for('users.users'))
-    users_list = User.query.all()
+    # Баланс - по журналу (снимок + хвост) тем же запросом
+    users_list = db.session.execute(
+        db.select(User, LedgerEntry.balance_expression(User.id).label('balance'))).all()
     return render_template('users.html', form=form, users=users_list)
 
+
+def _create_user(balance, commission_rate, webhook_url):
+    user = User(
+        balance=balance,
+        commission_rate=commission_rate,
+        webhook_url=webhook_url
+    )
+    db.session.add(user)
+    DashboardStats.apply(users=1)
+
 @bp.route('/users/<int:user_id>/delete', methods=['POST'])
 @swag_from({
     'tags': ['Users'],
@@ -79,9 +92,29 @@ def users():
         404: {'description': 'User not found'}
     }
 })
+@query_budget(7)
 def delete_user(user_id):
-    user = User.query.get_or_404(user_id)
-    db.session.delete(user)
-    db.session.commit()
+    run_write(_delete_user, user_id)
     flash('User deleted successfully!', 'success')
     return redirect(url_for('users.users'))
+
+
+def _delete_user(user_id):
+    user = User.query.get_or_404(user_id)
+    # Транзакции - одним DELETE по индексу user_id в горячей таблице и в архиве, а не удалением каждой через каскад
+    deleted = [
+        row for model in (Transaction, ArchivedTransaction)
+        for row in db.session.execute(
+            db.delete(model)
+            .where(model.user_id == user.id)
+            .returning(model.id, model.amount, model.commission, model.status, model.created_at)
+            .execution_options(synchronize_session=False)
+        )
+    ]
+    invalidate_transactions(row.id for row in deleted)
+    db.session.delete(user)
+    DashboardStats.apply(users=-1, transactions=-len(deleted), amount=-sum(row.amount for row in deleted))
+    # Агрегаты пользователя удаляются целиком, из общих вычитаются его транзакции
+    db.session.execute(db.delete(TransactionRollup).where(TransactionRollup.user_id == user.id))
+    TransactionRollup.apply(removed=[(row.created_at, user.id, row.status, row.amount, row.commission)
+                                     for row in deleted], per_user=False)
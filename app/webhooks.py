@@ -0,0 +1,232 @@
+import http.client
+import json
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from urllib.parse import urlsplit
+from sqlalchemy import bindparam, literal, select
+from app import db
+from app.models import User, WebhookEvent, WebhookStatus
+from app.money import to_major
+
+logger = logging.getLogger(__name__)
+
+
+def transaction_event(transaction_id, user_id, status, amount, commission):
+    return {
+        "transaction_id": transaction_id,
+        "user_id": user_id,
+        "status": status.value,
+        "amount": to_major(amount),
+        "commission": to_major(commission),
+    }
+
+
+def enqueue_transaction_events(events):
+    # Пишем в outbox в текущей транзакции
+    if events:
+        db.session.execute(*transaction_events_insert(events))
+
+
+def transaction_events_insert(events):
+    # Адрес берется из users прямо в INSERT ... SELECT, пользователи без webhook_url просто не дают строк.
+    # Отдает (statement, параметры executemany)
+    now = datetime.utcnow()
+    status_type = WebhookEvent.__table__.c.status.type
+    stmt = db.insert(WebhookEvent.__table__).from_select(
+        ['user_id', 'url', 'payload', 'status', 'attempts', 'next_attempt_at', 'created_at'],
+        select(
+            User.id,
+            User.webhook_url,
+            bindparam('payload', type_=db.Text),
+            literal(WebhookStatus.PENDING, status_type),
+            literal(0),
+            bindparam('now', type_=db.DateTime),
+            bindparam('now', type_=db.DateTime),
+        ).where(User.id == bindparam('event_user_id'), User.webhook_url.is_not(None), User.webhook_url != '')
+    )
+    return stmt, [
+        {
+            'event_user_id': event['user_id'],
+            'payload': json.dumps({"event": "transaction.status", "occurred_at": now.isoformat(), **event}),
+            'now': now,
+        }
+        for event in events
+    ]
+
+
+def enqueue_transaction_event(transaction, status=None):
+    if transaction.id is None:
+        db.session.flush()
+    enqueue_transaction_events([transaction_event(
+        transaction.id, transaction.user_id, status or transaction.status, transaction.amount, transaction.commission
+    )])
+
+
+class WebhookDispatcher:
+    def __init__(self, app, workers=4, batch_size=50, fetch_size=500, poll_interval=1.0, timeout=5.0,
+                 max_attempts=8, backoff_base=2.0, backoff_max=600.0, lease=60.0):
+        self.app = app
+        self.batch_size = batch_size
+        self.fetch_size = fetch_size
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.lease = lease
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='webhook')
+        self._connections = threading.local()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @classmethod
+    def from_config(cls, app):
+        config = app.config
+        return cls(
+            app,
+            workers=config['WEBHOOK_WORKERS'],
+            batch_size=config['WEBHOOK_BATCH_SIZE'],
+            poll_interval=config['WEBHOOK_POLL_INTERVAL'],
+            timeout=config['WEBHOOK_TIMEOUT'],
+            max_attempts=config['WEBHOOK_MAX_ATTEMPTS'],
+        )
+
+    def backoff(self, attempts):
+        return min(self.backoff_base ** attempts, self.backoff_max)
+
+    def claim(self):
+        # Забираем готовые события и сдвигаем next_attempt_at на время аренды,
+        # чтобы параллельный диспетчер не взял их же
+        now = datetime.utcnow()
+        due = (
+            select(WebhookEvent.id)
+            .where(WebhookEvent.status == WebhookStatus.PENDING, WebhookEvent.next_attempt_at <= now)
+            .order_by(WebhookEvent.next_attempt_at)
+            .limit(self.fetch_size)
+        )
+        rows = db.session.execute(
+            db.update(WebhookEvent)
+            .where(WebhookEvent.id.in_(due), WebhookEvent.next_attempt_at <= now)
+            .values(next_attempt_at=now + timedelta(seconds=self.lease))
+            .returning(WebhookEvent.id, WebhookEvent.url, WebhookEvent.payload, WebhookEvent.attempts)
+            .execution_options(synchronize_session=False)
+        ).all()
+        db.session.commit()
+        return sorted(rows, key=lambda row: row.id)
+
+    def batches(self, rows):
+        by_url = {}
+        for row in rows:
+            by_url.setdefault(row.url, []).append(row)
+        for url, events in by_url.items():
+            for start in range(0, len(events), self.batch_size):
+                yield url, events[start:start + self.batch_size]
+
+    def dispatch_once(self):
+        with self.app.app_context():
+            rows = self.claim()
+            if not rows:
+                return 0
+
+            futures = [(events, self.pool.submit(self.deliver, url, [json.loads(e.payload) for e in events]))
+                       for url, events in self.batches(rows)]
+
+            now = datetime.utcnow()
+            delivered = []
+            retries = []
+            for events, future in futures:
+                error = future.exception()
+                if error is None:
+                    delivered.extend(event.id for event in events)
+                    continue
+                for event in events:
+                    attempts = event.attempts + 1
+                    retries.append({
+                        'event_id': event.id,
+                        'attempts': attempts,
+                        'status': WebhookStatus.FAILED if attempts >= self.max_attempts else WebhookStatus.PENDING,
+                        'next_attempt_at': now + timedelta(seconds=self.backoff(attempts)),
+                        'last_error': str(error)[:255],
+                    })
+
+            if delivered:
+                db.session.execute(
+                    db.update(WebhookEvent)
+                    .where(WebhookEvent.id.in_(delivered))
+                    .values(status=WebhookStatus.DELIVERED, delivered_at=now, attempts=WebhookEvent.attempts + 1)
+                    .execution_options(synchronize_session=False)
+                )
+            if retries:
+                db.session.execute(
+                    db.update(WebhookEvent.__table__)
+                    .where(WebhookEvent.id == bindparam('event_id'))
+                    .values(attempts=bindparam('attempts'), status=bindparam('status'),
+                            next_attempt_at=bindparam('next_attempt_at'), last_error=bindparam('last_error')),
+                    retries
+                )
+            db.session.commit()
+            return len(rows)
+
+    def connection(self, parts):
+        # Одно keep-alive соединение на хост в каждом потоке пула
+        cache = self._connections.__dict__.setdefault('by_host', {})
+        key = (parts.scheme, parts.netloc)
+        conn = cache.get(key)
+        if conn is None:
+            conn_class = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+            conn = cache[key] = conn_class(parts.netloc, timeout=self.timeout)
+        return key, conn
+
+    def deliver(self, url, payloads):
+        parts = urlsplit(url)
+        if parts.scheme not in ('http', 'https'):
+            raise ValueError(f"Unsupported webhook URL: {url}")
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        body = json.dumps({"events": payloads})
+        headers = {'Content-Type': 'application/json', 'User-Agent': 'TransactionAPI-Webhooks'}
+
+        for retry in (True, False):
+            key, conn = self.connection(parts)
+            try:
+                conn.request('POST', path, body=body, headers=headers)
+                response = conn.getresponse()
+                response.read()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                # Сервер мог закрыть простаивающее соединение - одна повторная попытка на новом
+                self._connections.by_host.pop(key, None).close()
+                if retry:
+                    continue
+                raise
+            except Exception:
+                self._connections.by_host.pop(key, None).close()
+                raise
+            if response.will_close:
+                self._connections.by_host.pop(key, None).close()
+            if not 200 <= response.status < 300:
+                raise RuntimeError(f"Webhook endpoint responded with {response.status}")
+            return response.status
+
+    def run_forever(self):
+        while not self._stop.is_set():
+            try:
+                processed = self.dispatch_once()
+            except Exception:
+                logger.exception("Webhook dispatch failed")
+                processed = 0
+            if not processed:
+                self._stop.wait(self.poll_interval)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run_forever, name='webhook-dispatcher', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self.pool.shutdown(wait=True)
@@ -0,0 +1,137 @@
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from flask import current_app
+from sqlalchemy import text
+from app import db
+
+logger = logging.getLogger(__name__)
+
+
+class Rollback(Exception):
+    # Откатить изменения этой операции записи и вернуть вызывающему result
+    def __init__(self, result):
+        super().__init__(result)
+        self.result = result
+
+
+def run_write(fn, *args, **kwargs):
+    # fn меняет данные через db.session, но не коммитит сам.
+    # В режиме группового коммита выполняется потоком-писателем, иначе - здесь же с отдельным коммитом
+    coalescer = current_app.extensions.get('write_coalescer')
+    if coalescer is not None:
+        return coalescer.submit(fn, *args, **kwargs).result()
+
+    try:
+        result = fn(*args, **kwargs)
+    except Rollback as e:
+        db.session.rollback()
+        return e.result
+    except Exception:
+        db.session.rollback()
+        raise
+    db.session.commit()
+    return result
+
+
+class WriteCoalescer:
+    def __init__(self, app, window=0.002, max_batch=256):
+        self.app = app
+        self.window = window
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @classmethod
+    def from_config(cls, app):
+        return cls(
+            app,
+            window=app.config['WRITE_COALESCE_WINDOW'],
+            max_batch=app.config['WRITE_COALESCE_MAX_BATCH'],
+        )
+
+    def submit(self, fn, *args, **kwargs):
+        future = Future()
+        self._queue.put((future, fn, args, kwargs))
+        return future
+
+    def collect(self):
+        # Первая операция ждет сколько угодно, остальные - не дольше окна
+        try:
+            batch = [self._queue.get(timeout=0.1)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def execute(self, batch):
+        # Одна транзакция на всю группу; каждая операция в своем SAVEPOINT,
+        # чтобы ошибка одной не откатывала остальные
+        outcomes = []
+        if db.session.get_bind().dialect.name == 'sqlite':
+            # Блокировка записи SQLite сразу, а не при первой записи внутри группы
+            db.session.execute(text('BEGIN IMMEDIATE'))
+        elif not db.session.in_transaction():
+            # BEGIN IMMEDIATE - синтаксис только SQLite; остальным базам - обычная транзакция
+            db.session.begin()
+        for future, fn, args, kwargs in batch:
+            savepoint = db.session.begin_nested()
+            try:
+                result = fn(*args, **kwargs)
+            except Rollback as e:
+                savepoint.rollback()
+                outcomes.append((future, e.result, None))
+            except Exception as e:
+                savepoint.rollback()
+                outcomes.append((future, None, e))
+            else:
+                savepoint.commit()
+                outcomes.append((future, result, None))
+
+        try:
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.exception("Group commit of %d writes failed", len(batch))
+            outcomes = [(future, None, error or e) for future, _, error in outcomes]
+
+        for future, result, error in outcomes:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    def run_forever(self):
+        with self.app.app_context():
+            while not self._stop.is_set():
+                batch = self.collect()
+                if not batch:
+                    continue
+                try:
+                    self.execute(batch)
+                except Exception as e:
+                    db.session.rollback()
+                    for future, *_ in batch:
+                        if not future.done():
+                            future.set_exception(e)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run_forever, name='write-coalescer', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
@@ -0,0 +1,5 @@
+from app import create_app
+from app.asgi import AsyncTransactionAPI
+
+# uvicorn asgi:application - JSON API транзакций на asyncio, остальные страницы через WSGI-адаптер
+application = AsyncTransactionAPI.from_config(create_app())
@@ -0,0 +1,183 @@
+import argparse
+import asyncio
+import json
+import random
+import socket
+import sqlite3
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+from app import create_app, db
+from app.models import User, Transaction, DashboardStats
+from app.money import to_minor
+from benchmarks.common import temporary_app
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+class PooledWSGIServer(BaseWSGIServer):
+    # Фиксированное число потоков, как у gunicorn --threads: запрос, ждущий блокировку, занимает поток
+    def __init__(self, host, port, app, threads):
+        super().__init__(host, port, app, handler=QuietRequestHandler)
+        self.pool = ThreadPoolExecutor(max_workers=threads)
+
+    def process_request(self, request, client_address):
+        self.pool.submit(self._handle, request, client_address)
+
+    def _handle(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+
+def serve(mode, database, port, threads):
+    app = create_app({
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{database}',
+        'SQLALCHEMY_ENGINE_OPTIONS': {'pool_size': threads, 'max_overflow': 0, 'pool_timeout': 30},
+        'ASYNC_DB_POOL_SIZE': threads,
+    }, config_name='production')
+    if mode == 'sync':
+        PooledWSGIServer('127.0.0.1', port, app, threads).serve_forever()
+    else:
+        import uvicorn
+        from app.asgi import AsyncTransactionAPI
+        uvicorn.run(AsyncTransactionAPI.from_config(app), host='127.0.0.1', port=port, log_level='warning')
+
+
+def seed(users, transactions):
+    app = temporary_app()
+    with app.app_context():
+        db.session.add_all(User(balance=to_minor(10 ** 9), commission_rate=0.01) for _ in range(users))
+        db.session.flush()
+        db.session.add_all(
+            Transaction(user_id=i % users + 1, amount=to_minor(10), commission=to_minor('0.1')) for i in range(transactions)
+        )
+        db.session.add(DashboardStats(id=DashboardStats.ROW_ID, **DashboardStats.compute()))
+        db.session.commit()
+        return db.engine.url.database
+
+
+def hold_locks(database, hold, every, stop):
+    # Имитация медленного писателя: периодически держит блокировку записи всей базы
+    connection = sqlite3.connect(database, isolation_level=None)
+    while not stop.wait(every):
+        connection.execute('BEGIN IMMEDIATE')
+        time.sleep(hold)
+        connection.execute('COMMIT')
+    connection.close()
+
+
+async def http_request(port, method, path, body=None):
+    payload = json.dumps(body).encode() if body is not None else b''
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write(
+        f"{method} {path} HTTP/1.1\r\nHost: 127.0.0.1\r\nContent-Type: application/json\r\n"
+        f"Content-Length: {len(payload)}\r\nConnection: close\r\n\r\n".encode() + payload
+    )
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    return int(response.split(b' ', 2)[1])
+
+
+async def load(port, concurrency, requests, users, transactions):
+    latencies = []
+    statuses = {}
+    issued = 0
+
+    async def client():
+        nonlocal issued
+        while issued < requests:
+            issued += 1
+            if random.random() < 0.5:
+                args = ('GET', f'/check_transaction?transaction_id={random.randint(1, transactions)}')
+            else:
+                args = ('POST', '/create_transaction', {'user_id': random.randint(1, users), 'amount': 1})
+            started = time.perf_counter()
+            try:
+                code = await http_request(port, *args)
+            except OSError as e:
+                code = type(e).__name__
+            latencies.append(time.perf_counter() - started)
+            statuses[code] = statuses.get(code, 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'statuses': {str(code): count for code, count in statuses.items()},
+        'requests_per_sec': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(statistics.median(latencies) * 1000, 1),
+        'p99_ms': round(latencies[int(len(latencies) * 0.99) - 1] * 1000, 1),
+    }
+
+
+def wait_for_port(port, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.5).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Server on port {port} did not start")
+
+
+def run(mode, args, database):
+    server = subprocess.Popen([
+        sys.executable, '-m', 'benchmarks.async_vs_sync', '--serve', mode, '--database', database,
+        '--port', str(args.port), '--threads', str(args.threads),
+    ])
+    stop = threading.Event()
+    locker = threading.Thread(target=hold_locks, args=(database, args.lock_hold, args.lock_every, stop))
+    try:
+        wait_for_port(args.port)
+        if args.lock_hold:
+            locker.start()
+        result = asyncio.run(load(args.port, args.concurrency, args.requests, args.users, args.transactions))
+    finally:
+        stop.set()
+        if locker.is_alive():
+            locker.join()
+        server.terminate()
+        server.wait()
+    return {'mode': mode, 'concurrency': args.concurrency, 'threads': args.threads, **result}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Sync (thread pool) vs async (ASGI + aiosqlite) JSON API under load.')
+    parser.add_argument('--concurrency', type=int, default=200, help='Requests in flight')
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--threads', type=int, default=8, help='Sync worker threads and DB pool size')
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--transactions', type=int, default=10000)
+    parser.add_argument('--lock-hold', type=float, default=0.0, help='Seconds a competing writer holds the DB lock')
+    parser.add_argument('--lock-every', type=float, default=1.0, help='Seconds between competing writer locks')
+    parser.add_argument('--port', type=int, default=5099)
+    parser.add_argument('--serve', choices=['sync', 'async'], help=argparse.SUPPRESS)
+    parser.add_argument('--database', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve, args.database, args.port, args.threads)
+        return
+
+    for mode in ('sync', 'async'):
+        # Каждый режим - на своей копии данных
+        print(json.dumps(run(mode, args, seed(args.users, args.transactions))))
+
+
+if __name__ == '__main__':
+    main()
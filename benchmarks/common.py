@@ -0,0 +1,17 @@
+import os
+import tempfile
+from app import create_app, db
+
+
+def temporary_app(config_name='testing', **config):
+    # Отдельный файл SQLite на каждый прогон, чтобы замеры не влияли друг на друга
+    directory = tempfile.mkdtemp(prefix='transactions-bench-')
+    path = os.path.join(directory, 'bench.db')
+    app = create_app({
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{path}',
+        'WTF_CSRF_ENABLED': False,
+        **config
+    }, config_name=config_name)
+    with app.app_context():
+        db.create_all()
+    return app
@@ -0,0 +1,70 @@
+import argparse
+import json
+from sqlalchemy import event
+from app import db
+from app.models import User, Transaction, DashboardStats
+from app.money import to_minor
+from benchmarks.common import temporary_app
+
+URLS = ['/', '/transactions?format=json', '/check_transaction?transaction_id=1']
+
+
+def seed(app, users, transactions):
+    with app.app_context():
+        db.session.add_all(User(balance=to_minor(1000), commission_rate=0.01) for _ in range(users))
+        db.session.flush()
+        db.session.add_all(
+            Transaction(user_id=i % users + 1, amount=to_minor(10), commission=to_minor('0.1')) for i in range(transactions)
+        )
+        db.session.add(DashboardStats(id=DashboardStats.ROW_ID, users_version=1, transactions_version=1,
+                                      **DashboardStats.compute()))
+        db.session.commit()
+
+
+def poll(app, url, polls, conditional):
+    # Клиент повторяет запрос, как дашборд с автообновлением; с conditional - присылает полученный ETag
+    statements = []
+    with app.app_context():
+        engine = db.engine
+    listener = lambda *args: statements.append(1)
+    event.listen(engine, 'before_cursor_execute', listener)
+    client = app.test_client()
+    etag = None
+    codes = {}
+    sent = 0
+    try:
+        for _ in range(polls):
+            headers = {'If-None-Match': etag} if conditional and etag else {}
+            response = client.get(url, headers=headers)
+            etag = response.headers.get('ETag', etag)
+            codes[response.status_code] = codes.get(response.status_code, 0) + 1
+            sent += len(response.get_data())
+    finally:
+        event.remove(engine, 'before_cursor_execute', listener)
+    return {
+        'url': url,
+        'conditional': conditional,
+        'polls': polls,
+        'statuses': {str(code): count for code, count in codes.items()},
+        'sql_statements': len(statements),
+        'response_bytes': sent,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='SQL work and bytes sent by polling clients with and without ETags.')
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--transactions', type=int, default=5000)
+    parser.add_argument('--polls', type=int, default=200)
+    args = parser.parse_args()
+
+    # Кэш /check_transaction выключен, чтобы сравнивать только эффект условных запросов
+    app = temporary_app(CACHE_ENABLED=False)
+    seed(app, args.users, args.transactions)
+    for url in URLS:
+        for conditional in (False, True):
+            print(json.dumps(poll(app, url, args.polls, conditional)))
+
+
+if __name__ == '__main__':
+    main()
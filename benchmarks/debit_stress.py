@@ -0,0 +1,117 @@
+import argparse
+import json
+import threading
+import time
+from sqlalchemy.exc import OperationalError
+from app import db
+from app.models import User
+from app.ledger import debit, user_balance
+from app.money import to_minor, to_major
+from benchmarks.common import temporary_app
+
+
+def legacy_debit(client, user_id, amount):
+    # Прежний вариант: чтение колонки users.balance в Python, проверка и запись
+    user = db.session.get(User, user_id)
+    if user.balance < amount:
+        db.session.rollback()
+        return False
+    user.balance -= amount
+    db.session.commit()
+    return True
+
+
+def atomic_debit(client, user_id, amount):
+    # Условная вставка в журнал
+    ok = debit(user_id, amount)
+    db.session.commit()
+    return ok
+
+
+def endpoint_debit(client, user_id, amount):
+    response = client.post('/create_transaction', json={'user_id': user_id, 'amount': to_major(amount)})
+    if response.status_code not in (201, 422):
+        raise RuntimeError(response.get_data(as_text=True))
+    return response.status_code == 201
+
+
+MODES = {
+    'legacy': legacy_debit,
+    'atomic': atomic_debit,
+    'endpoint': endpoint_debit,
+}
+
+
+def run(mode, threads, ops, amount, balance):
+    app = temporary_app()
+    with app.app_context():
+        user = User(balance=balance, commission_rate=0.0)
+        db.session.add(user)
+        db.session.commit()
+        user_id = user.id
+
+    debit = MODES[mode]
+    barrier = threading.Barrier(threads + 1)
+    counters = {'successes': 0, 'errors': 0}
+    lock = threading.Lock()
+
+    def worker():
+        client = app.test_client()
+        successes = errors = 0
+        with app.app_context():
+            barrier.wait()
+            for _ in range(ops):
+                try:
+                    if debit(client, user_id, amount):
+                        successes += 1
+                except (OperationalError, RuntimeError):
+                    db.session.rollback()
+                    errors += 1
+        with lock:
+            counters['successes'] += successes
+            counters['errors'] += errors
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for thread in workers:
+        thread.start()
+    barrier.wait()
+    started = time.perf_counter()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    with app.app_context():
+        final_balance = db.session.get(User, user_id).balance if mode == 'legacy' else user_balance(user_id)
+    expected_balance = balance - counters['successes'] * amount
+    return {
+        'mode': mode,
+        'threads': threads,
+        'operations': threads * ops,
+        'successes': counters['successes'],
+        'errors': counters['errors'],
+        'final_balance': final_balance,
+        'expected_balance': expected_balance,
+        'exact': final_balance == expected_balance and final_balance >= 0,
+        'ops_per_sec': round(threads * ops / elapsed, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Concurrent debits of a single user: final balance and throughput.')
+    parser.add_argument('--mode', choices=sorted(MODES) + ['all'], default='all')
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--ops', type=int, default=200, help='Debits per thread')
+    parser.add_argument('--amount', type=to_minor, default='1')
+    parser.add_argument('--balance', type=to_minor, default=None,
+                        help='Starting balance (default: enough for half of the debits)')
+    args = parser.parse_args()
+
+    # Суммы - в минимальных единицах (app/money.py)
+    balance = args.balance if args.balance is not None else args.threads * args.ops * args.amount // 2
+    modes = sorted(MODES) if args.mode == 'all' else [args.mode]
+    for mode in modes:
+        print(json.dumps(run(mode, args.threads, args.ops, args.amount, balance)))
+
+
+if __name__ == '__main__':
+    main()
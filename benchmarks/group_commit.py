@@ -0,0 +1,70 @@
+import argparse
+import json
+import threading
+import time
+from app import db
+from app.models import User
+from app.money import to_minor
+from benchmarks.common import temporary_app
+
+
+def run(coalescing, threads, ops, window):
+    app = temporary_app(WRITE_COALESCING=coalescing, WRITE_COALESCE_WINDOW=window)
+    with app.app_context():
+        users = [User(balance=to_minor(10 ** 9), commission_rate=0.01) for _ in range(threads)]
+        db.session.add_all(users)
+        db.session.commit()
+        user_ids = [user.id for user in users]
+
+    barrier = threading.Barrier(threads + 1)
+    statuses = {}
+    lock = threading.Lock()
+
+    def worker(user_id):
+        client = app.test_client()
+        seen = {}
+        barrier.wait()
+        for _ in range(ops):
+            try:
+                code = client.post('/create_transaction', json={'user_id': user_id, 'amount': 1}).status_code
+            except Exception as e:
+                code = type(e).__name__
+            seen[code] = seen.get(code, 0) + 1
+        with lock:
+            for code, count in seen.items():
+                statuses[code] = statuses.get(code, 0) + count
+
+    workers = [threading.Thread(target=worker, args=(user_id,)) for user_id in user_ids]
+    for thread in workers:
+        thread.start()
+    barrier.wait()
+    started = time.perf_counter()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    coalescer = app.extensions.get('write_coalescer')
+    if coalescer is not None:
+        coalescer.stop()
+    return {
+        'coalescing': coalescing,
+        'threads': threads,
+        'requests': threads * ops,
+        'statuses': {str(code): count for code, count in statuses.items()},
+        'requests_per_sec': round(threads * ops / elapsed, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Write throughput of /create_transaction with and without group commit.')
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--ops', type=int, default=100, help='Requests per thread')
+    parser.add_argument('--window', type=float, default=0.002, help='Coalescing window in seconds')
+    args = parser.parse_args()
+
+    for coalescing in (False, True):
+        print(json.dumps(run(coalescing, args.threads, args.ops, args.window)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,356 @@
+import argparse
+import json
+import platform
+import random
+import sqlite3
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+from app import db
+from app.models import User, Transaction, TransactionStatus, DashboardStats, LedgerEntry
+from app.money import to_minor, commission_for
+from benchmarks.common import temporary_app
+
+SEED_CHUNK = 10000
+BATCH_ITEMS = 50
+# Эти пользователи удаляются сценарием delete_user, остальные сценарии их не трогают
+DELETABLE_SHARE = 0.05
+STATUS_WEIGHTS = {
+    TransactionStatus.PENDING: 30,
+    TransactionStatus.CONFIRMED: 50,
+    TransactionStatus.CANCELED: 15,
+    TransactionStatus.EXPIRED: 5,
+}
+
+
+def seed(app, users, transactions, rng):
+    now = datetime.utcnow()
+    with app.app_context():
+        db.session.execute(db.insert(User), [
+            {'balance': to_minor(round(rng.uniform(100, 10000), 2)), 'commission_rate': rng.choice([0.01, 0.02, 0.05])}
+            for _ in range(users)
+        ])
+        db.session.execute(LedgerEntry.open_accounts_statement())
+        statuses, weights = list(STATUS_WEIGHTS), list(STATUS_WEIGHTS.values())
+        for start in range(0, transactions, SEED_CHUNK):
+            rows = []
+            for _ in range(min(SEED_CHUNK, transactions - start)):
+                amount = to_minor(round(rng.uniform(1, 500), 2))
+                rows.append({
+                    'user_id': rng.randint(1, users),
+                    'amount': amount,
+                    'commission': commission_for(amount, 0.01),
+                    'status': rng.choices(statuses, weights)[0],
+                    'created_at': now - timedelta(seconds=rng.uniform(0, 30 * 24 * 3600)),
+                })
+            db.session.execute(db.insert(Transaction), rows)
+        db.session.add(DashboardStats(id=DashboardStats.ROW_ID, users_version=1, transactions_version=1,
+                                      changed_at=now, **DashboardStats.compute()))
+        db.session.commit()
+
+
+class Workload:
+    # Сценарии по одному на маршрут: (вес, функция(client, rng) -> HTTP-статус)
+    def __init__(self, users, transactions):
+        self.transactions = transactions
+        self.kept_users = max(1, int(users * (1 - DELETABLE_SHARE)))
+        self._deletable = list(range(self.kept_users + 1, users + 1))
+        self._lock = threading.Lock()
+        self.scenarios = {
+            'GET /': (10, self.dashboard),
+            'GET /dashboard/stream': (1, self.dashboard_stream),
+            'POST /set_refresh_interval': (1, self.set_refresh_interval),
+            'GET /users': (2, self.users_list),
+            'POST /users': (2, self.create_user),
+            'POST /users/<id>/delete': (1, self.delete_user),
+            'GET /transactions': (5, self.transactions_html),
+            'GET /transactions?format=json': (10, self.transactions_json),
+            'GET /transactions?format=ndjson': (5, self.transactions_ndjson),
+            'GET /transactions/<id>': (5, self.transaction_detail),
+            'POST /transactions/<id>': (3, self.update_status),
+            'POST /create_transaction': (15, self.create_transaction),
+            'POST /create_transactions': (2, self.create_transactions),
+            'POST /cancel_transaction': (5, self.cancel_transaction),
+            'GET /check_transaction': (30, self.check_transaction),
+            'GET /cache_stats': (1, self.cache_stats),
+        }
+
+    def select(self, names):
+        if names:
+            unknown = set(names) - set(self.scenarios)
+            if unknown:
+                raise SystemExit(f"Unknown endpoints: {', '.join(sorted(unknown))}")
+            self.scenarios = {name: self.scenarios[name] for name in names}
+
+    def user_id(self, rng):
+        return rng.randint(1, self.kept_users)
+
+    def transaction_id(self, rng):
+        return rng.randint(1, self.transactions)
+
+    def dashboard(self, client, rng):
+        return client.get('/').status_code
+
+    def dashboard_stream(self, client, rng):
+        # Время до первого события с итогами
+        response = client.get('/dashboard/stream', buffered=False)
+        try:
+            if response.status_code == 200:
+                for chunk in response.response:
+                    if (chunk if isinstance(chunk, str) else chunk.decode()).startswith('id:'):
+                        break
+            return response.status_code
+        finally:
+            response.close()
+
+    def set_refresh_interval(self, client, rng):
+        return client.post('/set_refresh_interval', json={'refresh_interval': rng.choice([10, 15, 30, 60])}).status_code
+
+    def users_list(self, client, rng):
+        return client.get('/users').status_code
+
+    def create_user(self, client, rng):
+        return client.post('/users', data={
+            'balance': round(rng.uniform(100, 10000), 2),
+            'commission_rate': 0.01,
+            'webhook_url': 'http://127.0.0.1:9/hook',
+        }).status_code
+
+    def delete_user(self, client, rng):
+        with self._lock:
+            user_id = self._deletable.pop() if self._deletable else self.kept_users + 1
+        return client.post(f'/users/{user_id}/delete').status_code
+
+    def transactions_html(self, client, rng):
+        return client.get(f'/transactions?user_id={self.user_id(rng)}').status_code
+
+    def transactions_json(self, client, rng):
+        status = rng.choice(['', '&status=pending', '&status=confirmed'])
+        return client.get(f'/transactions?format=json&limit=100{status}').status_code
+
+    def transactions_ndjson(self, client, rng):
+        return client.get(f'/transactions?format=ndjson&limit=500&user_id={self.user_id(rng)}').status_code
+
+    def transaction_detail(self, client, rng):
+        return client.get(f'/transactions/{self.transaction_id(rng)}').status_code
+
+    def update_status(self, client, rng):
+        return client.post(f'/transactions/{self.transaction_id(rng)}',
+                           data={'status': rng.choice(['confirmed', 'canceled'])}).status_code
+
+    def create_transaction(self, client, rng):
+        return client.post('/create_transaction', json={
+            'user_id': self.user_id(rng), 'amount': round(rng.uniform(1, 100), 2)
+        }).status_code
+
+    def create_transactions(self, client, rng):
+        return client.post('/create_transactions', json={'transactions': [
+            {'user_id': self.user_id(rng), 'amount': round(rng.uniform(1, 100), 2)} for _ in range(BATCH_ITEMS)
+        ]}).status_code
+
+    def cancel_transaction(self, client, rng):
+        return client.post('/cancel_transaction', json={'transaction_id': self.transaction_id(rng)}).status_code
+
+    def check_transaction(self, client, rng):
+        return client.get(f'/check_transaction?transaction_id={self.transaction_id(rng)}').status_code
+
+    def cache_stats(self, client, rng):
+        return client.get('/cache_stats').status_code
+
+
+def percentile(values, share):
+    # Ближайший ранг по отсортированному списку
+    if not values:
+        return None
+    return values[max(0, min(len(values) - 1, int(round(share * len(values))) - 1))]
+
+
+def summarize(latencies, statuses, elapsed):
+    latencies = sorted(latencies)
+    to_ms = lambda value: round(value * 1000, 3) if value is not None else None
+    return {
+        'requests': len(latencies),
+        'errors': sum(count for code, count in statuses.items() if not str(code).isdigit() or int(code) >= 500),
+        'statuses': {str(code): count for code, count in sorted(statuses.items(), key=lambda item: str(item[0]))},
+        'throughput': round(len(latencies) / elapsed, 2) if elapsed else None,
+        'mean_ms': to_ms(sum(latencies) / len(latencies)) if latencies else None,
+        'p50_ms': to_ms(percentile(latencies, 0.50)),
+        'p95_ms': to_ms(percentile(latencies, 0.95)),
+        'p99_ms': to_ms(percentile(latencies, 0.99)),
+        'max_ms': to_ms(latencies[-1] if latencies else None),
+    }
+
+
+def drive(app, workload, concurrency, duration, requests, seed_value, warmup):
+    names = list(workload.scenarios)
+    weights = [workload.scenarios[name][0] for name in names]
+    samples = {name: ([], {}) for name in names}
+    lock = threading.Lock()
+    issued = 0
+    barrier = threading.Barrier(concurrency + 1)
+    window = {}
+
+    def worker(index):
+        nonlocal issued
+        rng = random.Random(seed_value * 1000 + index)
+        client = app.test_client()
+        local = {name: ([], {}) for name in names}
+        barrier.wait()
+        while True:
+            now = time.perf_counter()
+            if now >= window['end']:
+                break
+            if requests:
+                with lock:
+                    if issued >= requests:
+                        break
+                    issued += 1
+            name = rng.choices(names, weights)[0]
+            started = time.perf_counter()
+            try:
+                code = workload.scenarios[name][1](client, rng)
+            except Exception as e:
+                code = type(e).__name__
+            finished = time.perf_counter()
+            # Запросы, начатые в прогреве, в статистику не входят
+            if started >= window['start']:
+                latencies, statuses = local[name]
+                latencies.append(finished - started)
+                statuses[code] = statuses.get(code, 0) + 1
+        with lock:
+            for name, (latencies, statuses) in local.items():
+                samples[name][0].extend(latencies)
+                for code, count in statuses.items():
+                    samples[name][1][code] = samples[name][1].get(code, 0) + count
+
+    threads = [threading.Thread(target=worker, args=(index,)) for index in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    started = time.perf_counter()
+    window['start'] = started + warmup
+    window['end'] = started + warmup + duration if duration else float('inf')
+    barrier.wait()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - window['start']
+
+    endpoints = {name: summarize(latencies, statuses, elapsed) for name, (latencies, statuses) in samples.items()}
+    all_statuses = {}
+    for _, statuses in samples.values():
+        for code, count in statuses.items():
+            all_statuses[code] = all_statuses.get(code, 0) + count
+    total = summarize([value for latencies, _ in samples.values() for value in latencies], all_statuses, elapsed)
+    return total, endpoints
+
+
+def run(args):
+    rng = random.Random(args.seed)
+    app = temporary_app(config_name=args.config, WEBHOOK_DISPATCHER_ENABLED=False,
+                        WRITE_COALESCING=args.write_coalescing)
+    seed(app, args.users, args.transactions, rng)
+    workload = Workload(args.users, args.transactions)
+    workload.select(args.endpoints)
+    total, endpoints = drive(app, workload, args.concurrency, args.duration, args.requests, args.seed, args.warmup)
+
+    coalescer = app.extensions.get('write_coalescer')
+    if coalescer is not None:
+        coalescer.stop()
+    return {
+        'meta': {
+            'started_at': datetime.utcnow().isoformat(),
+            'users': args.users,
+            'transactions': args.transactions,
+            'concurrency': args.concurrency,
+            'duration': args.duration,
+            'requests': args.requests,
+            'warmup': args.warmup,
+            'seed': args.seed,
+            'config': args.config,
+            'write_coalescing': args.write_coalescing,
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+        },
+        'total': total,
+        'endpoints': endpoints,
+    }
+
+
+def compare(baseline, candidate, threshold, min_ms):
+    # Регрессия: рост перцентиля или падение пропускной способности больше threshold (доля),
+    # для задержек - еще и больше min_ms по абсолютной величине, чтобы не ловить шум
+    report = {}
+    regressions = []
+    for name in sorted(set(baseline['endpoints']) | set(candidate['endpoints'])):
+        before = baseline['endpoints'].get(name)
+        after = candidate['endpoints'].get(name)
+        if not before or not after or not before['requests'] or not after['requests']:
+            report[name] = {'skipped': 'missing in one of the runs'}
+            continue
+        metrics = {}
+        for metric in ('p50_ms', 'p95_ms', 'p99_ms', 'throughput'):
+            old, new = before[metric], after[metric]
+            change = (new - old) / old if old else None
+            if metric == 'throughput':
+                regressed = change is not None and change < -threshold
+            else:
+                regressed = change is not None and change > threshold and new - old > min_ms
+            metrics[metric] = {'baseline': old, 'candidate': new,
+                               'change': round(change, 4) if change is not None else None, 'regressed': regressed}
+            if regressed:
+                regressions.append(f"{name} {metric}")
+        if after['errors'] > before['errors']:
+            metrics['errors'] = {'baseline': before['errors'], 'candidate': after['errors'], 'regressed': True}
+            regressions.append(f"{name} errors")
+        report[name] = metrics
+    return {'threshold': threshold, 'min_ms': min_ms, 'endpoints': report, 'regressions': regressions}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Mixed-workload load test of every route with per-endpoint latency.')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help='Seed a database, drive the workload, print JSON results')
+    run_parser.add_argument('--users', type=int, default=1000)
+    run_parser.add_argument('--transactions', type=int, default=100000)
+    run_parser.add_argument('--concurrency', type=int, default=16)
+    run_parser.add_argument('--duration', type=float, default=30.0, help='Measured seconds (0 - until --requests)')
+    run_parser.add_argument('--requests', type=int, default=0, help='Stop after this many requests (0 - no limit)')
+    run_parser.add_argument('--warmup', type=float, default=2.0, help='Seconds excluded from the statistics')
+    run_parser.add_argument('--seed', type=int, default=42)
+    run_parser.add_argument('--config', default='production', choices=['development', 'testing', 'production'])
+    run_parser.add_argument('--write-coalescing', action='store_true')
+    run_parser.add_argument('--endpoints', nargs='*', help='Only these scenarios, e.g. "GET /check_transaction"')
+    run_parser.add_argument('--output', help='Write the JSON here instead of stdout')
+
+    compare_parser = commands.add_parser('compare', help='Compare two result files, exit 1 on regressions')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('candidate')
+    compare_parser.add_argument('--threshold', type=float, default=0.10, help='Allowed relative change')
+    compare_parser.add_argument('--min-ms', type=float, default=1.0, help='Ignore latency changes below this')
+
+    args = parser.parse_args()
+    if args.command == 'run':
+        if not args.duration and not args.requests:
+            parser.error('set --duration or --requests')
+        result = json.dumps(run(args), indent=2)
+        if args.output:
+            with open(args.output, 'w') as file:
+                file.write(result + '\n')
+        else:
+            print(result)
+        return
+
+    with open(args.baseline) as file:
+        baseline = json.load(file)
+    with open(args.candidate) as file:
+        candidate = json.load(file)
+    report = compare(baseline, candidate, args.threshold, args.min_ms)
+    print(json.dumps(report, indent=2))
+    if report['regressions']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+import argparse
+import json
+import random
+import time
+from app.models import PricingMode
+from app.pricing import Schedule, PricingEngine, np
+
+SCHEDULES = [
+    Schedule(PricingMode.TIERED, [(0, 0.02), (100000, 0.015), (1000000, 0.01), (10000000, 0.005)]),
+    Schedule(PricingMode.VOLUME, [(0, 0.025), (50000, 0.02), (500000, 0.012)]),
+]
+
+
+def engine_for(users, seed):
+    # Треть пользователей на сетках, остальные - с плоскими ставками из небольшого набора
+    rng = random.Random(seed)
+    schedules = {}
+    for user_id in range(1, users + 1):
+        if user_id % 3 == 0:
+            schedules[user_id] = SCHEDULES[user_id % 2]
+        else:
+            schedules[user_id] = Schedule.flat(rng.choice((0.0, 0.005, 0.01, 0.015, 0.02)))
+    return PricingEngine(schedules)
+
+
+def run(engine, user_ids, amounts, vectorized, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        commissions = engine.price(user_ids, amounts, vectorized=vectorized)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return commissions, {
+        'path': 'numpy' if vectorized else 'python',
+        'rows': len(amounts),
+        'seconds': round(best, 3),
+        'rows_per_sec': round(len(amounts) / best),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Batch commission pricing: NumPy path vs per-row Python loop.')
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    engine = engine_for(args.users, args.seed)
+    rng = random.Random(args.seed)
+    user_ids = [rng.randint(1, args.users) for _ in range(args.rows)]
+    # Суммы в минимальных единицах от 0.01 до 200000.00 - попадают во все ступени
+    amounts = [int(rng.lognormvariate(10, 2.5)) % 20000000 + 1 for _ in range(args.rows)]
+
+    expected, result = run(engine, user_ids, amounts, False, args.repeat)
+    print(json.dumps(result))
+    if np is None:
+        print(json.dumps({'path': 'numpy', 'skipped': 'numpy is not installed'}))
+        return
+    commissions, result = run(engine, user_ids, amounts, True, args.repeat)
+    # Оба пути обязаны давать одни и те же комиссии до минимальной единицы
+    result['matches_python'] = commissions == expected
+    print(json.dumps(result))
+
+
+if __name__ == '__main__':
+    main()
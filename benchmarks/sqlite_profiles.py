@@ -0,0 +1,97 @@
+import argparse
+import json
+import random
+import threading
+import time
+from app import db
+from app.models import User, Transaction, LedgerEntry
+from app.money import to_minor
+from benchmarks.common import temporary_app
+
+# testing - те же настройки движка, что были до появления профилей (без PRAGMA, пул по умолчанию)
+PROFILES = ['testing', 'production']
+
+
+def seed(app, users, transactions):
+    with app.app_context():
+        db.session.execute(db.insert(User), [{'balance': to_minor(10 ** 9), 'commission_rate': 0.01} for _ in range(users)])
+        db.session.execute(LedgerEntry.open_accounts_statement())
+        db.session.execute(db.insert(Transaction), [
+            {'amount': to_minor(1), 'commission': to_minor('0.01'), 'user_id': random.randint(1, users)} for _ in range(transactions)
+        ])
+        db.session.commit()
+
+
+def run(profile, readers, writers, duration, users, transactions):
+    app = temporary_app(config_name=profile)
+    seed(app, users, transactions)
+
+    counters = {'reads': 0, 'writes': 0, 'errors': 0}
+    lock = threading.Lock()
+    stop = threading.Event()
+
+    def reader():
+        client = app.test_client()
+        done = errors = 0
+        while not stop.is_set():
+            response = client.get(f'/check_transaction?transaction_id={random.randint(1, transactions)}')
+            if response.status_code == 200:
+                done += 1
+            else:
+                errors += 1
+        with lock:
+            counters['reads'] += done
+            counters['errors'] += errors
+
+    def writer():
+        client = app.test_client()
+        done = errors = 0
+        while not stop.is_set():
+            try:
+                response = client.post('/create_transaction',
+                                       json={'user_id': random.randint(1, users), 'amount': 1})
+                ok = response.status_code == 201
+            except Exception:
+                ok = False
+            if ok:
+                done += 1
+            else:
+                errors += 1
+        with lock:
+            counters['writes'] += done
+            counters['errors'] += errors
+
+    threads = [threading.Thread(target=reader) for _ in range(readers)]
+    threads += [threading.Thread(target=writer) for _ in range(writers)]
+    for thread in threads:
+        thread.start()
+    time.sleep(duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    return {
+        'profile': profile,
+        'readers': readers,
+        'writers': writers,
+        'reads_per_sec': round(counters['reads'] / duration, 1),
+        'writes_per_sec': round(counters['writes'] / duration, 1),
+        'errors': counters['errors'],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Mixed read/write throughput of the SQLite engine profiles.')
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--writers', type=int, default=4)
+    parser.add_argument('--duration', type=float, default=10.0, help='Seconds per profile')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--transactions', type=int, default=100000)
+    args = parser.parse_args()
+
+    for profile in PROFILES:
+        print(json.dumps(run(profile, args.readers, args.writers, args.duration, args.users, args.transactions)))
+
+
+if __name__ == '__main__':
+    main()
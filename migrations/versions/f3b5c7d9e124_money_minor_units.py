@@ -0,0 +1,51 @@
+"""Store money as integer minor units
+
+Revision ID: f3b5c7d9e124
+Revises: e2a4b6c8d013
+Create Date: 2026-10-18 16:40:12.318904
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from flask import current_app
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3b5c7d9e124'
+down_revision = 'e2a4b6c8d013'
+branch_labels = None
+depends_on = None
+
+MONEY_COLUMNS = (
+    ('users', ('balance',)),
+    ('transactions', ('amount', 'commission')),
+    ('dashboard_stats', ('total_transaction_amount',)),
+)
+
+
+def upgrade():
+    factor = 10 ** current_app.config['MONEY_SCALE']
+    # Сначала значения, потом тип: ROUND убирает хвосты двоичной дроби (0.1 * 100 = 10.000000000000002).
+    # Доли минимальной единицы (комиссии вида 0.123) округляются до нее
+    for table, columns in MONEY_COLUMNS[:2]:
+        op.execute(f"UPDATE {table} SET " + ', '.join(f"{column} = ROUND({column} * {factor})" for column in columns))
+
+    for table, columns in MONEY_COLUMNS:
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            for column in columns:
+                batch_op.alter_column(column, existing_type=sa.Float(), type_=sa.BigInteger(),
+                                      existing_nullable=False, postgresql_using=f'{column}::bigint')
+
+    # Накопленная во float сумма могла уплыть - пересчитываем точно по уже целым суммам
+    op.execute("UPDATE dashboard_stats SET total_transaction_amount = "
+               "(SELECT COALESCE(SUM(amount), 0) FROM transactions)")
+
+
+def downgrade():
+    factor = 10 ** current_app.config['MONEY_SCALE']
+    for table, columns in MONEY_COLUMNS:
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            for column in columns:
+                batch_op.alter_column(column, existing_type=sa.BigInteger(), type_=sa.Float(),
+                                      existing_nullable=False)
+        op.execute(f"UPDATE {table} SET " + ', '.join(f"{column} = {column} * 1.0 / {factor}" for column in columns))